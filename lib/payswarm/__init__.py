@@ -11,14 +11,22 @@ import urlparse
 from Crypto.PublicKey import RSA
 import pyld.jsonld as jsonld
 
+# the core client modules; the command line plugins and tools (audit,
+# daemon, loadtest, mock, publish, search, ...) are imported when used
+import codec
 import config
 import constants
+import frames
+import keys
 import purchase
+import revocation
 import signature
 import storage
 import util
 
-__all__ = ['config', 'jsonld', 'purchase', 'signature', 'storage', 'util']
+__all__ = [
+    'codec', 'config', 'frames', 'jsonld', 'keys', 'purchase', 'revocation',
+    'signature', 'storage', 'util']
 
 class ConfigException(Exception):
     """The class of exceptions used for configuration errors."""
@@ -52,6 +60,7 @@ class PaySwarmClient(object):
         """
         self.config = {}
         self.config['@context'] = constants.CONTEXT_URL
+        self.web_keys_config = None
 
     def _get_config_filename(self, config_name):
         base = os.path.expanduser('~')
@@ -171,10 +180,14 @@ class PaySwarmClient(object):
         
         authority - the PaySwarm Authority URL to use when discovering the 
             Web Keys config.
+
+        The config is fetched through the discovery cache, so repeated
+        loads do not contact the authority until the cache expires.
         """
-        
-        # FIXME: Implement this function
-        pass
+        self.config['authority'] = authority
+        self.web_keys_config = discovery.get_config(
+            urlparse.urljoin(authority, 'client-config'))
+        return self.web_keys_config
     
     def get_registration_url(self):
         """Returns the Web Keys registration URL."""
@@ -0,0 +1,203 @@
+"""The audit module checks published listings against their assets.
+
+A listing's "assetHash" is util.hash() of the signed asset it was created
+for. An audit streams assets and listings, hashes every distinct asset once
+across a process pool and joins listings to assets by their "asset" id,
+reporting listings whose asset hash no longer matches, listings whose asset
+is missing and listings that are no longer valid.
+"""
+from __future__ import with_statement
+
+from multiprocessing import Pool
+import collections
+import datetime
+import hashlib
+import json
+import time
+
+import codec
+import signature
+import util
+
+# number of assets sent to a worker process at a time
+CHUNK_SIZE = 16
+
+
+def _types(item):
+    types = item.get('type', [])
+    if not isinstance(types, list):
+        types = [types]
+    return types
+
+
+def content_digest(item):
+    """Returns a digest of an item's JSON content.
+
+    Identical assets share a digest, so their hash is only computed once.
+    """
+    data = codec.canonical_dumps(item)
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def _hash_asset(job):
+    """Hashes one asset in a worker process."""
+    digest, asset = job
+    try:
+        return digest, util.hash(asset), None
+    except Exception, e:
+        return digest, None, str(e)
+
+
+class Report(object):
+    """The results of an audit."""
+
+    def __init__(self):
+        self.assets = 0
+        self.listings = 0
+        # number of asset hashes computed and served from the cache
+        self.hashed = 0
+        self.cached = 0
+        # (listing id, asset id, listing assetHash, computed hash)
+        self.mismatches = []
+        # (listing id, asset id)
+        self.missing = []
+        # (listing id, validUntil)
+        self.expired = []
+        # (item id, message)
+        self.errors = []
+        self.seconds = 0.0
+
+    @property
+    def ok(self):
+        """Whether the audit found no problems."""
+        return not (self.mismatches or self.missing or self.expired or
+            self.errors)
+
+    def throughput(self):
+        """Returns the number of items audited per second."""
+        return (self.assets + self.listings) / max(self.seconds, 1e-6)
+
+
+def audit(items, jobs=1, cache=None, now=None):
+    """Audits a stream of assets and listings.
+
+    items - an iterable of signed assets and listings.
+    jobs - the number of worker processes used to hash assets.
+    cache - a dict of asset hashes keyed by content_digest(), used and
+        updated by the audit (optional).
+    now - the time listings must be valid at (default: the current time).
+
+    Returns a Report.
+    """
+    report = Report()
+    start = time.time()
+    now = now or datetime.datetime.utcnow()
+    cache = {} if cache is None else cache
+    # content digest keyed by asset id
+    assets = {}
+    # (listing id, asset id, assetHash) for every listing
+    listings = []
+    pending = set()
+    failed = {}
+
+    def _record(results):
+        for digest, asset_hash, error in results:
+            report.hashed += 1
+            if error is not None:
+                failed[digest] = error
+            else:
+                cache[digest] = asset_hash
+
+    pool = None
+    if jobs > 1:
+        pool = Pool(jobs)
+    # assets waiting to be sent to the pool and batches being hashed; the
+    # pool only sees these lists, all bookkeeping stays in this thread
+    batch = []
+    in_flight = collections.deque()
+    try:
+        for item in items:
+            # only small references are kept, never whole documents
+            types = _types(item)
+            if 'Listing' in types:
+                report.listings += 1
+                asset = item.get('asset')
+                if isinstance(asset, dict):
+                    asset = asset.get('id')
+                listings.append(
+                    (item.get('id'), asset, item.get('assetHash')))
+                _check_validity(report, item, now)
+            elif 'Asset' in types:
+                report.assets += 1
+                digest = content_digest(item)
+                assets[item.get('id')] = digest
+                if digest in cache or digest in pending:
+                    report.cached += 1
+                    continue
+                pending.add(digest)
+                if pool is None:
+                    _record([_hash_asset((digest, item))])
+                    continue
+                batch.append((digest, item))
+                if len(batch) >= CHUNK_SIZE * jobs:
+                    in_flight.append(
+                        pool.map_async(_hash_asset, batch, CHUNK_SIZE))
+                    batch = []
+                    # bound the number of documents held for hashing
+                    while len(in_flight) > 2:
+                        _record(in_flight.popleft().get())
+        if batch:
+            in_flight.append(pool.map_async(_hash_asset, batch, CHUNK_SIZE))
+        while in_flight:
+            _record(in_flight.popleft().get())
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    for asset_id, digest in assets.iteritems():
+        if digest in failed:
+            report.errors.append((asset_id, failed[digest]))
+
+    for listing_id, asset_id, asset_hash in listings:
+        digest = assets.get(asset_id)
+        if digest is None:
+            report.missing.append((listing_id, asset_id))
+        elif digest in cache and cache[digest] != asset_hash:
+            report.mismatches.append(
+                (listing_id, asset_id, asset_hash, cache[digest]))
+
+    report.seconds = time.time() - start
+    return report
+
+
+def _check_validity(report, listing, now):
+    valid_until = listing.get('validUntil')
+    if valid_until is None:
+        return
+    try:
+        expires = datetime.datetime.strptime(
+            valid_until, signature.W3C_DATE_FORMAT)
+    except ValueError:
+        report.errors.append((listing.get('id'),
+            'Invalid validUntil "%s".' % valid_until))
+        return
+    if expires < now:
+        report.expired.append((listing.get('id'), valid_until))
+
+
+def load_cache(path):
+    """Loads an asset hash cache written by save_cache, or an empty one."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_cache(path, cache):
+    """Writes an asset hash cache."""
+    with open(path, 'w') as f:
+        json.dump(cache, f, sort_keys=True, separators=(',', ':'))
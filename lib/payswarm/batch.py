@@ -0,0 +1,167 @@
+"""The batch plugin runs a stream of PaySwarm commands in one process.
+
+Commands are read as JSON Lines using the same request format as the
+daemon and results are written as JSON Lines in input order:
+
+    {"id": 1, "method": "sign", "params": {"jsonld": {...}}}
+    {"id": 2, "method": "verify", "params": {"jsonld": {...}}}
+    {"id": 3, "method": "hash", "params": {"jsonld": {...}}}
+    {"id": 4, "method": "register",
+     "params": {"asset": {...}, "listing": {...}}}
+    {"id": 5, "method": "fetch", "params": {"id": "{ITEM_ID}"}}
+
+sign uses the session config key unless "publicKeyId" and "privateKeyPem"
+params are given. Config, keys and HTTP connections stay loaded for the
+whole stream. With --dedup, an asset registered again with unchanged
+content reuses the signed asset from an earlier command or run (see
+payswarm.storage.SignedStore).
+"""
+from __future__ import with_statement
+
+from multiprocessing.pool import ThreadPool
+import sys
+
+import codec
+import config
+import constants
+import daemon
+import signature
+import storage
+import util
+
+
+class Runner(object):
+    """Runs batch commands against a single loaded configuration."""
+
+    def __init__(self, session, listings_url=constants.DEFAULT_LISTINGS_URL,
+            store=None):
+        """Creates a new runner.
+
+        session - the session config providing the signing key and account
+            information.
+        listings_url - the listing service URL used by register and fetch.
+        store - the storage.SignedStore register reuses signed assets from
+            (optional).
+        """
+        self.session = session
+        self.store = store
+        self.sections = config.storage_config(session, listings_url)
+        self.methods = dict(daemon.METHODS)
+        self.methods.update({
+            'sign': self._sign,
+            'register': self._register,
+            'fetch': self._fetch
+        })
+
+    def _sign(self, params):
+        public_key = self.session.get('publicKey', {})
+        return signature.sign(params['jsonld'],
+            params.get('publicKeyId', public_key.get('id')),
+            params.get('privateKeyPem', public_key.get('privateKeyPem')),
+            params.get('nonce'), params.get('created'))
+
+    def _register(self, params):
+        signed_asset = storage.register_asset(self.sections, params['asset'],
+            store=self.store)
+        signed_listing = storage.register_listing(
+            self.sections, signed_asset, params['listing'])
+        return {'asset': signed_asset, 'listing': signed_listing}
+
+    def _fetch(self, params):
+        return storage.fetch(self.sections, params)
+
+    def run_line(self, line):
+        """Runs one JSON-encoded command and returns the response object."""
+        return daemon.dispatch(line, self.methods)
+
+    def run(self, lines, out, jobs=1):
+        """Runs a stream of commands.
+
+        lines - an iterable of JSON-encoded commands.
+        out - the stream to write JSON-encoded responses to.
+        jobs - the number of commands to run in parallel. Responses are
+            always written in input order.
+
+        Returns the number of failed commands.
+        """
+        lines = (line for line in lines if line.strip())
+        pool = None
+        if jobs > 1:
+            pool = ThreadPool(jobs)
+            responses = pool.imap(self.run_line, lines)
+        else:
+            responses = (self.run_line(line) for line in lines)
+
+        errors = 0
+        try:
+            for response in responses:
+                if 'error' in response:
+                    errors += 1
+                out.write(codec.dumps(response) + '\n')
+                out.flush()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return errors
+
+
+class Batch(util.Plugin):
+    """Plugin to run a stream of commands from a JSON Lines file."""
+
+    def __init__(self, config_plugin):
+        """Creates the plugin.
+
+        config_plugin - the plugin holding the session config.
+        """
+        self.config_plugin = config_plugin
+
+    def get_name(self):
+        return "Batch"
+
+    def before_args_parsed(self, parser, subparsers):
+        subparser = subparsers.add_parser('batch',
+                help='Run JSON Lines commands from a file or stdin.')
+        subparser.add_argument('file', nargs='?', default='-',
+                help='The JSON Lines command file, - for stdin. '
+                '(default: %(default)s)')
+        subparser.add_argument('-o', '--output', default='-',
+                help='The JSON Lines result file, - for stdout. '
+                '(default: %(default)s)')
+        subparser.add_argument('-j', '--jobs', type=int, default=1,
+                help='The number of commands to run in parallel. '
+                '(default: %(default)s)')
+        subparser.add_argument('--listings-url',
+                default=constants.DEFAULT_LISTINGS_URL,
+                help='URL for the Web Service that stores assets and '
+                'listings. (default: %(default)s)')
+        subparser.add_argument('--dedup', action='store_true',
+                help='Reuse assets already signed and uploaded with the same '
+                'content instead of registering them again.')
+        subparser.set_defaults(func=self.run)
+
+    def after_args_parsed(self, args):
+        pass
+
+    def run(self, args):
+        store = None
+        if args.dedup:
+            store = storage.SignedStore(storage.default_signed_store_path())
+        runner = Runner(self.config_plugin.config, args.listings_url, store)
+        source = sys.stdin
+        out = sys.stdout
+        try:
+            if args.file != '-':
+                source = open(args.file)
+            if args.output != '-':
+                out = open(args.output, 'w')
+            errors = runner.run(source, out, args.jobs)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if out is not sys.stdout:
+                out.close()
+            if store is not None:
+                store.close()
+        if errors:
+            sys.exit(1)
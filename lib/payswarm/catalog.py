@@ -0,0 +1,253 @@
+"""The catalog module reads and writes signed catalog archives.
+
+A catalog archive stores signed assets and listings as individually
+addressable records so a single item can be looked up without parsing the
+rest of the catalog:
+
+    header:  magic (8 bytes), index offset (uint64), record count (uint32),
+             index entry count (uint32)
+    records: data length (uint32), SHA-256 of data (32 bytes),
+             data (compact JSON, UTF-8)
+    keys:    key length (uint16), key (UTF-8) ...
+    index:   key offset (uint64), record offset (uint64) ...
+
+All integers are big-endian. Index entries are sorted by key. Every record
+is indexed by its "id" and listings are also indexed by their "assetHash",
+so a lookup by assetHash returns the listings for that asset.
+"""
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+
+import codec
+
+MAGIC = 'PSCATv1\n'
+
+_HEADER = struct.Struct('>8sQII')
+_RECORD = struct.Struct('>I32s')
+_KEY = struct.Struct('>H')
+_ENTRY = struct.Struct('>QQ')
+
+
+def _keys(item):
+    """Returns the index keys for an asset or listing."""
+    keys = [item['id']]
+    if 'assetHash' in item:
+        keys.append(item['assetHash'])
+    return [key.encode('utf-8') for key in keys]
+
+
+class CatalogWriter(object):
+    """Streams signed assets and listings into a catalog archive.
+
+    Records are written as they are added; only the index keys are kept in
+    memory until the archive is closed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(MAGIC, 0, 0, 0))
+        self._entries = []
+        self.count = 0
+
+    def add(self, item):
+        """Appends a signed asset or listing to the archive.
+
+        item - the JSON-LD object to store. It must have an "id".
+        """
+        data = codec.canonical_dumps(item)
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        offset = self._file.tell()
+        self._file.write(_RECORD.pack(len(data), hashlib.sha256(data).digest()))
+        self._file.write(data)
+        for key in _keys(item):
+            self._entries.append((key, offset))
+        self.count += 1
+
+    def close(self):
+        """Writes the index and header and closes the archive."""
+        if self._file is None:
+            return
+        self._entries.sort()
+        key_offsets = []
+        for key, offset in self._entries:
+            key_offsets.append(self._file.tell())
+            self._file.write(_KEY.pack(len(key)))
+            self._file.write(key)
+        index_offset = self._file.tell()
+        for key_offset, (key, offset) in zip(key_offsets, self._entries):
+            self._file.write(_ENTRY.pack(key_offset, offset))
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(
+            MAGIC, index_offset, self.count, len(self._entries)))
+        self._file.close()
+        self._file = None
+
+    def discard(self):
+        """Closes and removes an unfinished archive."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.unlink(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        # an archive without its index must not look complete
+        if type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class _Keys(object):
+    """Sequence view of the sorted index keys for bisect."""
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+
+    def __len__(self):
+        return self._catalog.index_count
+
+    def __getitem__(self, i):
+        return self._catalog._key(i)
+
+
+class CatalogReader(object):
+    """Reads a catalog archive through a read-only memory map."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        # an empty file cannot be mapped
+        if os.fstat(self._file.fileno()).st_size < _HEADER.size:
+            self._file.close()
+            raise Exception('Catalog archive is truncated: %s' % path)
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.index_offset, self.record_count, self.index_count = \
+            _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise Exception('Not a catalog archive: %s' % path)
+
+    def close(self):
+        """Closes the archive."""
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _entry(self, i):
+        return _ENTRY.unpack_from(self._map, self.index_offset + i * _ENTRY.size)
+
+    def _key(self, i):
+        key_offset = self._entry(i)[0]
+        length = _KEY.unpack_from(self._map, key_offset)[0]
+        start = key_offset + _KEY.size
+        return self._map[start:start + length]
+
+    def _record(self, offset):
+        """Returns the raw data and stored digest of the record at offset."""
+        length, digest = _RECORD.unpack_from(self._map, offset)
+        start = offset + _RECORD.size
+        return self._map[start:start + length], digest
+
+    def read(self, offset):
+        """Reads and verifies the record at the given offset.
+
+        offset - the file offset of the record.
+
+        Returns the stored JSON-LD object.
+        """
+        data, digest = self._record(offset)
+        if hashlib.sha256(data).digest() != digest:
+            raise Exception(
+                'Catalog record at offset %d is corrupt.' % offset)
+        return codec.loads(data)
+
+    def find(self, key):
+        """Finds all records indexed under the given id or assetHash.
+
+        key - the listing/asset id or assetHash to look up.
+
+        Returns a list of JSON-LD objects.
+        """
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        i = bisect.bisect_left(_Keys(self), key)
+        rval = []
+        while i < self.index_count and self._key(i) == key:
+            rval.append(self.read(self._entry(i)[1]))
+            i += 1
+        return rval
+
+    def get(self, key):
+        """Returns the first record indexed under key or None."""
+        items = self.find(key)
+        return items[0] if items else None
+
+    def __iter__(self):
+        """Iterates over all records in the order they were written."""
+        offset = _HEADER.size
+        for i in range(self.record_count):
+            yield self.read(offset)
+            offset += _RECORD.size + _RECORD.unpack_from(self._map, offset)[0]
+
+    def check(self):
+        """Checks the integrity of the whole archive.
+
+        Returns a list of problem descriptions, which is empty if the
+        archive is intact.
+        """
+        problems = []
+        offsets = set()
+        offset = _HEADER.size
+        for i in range(self.record_count):
+            if offset + _RECORD.size > self.index_offset:
+                problems.append('Record %d is truncated.' % i)
+                return problems
+            data, digest = self._record(offset)
+            if hashlib.sha256(data).digest() != digest:
+                problems.append(
+                    'Record %d at offset %d has a bad hash.' % (i, offset))
+            offsets.add(offset)
+            offset += _RECORD.size + len(data)
+
+        end = self.index_offset + self.index_count * _ENTRY.size
+        if end != len(self._map):
+            problems.append('Index size does not match the archive size.')
+            return problems
+        previous = None
+        for i in range(self.index_count):
+            key = self._key(i)
+            offset = self._entry(i)[1]
+            if offset not in offsets:
+                problems.append(
+                    'Index key "%s" points to an invalid record.' % key)
+            if previous is not None and key < previous:
+                problems.append('Index key "%s" is out of order.' % key)
+            previous = key
+        return problems
+
+
+def write(path, items):
+    """Writes an iterable of signed assets and listings to a catalog archive.
+
+    path - the archive file path.
+    items - the JSON-LD objects to store.
+
+    Returns the number of records written.
+    """
+    with CatalogWriter(path) as writer:
+        for item in items:
+            writer.add(item)
+        return writer.count
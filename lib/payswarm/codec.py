@@ -0,0 +1,118 @@
+"""The codec module parses and serializes JSON with the fastest backend.
+
+Parsing and serializing use simplejson if it is installed and the
+standard json module otherwise. simplejson produces the same output as the
+json module for the same options and parses to equal objects, except that
+it returns str rather than unicode for ASCII strings, so parsed strings
+must be tested with basestring.
+
+ujson is faster but is only used when chosen explicitly, and only to
+parse trusted input: it does not parse every document as json does (a
+lone surrogate such as "\ud800" becomes an empty string, integers above
+2**64 are rejected), so a signed document parsed with it could fail to
+verify or be silently altered. Documents it rejects are parsed again with
+json. It is never used to serialize because its output differs (it
+escapes "/" and formats floats differently).
+
+Content whose bytes are hashed or signed (digests, cache keys, catalog
+records) must not depend on which packages are installed, so it is
+serialized with canonical_dumps, which always uses the json module.
+
+The backend can be chosen explicitly, for example to compare them:
+
+    payswarm.codec.set_backend('json')
+"""
+import json
+
+# loads and dumps functions keyed by backend name, for installed backends
+BACKENDS = {'json': (json.loads, json.dumps)}
+
+# backends chosen by default, fastest first; they must parse to objects
+# equal to json's and serialize exactly as json does
+PREFERENCE = ['simplejson', 'json']
+
+try:
+    import simplejson
+    BACKENDS['simplejson'] = (simplejson.loads, simplejson.dumps)
+except ImportError:
+    pass
+
+try:
+    import ujson
+
+    # ujson 1.x rounds floats unless asked not to
+    try:
+        ujson.loads('0', precise_float=True)
+        _ujson_options = {'precise_float': True}
+    except TypeError:
+        _ujson_options = {}
+
+    def _ujson_loads(data):
+        try:
+            return ujson.loads(data, **_ujson_options)
+        except (ValueError, OverflowError):
+            # such as integers too big for ujson
+            return json.loads(data)
+
+    # serialization uses the first backend in PREFERENCE
+    BACKENDS['ujson'] = (_ujson_loads, None)
+except ImportError:
+    pass
+
+# the name of the backend used by loads and by dumps
+backend = None
+dumps_backend = None
+
+_loads = json.loads
+_dumps = json.dumps
+
+
+def set_backend(name=None):
+    """Chooses the JSON backend.
+
+    name - 'ujson', 'simplejson' or 'json', None for the fastest installed.
+
+    Serialization uses the first backend from name onward in PREFERENCE
+    that can serialize, or the first in PREFERENCE for other backends.
+    """
+    global backend, dumps_backend, _loads, _dumps
+    if name is None:
+        name = [n for n in PREFERENCE if n in BACKENDS][0]
+    if name not in BACKENDS:
+        raise Exception('JSON backend "%s" is not installed.' % name)
+    backend = name
+    _loads = BACKENDS[name][0]
+    start = PREFERENCE.index(name) if name in PREFERENCE else 0
+    for dumps_name in PREFERENCE[start:]:
+        if dumps_name in BACKENDS and BACKENDS[dumps_name][1] is not None:
+            dumps_backend = dumps_name
+            _dumps = BACKENDS[dumps_name][1]
+            break
+
+
+def loads(data):
+    """Parses a JSON string."""
+    return _loads(data)
+
+
+def load(f):
+    """Parses the JSON in a file object."""
+    return _loads(f.read())
+
+
+def dumps(obj, sort_keys=False, separators=None, indent=None):
+    """Serializes an object to JSON, as json.dumps would."""
+    if separators is None:
+        # simplejson drops the space after "," when indenting, json does not
+        separators = (', ', ': ')
+    return _dumps(obj, sort_keys=sort_keys, separators=separators,
+        indent=indent)
+
+
+def canonical_dumps(obj):
+    """Serializes an object to compact JSON with sorted keys using the json
+    module, for content that is hashed or signed."""
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+
+set_backend()
@@ -1,11 +1,11 @@
 """The PaySwarm configuration module is used to read/write configs."""
 from __future__ import with_statement
 
-import json
 import logging
 import os
 
-from .util import Plugin
+from . import codec
+from .util import Plugin, config_dir
 from pyld.jsonld import JsonLdProcessor as JsonLdProcessor
 
 """
@@ -74,11 +74,11 @@ class Config(dict):
         if clear:
             self.clear()
         with open(path) as config:
-            self.update(json.load(config))
+            self.update(codec.load(config))
 
     def save(self, path):
         with open(path, 'w') as config:
-            config.write(json.dumps(self))
+            config.write(codec.dumps(self))
 
 
 class Files(Plugin):
@@ -88,8 +88,7 @@ class Files(Plugin):
         # top level config dir
         self.default_config_dir = \
                 os.path.join(os.path.expanduser('~'), '.config', 'payswarm1')
-        self.config_dir = \
-                os.environ.get('PAYSWARM_CONFIG_DIR', self.default_config_dir)
+        self.config_dir = config_dir()
 
         # main config file path
         self.default_main_config_path = \
@@ -144,11 +143,21 @@ class Files(Plugin):
         pass
 
 
+from ConfigParser import ConfigParser, RawConfigParser
 from Crypto.PublicKey import RSA
-import json
 import os.path
 import urllib2
 
+import constants
+import discovery
+from discovery import PSW_REQUEST, PSW_AUTHORIZE, PSW_TOKENS, \
+    PSW_PREFERENCES, PSW_CONTRACTS, PSW_LICENSES, PSW_KEYS
+
+# PaySwarm preferences vocabulary
+PS_ACCOUNT = 'https://w3id.org/commerce#account'
+PSP_LICENSE = 'https://w3id.org/payswarm#license'
+PS_LICENSE_HASH = 'https://w3id.org/payswarm#licenseHash'
+
 
 
 def _update_config(defaults, config, options, section, name):
@@ -222,14 +231,15 @@ def set_basic_endpoints(config):
         config under the [general] section 'authorize-url', 
         'request-url', and 'tokens-url'.
 
+    The client config is served from the discovery cache when possible.
+
     Throws an exception if the retrieval was a failure."""
 
     # Create the client-config read request
     config_url = config.get("general", "config-url")
 
-    # Read the basic client configuration parameters from the URL
-    data = urllib2.urlopen(config_url)
-    aconfig = json.loads(data.read())
+    # Read the basic client configuration parameters from the URL (cached)
+    aconfig = discovery.get_config(config_url)
 
     # Extract the information from the authority configuration
     for key, value in aconfig.items():
@@ -250,8 +260,10 @@ def set_application_endpoints(client, config):
     """
     # Retrieve the application endpoints
     authority_url = config.get("general", "config-url")
-    endpoints = client.call( \
-        authority_url, "Failed to retrieve application endpoints.")
+    endpoints = discovery.get_config(authority_url,
+        lambda url: client.call(
+            url, "Failed to retrieve application endpoints."),
+        "application:" + authority_url)
 
     # Extract the information from the authority configuration
     for key, value in endpoints.items():
@@ -280,8 +292,10 @@ def set_application_preferences(client, config):
     """
     # Retrieve the application endpoints
     preferences_url = config.get("application", "preferences-url")
-    preferences = client.call( \
-        preferences_url, "Failed to retrieve application endpoints.")
+    preferences = discovery.get_config(preferences_url,
+        lambda url: client.call(
+            url, "Failed to retrieve application preferences."),
+        "application:" + preferences_url)
 
     # Extract the information from the authority configuration
     for key, value in preferences.items():
@@ -315,3 +329,34 @@ def generate_keys(config):
     # save the key data into the configuration file
     config.set("application", "private-key", private_pem)
     config.set("application", "public-key", public_pem)
+
+def storage_config(config, listings_url):
+    """Builds the section-based configuration used by the storage module.
+
+    config - the session config (see Files) to read the authority, owner,
+        financial account and keys from.
+    listings_url - the URL of the listing service.
+
+    Returns a RawConfigParser with the [general] and [application] options
+    read by payswarm.storage.
+    """
+    authority = config.get("authority", "")
+    owner = config.get("owner", "")
+    public_key = config.get("publicKey", {})
+
+    sections = RawConfigParser()
+    sections.add_section("general")
+    sections.add_section("application")
+    sections.set("general", "authority-url", authority)
+    sections.set("general", "config-url", authority + "client-config")
+    sections.set("general", "listings-url", listings_url)
+    sections.set("application", "preferences-url", owner + "/preferences")
+    sections.set("application", "financial-account", config.get("source", ""))
+    sections.set("application", "default-license",
+        constants.DEFAULT_LICENSE_URL)
+    sections.set("application", "default-license-hash",
+        constants.DEFAULT_LICENSE_HASH)
+    sections.set("application", "public-key-id", public_key.get("id", ""))
+    sections.set("application", "private-key",
+        public_key.get("privateKeyPem", ""))
+    return sections
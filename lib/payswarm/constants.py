@@ -6,6 +6,9 @@ __all__ = [
   'CONTEXTS',
   'CONTEXT',
   'FRAMES',
+  'DEFAULT_LISTINGS_URL',
+  'DEFAULT_LICENSE_URL',
+  'DEFAULT_LICENSE_HASH',
 ]
 
 # Versioned PaySwarm JSON-LD context URLs.
@@ -221,3 +224,26 @@ FRAMES['Listing'] = {
   'vendor': {'@embed': False},
   'signature': {'@embed': True}
 }
+
+# PaySwarm JSON-LD frame for any object with a signature.
+FRAMES['Signature'] = {
+  '@context': CONTEXT_URL,
+  'signature': {
+    'type': {},
+    'created': {},
+    'creator': {},
+    'signatureValue': {},
+    # FIXME: improve handling signatures w/o nonces
+    #'nonce': {'@omitDefault': True}
+  }
+}
+
+# Default listing service URL.
+DEFAULT_LISTINGS_URL = 'http://listings.dev.payswarm.com/'
+
+# Default license for assets published by this client.
+DEFAULT_LICENSE_URL = 'https://w3id.org/payswarm/licenses/blogging'
+
+# Hash of the default license.
+DEFAULT_LICENSE_HASH = 'urn:sha256:' + \
+  'd9dcfb7b3ba057df52b99f777747e8fe0fc598a3bb364e3d3eb529f90d58e1b9'
@@ -0,0 +1,219 @@
+"""The content module hashes the local files that assets describe.
+
+Files are read through a memory map in CHUNK_SIZE pieces, so multi-GB
+files are never loaded into memory. Two modes are supported:
+
+    sha256 - a plain SHA-256 of the file, computed sequentially.
+    tree   - a SHA-256 Merkle tree. Each chunk is hashed as a leaf,
+             H(0x00 + chunk), and pairs of nodes are combined as
+             H(0x01 + left + right); an odd node is carried up unchanged.
+             Leaves are hashed across threads and progress can be saved
+             to a state file so an interrupted run resumes where it
+             stopped.
+
+The digest is recorded on an asset with the "digestAlgorithm" and
+"digestValue" properties, so it is covered by the asset's signature.
+"""
+from __future__ import with_statement
+
+from multiprocessing.pool import ThreadPool
+import hashlib
+import json
+import mmap
+import os
+
+import util
+
+# number of bytes read, and hashed as one tree leaf, at a time
+CHUNK_SIZE = 1024 * 1024
+
+# number of leaves hashed between saves of the resume state
+SAVE_INTERVAL = 256
+
+# digestAlgorithm values keyed by mode
+ALGORITHMS = {
+    'sha256': 'sha256',
+    'tree': 'sha256-tree'
+}
+
+
+def _open(path):
+    """Returns the file and a read-only memory map, or None if empty."""
+    f = open(path, 'rb')
+    if os.fstat(f.fileno()).st_size == 0:
+        return f, None
+    return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def hash_sha256(path):
+    """Computes the SHA-256 of a file.
+
+    path - the file to hash.
+
+    Returns the hex digest.
+    """
+    f, data = _open(path)
+    h = hashlib.sha256()
+    try:
+        if data is not None:
+            for offset in xrange(0, len(data), CHUNK_SIZE):
+                h.update(data[offset:offset + CHUNK_SIZE])
+    finally:
+        if data is not None:
+            data.close()
+        f.close()
+    return h.hexdigest()
+
+
+def _root(leaves):
+    """Combines leaf digests into the Merkle tree root digest."""
+    nodes = leaves
+    while len(nodes) > 1:
+        parents = []
+        for i in xrange(0, len(nodes) - 1, 2):
+            parents.append(
+                hashlib.sha256('\x01' + nodes[i] + nodes[i + 1]).digest())
+        if len(nodes) % 2:
+            parents.append(nodes[-1])
+        nodes = parents
+    return nodes[0]
+
+
+def _load_state(state, path, st):
+    """Returns the leaves saved for an unchanged file, or an empty list."""
+    try:
+        with open(state) as f:
+            saved = json.load(f)
+    except (IOError, ValueError):
+        return []
+    if saved.get('path') != os.path.abspath(path) or \
+        saved.get('size') != st.st_size or \
+        saved.get('mtime') != st.st_mtime or \
+        saved.get('chunkSize') != CHUNK_SIZE:
+        return []
+    return [leaf.decode('hex') for leaf in saved.get('leaves', [])]
+
+
+def _save_state(state, path, st, leaves):
+    tmp = state + '.%d.tmp' % os.getpid()
+    with open(tmp, 'w') as f:
+        json.dump({
+            'path': os.path.abspath(path),
+            'size': st.st_size,
+            'mtime': st.st_mtime,
+            'chunkSize': CHUNK_SIZE,
+            'leaves': [leaf.encode('hex') for leaf in leaves]
+        }, f)
+    os.rename(tmp, state)
+
+
+def hash_tree(path, jobs=4, state=None):
+    """Computes the SHA-256 Merkle tree root of a file.
+
+    path - the file to hash.
+    jobs - the number of threads hashing leaves.
+    state - a file to save progress to and resume from (optional). It is
+        removed once the file has been hashed, and ignored if the file has
+        changed since it was written.
+
+    Returns the hex digest.
+    """
+    st = os.stat(path)
+    leaves = []
+    if state is not None:
+        leaves = _load_state(state, path, st)
+    count = (st.st_size + CHUNK_SIZE - 1) // CHUNK_SIZE
+    if count == 0:
+        return hashlib.sha256('\x00').hexdigest()
+
+    f, data = _open(path)
+
+    def _leaf(i):
+        # hashlib releases the GIL while hashing each chunk
+        h = hashlib.sha256('\x00')
+        h.update(data[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE])
+        return h.digest()
+
+    pool = ThreadPool(jobs)
+    try:
+        remaining = xrange(len(leaves), count)
+        for leaf in pool.imap(_leaf, remaining, 4):
+            leaves.append(leaf)
+            if state is not None and len(leaves) % SAVE_INTERVAL == 0:
+                _save_state(state, path, st, leaves)
+    finally:
+        pool.close()
+        pool.join()
+        data.close()
+        f.close()
+
+    if state is not None and os.path.exists(state):
+        os.unlink(state)
+    return _root(leaves).encode('hex')
+
+
+def hash_file(path, mode='sha256', jobs=4, state=None):
+    """Hashes a file.
+
+    path - the file to hash.
+    mode - 'sha256' or 'tree'.
+    jobs - the number of threads used in tree mode.
+    state - the resume state file used in tree mode (optional).
+
+    Returns the hex digest.
+    """
+    if mode == 'sha256':
+        return hash_sha256(path)
+    if mode == 'tree':
+        return hash_tree(path, jobs, state)
+    raise Exception('Unknown content hash mode "%s".' % mode)
+
+
+def record_digest(asset, path, mode='sha256', jobs=4, state=None):
+    """Hashes an asset's content file and records the digest on the asset.
+
+    asset - the asset to update. It should not have been signed yet.
+    path - the local content file.
+    mode - see hash_file.
+    jobs - see hash_file.
+    state - see hash_file.
+
+    Returns the asset.
+    """
+    asset['digestAlgorithm'] = ALGORITHMS[mode]
+    asset['digestValue'] = hash_file(path, mode, jobs, state)
+    return asset
+
+
+class Content(util.Plugin):
+    """Plugin to hash asset content files."""
+
+    def get_name(self):
+        return "Content"
+
+    def before_args_parsed(self, parser, subparsers):
+        subparser = subparsers.add_parser('content',
+                help='Hash local asset content files.')
+        subparser.add_argument('files', nargs='+', metavar='FILE',
+                help='A content file to hash.')
+        subparser.add_argument('-m', '--mode', choices=sorted(ALGORITHMS),
+                default='sha256',
+                help='The hash mode. (default: %(default)s)')
+        subparser.add_argument('-j', '--jobs', type=int, default=4,
+                help='The number of threads in tree mode. '
+                '(default: %(default)s)')
+        subparser.add_argument('--resume', action='store_true',
+                help='Save progress to FILE.hashstate in tree mode and '
+                'resume from it.')
+        subparser.set_defaults(func=self.run)
+
+    def after_args_parsed(self, args):
+        pass
+
+    def run(self, args):
+        for path in args.files:
+            state = None
+            if args.resume:
+                state = path + '.hashstate'
+            digest = hash_file(path, args.mode, args.jobs, state)
+            print "%s  %s:%s" % (path, ALGORITHMS[args.mode], digest)
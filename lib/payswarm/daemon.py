@@ -0,0 +1,273 @@
+"""The daemon module runs a local PaySwarm signing and verification service.
+
+A long-running daemon keeps JSON-LD contexts, fetched public keys and
+imported RSA keys warm across requests. Clients talk to it over a UNIX
+socket using newline-delimited JSON:
+
+    request:  {"id": 1, "method": "verify", "params": {"jsonld": {...}}}
+    response: {"id": 1, "result": true}
+              {"id": 1, "error": "The public key has been revoked."}
+
+Requests may be pipelined; responses on a connection are always written in
+request order.
+"""
+import datetime
+import os
+import signal
+import socket
+import SocketServer
+import sys
+
+import codec
+import signature
+import util
+import warmup
+
+
+def default_socket_path():
+    """Returns the default daemon socket path.
+
+    PAYSWARM_DAEMON_SOCKET else PAYSWARM_CONFIG_DIR/daemon.sock
+    """
+    return os.environ.get('PAYSWARM_DAEMON_SOCKET',
+            os.path.join(util.config_dir(), 'daemon.sock'))
+
+
+def _sign(params):
+    return signature.sign(params['jsonld'], params['publicKeyId'],
+            params['privateKeyPem'], params.get('nonce'),
+            params.get('created'))
+
+
+def _verify(params):
+    return signature.verify(params['jsonld'])
+
+
+def _hash(params):
+    return util.hash(params['jsonld'])
+
+
+# daemon methods keyed by name
+METHODS = {
+    'sign': _sign,
+    'verify': _verify,
+    'hash': _hash
+}
+
+
+def dispatch(line, methods=METHODS):
+    """Handles a single request line.
+
+    line - the JSON-encoded request.
+    methods - the map of method name to function taking the request params.
+
+    Returns the response object.
+    """
+    try:
+        request = codec.loads(line)
+    except ValueError, e:
+        return {'id': None, 'error': 'Invalid request: %s' % e}
+    if not isinstance(request, dict):
+        return {'id': None, 'error': 'Invalid request: not a JSON object.'}
+
+    rval = {'id': request.get('id')}
+    method = methods.get(request.get('method'))
+    if method is None:
+        rval['error'] = 'Unknown method "%s".' % request.get('method')
+        return rval
+    try:
+        rval['result'] = method(request.get('params', {}))
+    except Exception, e:
+        rval['error'] = str(e)
+    return rval
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+    """Handles pipelined requests on a single client connection."""
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            line = line.strip()
+            if line:
+                self.wfile.write(codec.dumps(dispatch(line)) + '\n')
+
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """A UNIX socket server that handles each connection in a thread."""
+
+    daemon_threads = True
+
+    def __init__(self, path):
+        # remove a stale socket left by a previous daemon
+        if os.path.exists(path):
+            os.unlink(path)
+        # create the socket owner-only so no other user can connect before
+        # its permissions are set
+        umask = os.umask(0077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path, _Handler)
+        finally:
+            os.umask(umask)
+        os.chmod(path, 0600)
+        self.path = path
+
+
+def serve(path, workers=1):
+    """Runs the daemon until it is terminated.
+
+    path - the UNIX socket path to listen on.
+    workers - the number of worker processes accepting connections on the
+        shared socket.
+    """
+    server = Server(path)
+    if workers <= 1:
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(path)
+        return
+
+    # pre-fork workers, each sharing the listening socket and a copy of
+    # any state warmed up before forking
+    children = []
+    for i in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def _stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    try:
+        while children:
+            try:
+                pid, status = os.wait()
+                children.remove(pid)
+            except OSError:
+                pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+class Client(object):
+    """A client for the PaySwarm daemon.
+
+    The sign, verify and hash methods mirror payswarm.signature.sign,
+    payswarm.signature.verify and payswarm.util.hash.
+    """
+
+    def __init__(self, path=None):
+        """Creates a new daemon client.
+
+        path - the daemon socket path (default: default_socket_path()).
+        """
+        self.path = path or default_socket_path()
+        self._socket = None
+        self._file = None
+        self._next_id = 0
+
+    def _connect(self):
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(self.path)
+            self._file = self._socket.makefile('rb')
+
+    def close(self):
+        """Closes the connection to the daemon."""
+        if self._socket is not None:
+            self._file.close()
+            self._socket.close()
+            self._socket = None
+            self._file = None
+
+    def pipeline(self, calls):
+        """Sends several requests before reading any of the responses.
+
+        calls - a list of (method, params) tuples.
+
+        Returns a list of results in call order. If any call failed, an
+        exception for the first failure is raised once all responses have
+        been read.
+        """
+        self._connect()
+        requests = []
+        for method, params in calls:
+            self._next_id += 1
+            requests.append(codec.dumps(
+                {'id': self._next_id, 'method': method, 'params': params}))
+        self._socket.sendall('\n'.join(requests) + '\n')
+
+        results = []
+        error = None
+        for i in range(len(requests)):
+            line = self._file.readline()
+            if not line:
+                self.close()
+                raise Exception('PaySwarm daemon closed the connection.')
+            response = codec.loads(line)
+            if 'error' in response and error is None:
+                error = response['error']
+            results.append(response.get('result'))
+        if error is not None:
+            raise Exception(error)
+        return results
+
+    def call(self, method, params):
+        """Performs a single daemon request and returns its result."""
+        return self.pipeline([(method, params)])[0]
+
+    def sign(self, jsonld, public_key_id, private_key_pem,
+            nonce=None, created=None):
+        """Adds a digital signature to an object using the daemon."""
+        if isinstance(created, datetime.datetime):
+            created = created.strftime(signature.W3C_DATE_FORMAT)
+        return self.call('sign', {
+            'jsonld': jsonld,
+            'publicKeyId': public_key_id,
+            'privateKeyPem': private_key_pem,
+            'nonce': nonce,
+            'created': created
+        })
+
+    def verify(self, jsonld):
+        """Verifies a digital signature in an object using the daemon."""
+        return self.call('verify', {'jsonld': jsonld})
+
+    def hash(self, obj):
+        """Generates a hash of JSON-LD encoded data using the daemon."""
+        return self.call('hash', {'jsonld': obj})
+
+
+class Daemon(util.Plugin):
+    """Plugin to run the PaySwarm signing and verification daemon."""
+
+    def get_name(self):
+        return "Daemon"
+
+    def before_args_parsed(self, parser, subparsers):
+        subparser = subparsers.add_parser('daemon',
+                help='Run a local signing and verification daemon.')
+        subparser.add_argument('-s', '--socket', default=default_socket_path(),
+                help='The UNIX socket to listen on. (default: %(default)s)')
+        subparser.add_argument('-w', '--workers', type=int, default=1,
+                help='The number of worker processes. (default: %(default)s)')
+        warmup.add_source_arguments(subparser)
+        subparser.set_defaults(func=self.run)
+
+    def run(self, args):
+        # warm up before listening so the first requests find warm caches
+        if warmup.has_sources(args):
+            warmup.print_report(warmup.run_from_args(args), sys.stderr)
+        serve(args.socket, args.workers)
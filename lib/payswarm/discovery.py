@@ -0,0 +1,157 @@
+"""The discovery module caches PaySwarm Authority client configuration.
+
+A client config is fetched once, kept in memory and cached on disk under
+PAYSWARM_CONFIG_DIR/cache/discovery. After DISCOVERY_TTL seconds the
+cached copy is revalidated with its ETag, so tools that start frequently
+do not contact the authority on every launch.
+"""
+from __future__ import with_statement
+
+import hashlib
+import json
+import os
+import time
+
+import codec
+import util
+
+# PaySwarm web service vocabulary
+PSW = 'http://purl.org/payswarm/webservices#'
+PSW_REQUEST = PSW + 'oAuthRequest'
+PSW_AUTHORIZE = PSW + 'oAuthAuthorize'
+PSW_TOKENS = PSW + 'oAuthTokens'
+PSW_PREFERENCES = PSW + 'preferences'
+PSW_CONTRACTS = PSW + 'contracts'
+PSW_LICENSES = PSW + 'licenses'
+PSW_KEYS = PSW + 'keys'
+PSW_LISTINGS = PSW + 'listings'
+
+# client config properties keyed by the endpoint names used in configs
+ENDPOINTS = {
+    'request-url': PSW_REQUEST,
+    'authorize-url': PSW_AUTHORIZE,
+    'tokens-url': PSW_TOKENS,
+    'preferences-url': PSW_PREFERENCES,
+    'contracts-url': PSW_CONTRACTS,
+    'licenses-url': PSW_LICENSES,
+    'keys-url': PSW_KEYS,
+    'listings-url': PSW_LISTINGS
+}
+
+# number of seconds a discovered config is used before it is revalidated
+DISCOVERY_TTL = 60 * 60
+
+# {'config', 'etag', 'expires'} keyed by cache key
+_configs = {}
+
+# coalesces concurrent fetches of the same config
+config_fetches = util.SingleFlight()
+
+
+def _cache_path(key):
+    name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json'
+    return os.path.join(util.config_dir(), 'cache', 'discovery', name)
+
+
+def _load(key):
+    """Loads a cache entry from disk or returns None."""
+    try:
+        with open(_cache_path(key)) as f:
+            entry = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if entry.get('key') != key:
+        return None
+    return entry
+
+
+def _save(key, entry):
+    """Writes a cache entry to disk, ignoring failures."""
+    path = _cache_path(key)
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), 0700)
+        tmp = path + '.%d.tmp' % os.getpid()
+        with open(tmp, 'w') as f:
+            json.dump(dict(entry, key=key), f)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+
+
+def get_config(url, fetch=None, key=None):
+    """Retrieves a client config document, using the cache when possible.
+
+    url - the URL of the config document.
+    fetch - a function taking the URL and returning the document, used
+        instead of an anonymous GET, e.g. for OAuth-signed requests. ETags
+        are not used with a custom fetch function (optional).
+    key - the cache key, defaults to url. Use a different key when a
+        custom fetch function can return a different document (optional).
+
+    Returns the config document. A stale cached copy is returned if
+    revalidation fails.
+    """
+    key = key or url
+    entry = _configs.get(key) or _load(key)
+    now = time.time()
+    if entry is not None and entry['expires'] > now:
+        _configs[key] = entry
+        return entry['config']
+
+    try:
+        # concurrent callers share one fetch and one cache write
+        return config_fetches.do(key, _refresh, (url, entry, fetch, key))
+    except Exception:
+        if entry is None:
+            raise
+        # serve the stale copy for a while rather than fail
+        entry['expires'] = now + min(60, DISCOVERY_TTL)
+        _configs[key] = entry
+        return entry['config']
+
+
+def _refresh(url, entry, fetch, key):
+    """Fetches or revalidates a config and caches it."""
+    if fetch is not None:
+        entry = {'config': fetch(url), 'etag': None}
+    else:
+        entry = _revalidate(url, entry)
+    entry = dict(entry, expires=time.time() + DISCOVERY_TTL)
+    _configs[key] = entry
+    _save(key, entry)
+    return entry['config']
+
+
+def _revalidate(url, entry):
+    """Fetches a config document, sending the cached ETag if there is one."""
+    headers = {'Accept': 'application/ld+json, application/json'}
+    if entry is not None and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    res = util.request_raw('GET', url, headers=headers)
+    if res.status == 304 and entry is not None:
+        return entry
+    if res.status < 200 or res.status >= 300:
+        raise Exception('Bad status code %d requesting "%s"' %
+            (res.status, url))
+    return {'config': codec.loads(res.data), 'etag': res.headers.get('etag')}
+
+
+def get_endpoint(url, name, fetch=None, key=None):
+    """Looks up a single endpoint in a client config.
+
+    url - the URL of the config document.
+    name - the endpoint name, such as 'request-url' or 'keys-url', or a
+        config property.
+    fetch - see get_config (optional).
+    key - see get_config (optional).
+
+    Returns the endpoint URL or None.
+    """
+    config = get_config(url, fetch, key)
+    return config.get(ENDPOINTS.get(name, name))
+
+
+def clear():
+    """Clears the in-memory cache. The disk cache is left in place."""
+    _configs.clear()
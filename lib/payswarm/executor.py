@@ -0,0 +1,180 @@
+"""The executor module runs signing and verification on thread pools.
+
+Network waits and CPU work go to separate pools: public key fetches run on
+an IO pool while framing, normalization and RSA operations for other
+documents run on a CPU pool, so a slow key fetch does not hold up work
+that is ready to run. Every call returns a Future:
+
+    executor = payswarm.executor.get_executor()
+    futures = [executor.verify(doc) for doc in docs]
+    results = [future.result() for future in futures]
+
+The sign, verify and hash functions and the caches they use are safe to
+call from several threads, so an executor may be shared by a whole
+process.
+"""
+from __future__ import with_statement
+
+from multiprocessing.pool import ThreadPool
+import sys
+import threading
+
+import keys
+import signature
+import util
+
+# number of threads waiting on the network
+IO_WORKERS = 16
+
+# number of threads doing JSON-LD and crypto work
+CPU_WORKERS = 2
+
+# the shared executor, see get_executor
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class Future(object):
+    """The pending result of an executor call."""
+
+    def __init__(self, on_done=None):
+        self._event = threading.Event()
+        self._result = None
+        self._error = None
+        self._on_done = on_done
+
+    def _finish(self):
+        self._event.set()
+        if self._on_done is not None:
+            self._on_done()
+
+    def set_result(self, result):
+        """Completes the call with a result."""
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        """Completes the call with an exception from sys.exc_info()."""
+        self._error = exc_info
+        self._finish()
+
+    def done(self):
+        """Returns whether the call has finished."""
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """Waits for the call to finish and returns its result.
+
+        timeout - the maximum number of seconds to wait (optional).
+
+        Raises the call's exception if it failed.
+        """
+        if not self._event.wait(timeout):
+            raise Exception('Timed out waiting for an executor call.')
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._result
+
+
+class Executor(object):
+    """Runs PaySwarm operations on separate IO and CPU thread pools."""
+
+    def __init__(self, io_workers=None, cpu_workers=None):
+        """Creates a new executor.
+
+        io_workers - the number of IO threads (default: IO_WORKERS).
+        cpu_workers - the number of CPU threads (default: CPU_WORKERS).
+        """
+        self._io = ThreadPool(io_workers or IO_WORKERS)
+        self._cpu = ThreadPool(cpu_workers or CPU_WORKERS)
+        # number of unfinished calls
+        self._pending = 0
+        self._idle = threading.Condition(threading.Lock())
+
+    def _future(self):
+        with self._idle:
+            self._pending += 1
+        return Future(self._done)
+
+    def _done(self):
+        with self._idle:
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.notify_all()
+
+    def _submit(self, pool, future, fn, args, then=None):
+        """Runs fn on a pool, passing its result to then or the future."""
+        def _call():
+            try:
+                result = fn(*args)
+                if then is not None:
+                    then(result)
+                    return
+            except Exception:
+                future.set_exception(sys.exc_info())
+                return
+            future.set_result(result)
+        pool.apply_async(_call)
+
+    def sign(self, jsonld, public_key_id, private_key_pem,
+            nonce=None, created=None):
+        """Signs an object, see payswarm.signature.sign."""
+        future = self._future()
+        self._submit(self._cpu, future, signature.sign,
+            (jsonld, public_key_id, private_key_pem, nonce, created))
+        return future
+
+    def verify(self, jsonld):
+        """Verifies an object, see payswarm.signature.verify.
+
+        The public key is fetched on the IO pool between the two CPU-bound
+        verification stages.
+        """
+        future = self._future()
+
+        def _complete(state, public_key):
+            self._submit(self._cpu, future, signature.complete_verify,
+                (state, public_key))
+
+        def _fetch(state):
+            if state is None:
+                future.set_result(True)
+                return
+            self._submit(self._io, future, keys.get_public_key,
+                (state.creator,), lambda key: _complete(state, key))
+
+        self._submit(self._cpu, future, signature.prepare_verify, (jsonld,),
+            _fetch)
+        return future
+
+    def hash(self, obj):
+        """Hashes an object, see payswarm.util.hash."""
+        future = self._future()
+        self._submit(self._cpu, future, util.hash, (obj,))
+        return future
+
+    def fetch_key(self, key_id):
+        """Fetches a public key, see payswarm.keys.get_public_key."""
+        future = self._future()
+        self._submit(self._io, future, keys.get_public_key, (key_id,))
+        return future
+
+    def close(self):
+        """Waits for pending calls and stops the thread pools."""
+        # calls move between the pools, so wait for them before closing
+        with self._idle:
+            while self._pending:
+                self._idle.wait()
+        self._cpu.close()
+        self._io.close()
+        self._cpu.join()
+        self._io.join()
+
+
+def get_executor():
+    """Returns the executor shared by the process, creating it if needed."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = Executor()
+        return _executor
@@ -0,0 +1,95 @@
+"""The frames module validates JSON-LD frames once and reuses them.
+
+A frame is validated the first time it is used by expanding it, which
+also loads its remote contexts through util.load_document. Later framing
+calls pass PyLD the same frame and skip the validation; the contexts are
+served by the document loader's cache.
+"""
+from __future__ import with_statement
+
+import copy
+import hashlib
+
+import payswarm
+
+import codec
+import constants
+import util
+
+# maximum number of cached user-supplied frames
+FRAME_CACHE_SIZE = 100
+
+# validated frames keyed by frame name
+_named = {}
+
+# validated frames keyed by digest of user-supplied frames
+_custom = {}
+
+
+def compile_frame(frame):
+    """Validates a JSON-LD frame.
+
+    frame - the frame to validate. It must be a JSON object.
+
+    Returns a copy of the frame to reuse for framing.
+    """
+    if not isinstance(frame, dict):
+        raise Exception('A JSON-LD frame must be a JSON object.')
+    util.preload_contexts(frame)
+    with util.jsonld_lock:
+        expanded = payswarm.jsonld.expand(frame, {
+            'isFrame': True,
+            'keepFreeFloatingNodes': True,
+            'documentLoader': util.load_document
+        })
+    if len(expanded) != 1 or not isinstance(expanded[0], dict):
+        raise Exception('A JSON-LD frame must expand to a single object.')
+    return copy.deepcopy(frame)
+
+
+def get_frame(name):
+    """Returns a validated frame from constants.FRAMES.
+
+    name - the frame name, such as 'Asset' or 'Listing'.
+    """
+    entry = _named.get(name)
+    if entry is None:
+        entry = _named[name] = compile_frame(constants.FRAMES[name])
+    return entry
+
+
+def _get_custom(frame):
+    key = hashlib.sha256(
+        codec.canonical_dumps(frame)).hexdigest()
+    entry = _custom.get(key)
+    if entry is None:
+        if len(_custom) >= FRAME_CACHE_SIZE:
+            _custom.clear()
+        entry = _custom[key] = compile_frame(frame)
+    return entry
+
+
+def frame(input, frame):
+    """Frames JSON-LD input using a validated frame.
+
+    input - the JSON-LD input to frame.
+    frame - the name of a frame in constants.FRAMES or a frame object,
+        which is validated once and cached.
+
+    Returns the framed output.
+    """
+    if isinstance(frame, basestring):
+        frame = get_frame(frame)
+    else:
+        frame = _get_custom(frame)
+    util.preload_contexts(input)
+    with util.jsonld_lock:
+        return payswarm.jsonld.frame(input, frame, {
+            'documentLoader': util.load_document
+        })
+
+
+def clear():
+    """Clears all validated frames."""
+    _named.clear()
+    _custom.clear()
@@ -0,0 +1,116 @@
+"""The keys module is used to retrieve and cache PaySwarm keys.
+
+All functions are safe to call from several threads. Concurrent fetches of
+the same key are coalesced; at worst two threads import the same PEM.
+"""
+import time
+
+from Crypto.PublicKey import RSA
+
+import revocation
+import scheduler
+import util
+
+# number of seconds a fetched public key document is trusted before it is
+# fetched again (revoked keys are kept until cleared)
+PUBLIC_KEY_TTL = 300
+
+# number of seconds past PUBLIC_KEY_TTL a cached key is still used when it
+# cannot be fetched again (the host is down, slow, failing with 5xx
+# responses or its circuit is open)
+STALE_KEY_TTL = 3600
+
+# number of stale keys used because a fetch failed
+stale_stats = {'served': 0}
+
+# number of seconds to wait for a key fetch started by another caller
+KEY_FETCH_TIMEOUT = 30
+
+# coalesces concurrent fetches of the same public key, see key_fetches.stats
+key_fetches = util.SingleFlight()
+
+# (expires, public key document) keyed by public key id
+_public_keys = {}
+
+# imported RSA key objects keyed by PEM
+_rsa_keys = {}
+
+
+def get_public_key(key_id):
+    """Retrieves the public key document for the given key id.
+
+    key_id - the URL of the public key.
+
+    Returns the public key document. The document is served from the
+    cache until PUBLIC_KEY_TTL expires, or from the synced key status
+    index without fetching it. Concurrent callers asking for the same
+    uncached key share a single fetch. If the authority cannot be reached or
+    answers with a server error, a cached key that expired less than
+    STALE_KEY_TTL seconds ago is returned instead.
+    """
+    now = time.time()
+    entry = _public_keys.get(key_id)
+    if entry is not None and (entry[0] > now or 'revoked' in entry[1]):
+        return entry[1]
+
+    index = revocation.get_index()
+    if index is not None:
+        key = index.get_key(key_id)
+        if key is not None:
+            return key
+
+    return key_fetches.do(
+        key_id, _fetch_public_key, (key_id,), KEY_FETCH_TIMEOUT)
+
+
+def _fetch_public_key(key_id):
+    try:
+        key = util.get(key_id, priority=scheduler.KEY)
+    except Exception, e:
+        # an answer such as 404 or 410 means the key is gone, and a
+        # document that does not parse is not a key; only an unreachable or
+        # failing authority is worked around
+        if isinstance(e, ValueError) or \
+                (isinstance(e, util.HTTPError) and e.status < 500):
+            raise
+        entry = _public_keys.get(key_id)
+        if entry is None or entry[0] + STALE_KEY_TTL <= time.time():
+            raise
+        stale_stats['served'] += 1
+        return entry[1]
+    _public_keys[key_id] = (time.time() + PUBLIC_KEY_TTL, key)
+    return key
+
+
+def is_revoked(key_id):
+    """Returns whether a public key is known to be revoked.
+
+    key_id - the URL of the public key.
+
+    Only the cache and the synced key status index are consulted; unknown
+    keys are not considered revoked.
+    """
+    entry = _public_keys.get(key_id)
+    if entry is not None and 'revoked' in entry[1]:
+        return True
+    index = revocation.get_index()
+    return index is not None and index.is_revoked(key_id)
+
+
+def import_key(pem):
+    """Imports an RSA key from PEM-encoded data.
+
+    pem - the public or private key in PEM-encoded format.
+
+    Returns the RSA key object. Each distinct PEM is only parsed once.
+    """
+    key = _rsa_keys.get(pem)
+    if key is None:
+        key = _rsa_keys[pem] = RSA.importKey(pem)
+    return key
+
+
+def clear():
+    """Clears all cached public key documents and imported keys."""
+    _public_keys.clear()
+    _rsa_keys.clear()
@@ -0,0 +1,232 @@
+"""The loadtest plugin drives the client library against a mock service.
+
+Operations are started at a fixed target rate whether or not earlier ones
+have finished, so a slow service shows up as growing latency rather than
+as a lower request rate. Latency is measured from the time an operation
+was scheduled to start.
+"""
+from __future__ import with_statement
+
+from multiprocessing.pool import ThreadPool
+import math
+import threading
+import time
+import urlparse
+
+from Crypto.PublicKey import RSA
+
+import config
+import constants
+import discovery
+import mock
+import purchase
+import scheduler
+import signature
+import storage
+import util
+
+# operations that can be load tested
+OPERATIONS = ['verify', 'register', 'fetch', 'purchase']
+
+
+def percentile(values, p):
+    """Returns the nearest-rank percentile of sorted values, or None."""
+    if not values:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class Report(object):
+    """The results of a load test."""
+
+    def __init__(self, latencies, errors, seconds):
+        """Creates a new report.
+
+        latencies - the latency in seconds of each successful operation.
+        errors - the error message of each failed operation.
+        seconds - the length of the test.
+        """
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.seconds = seconds
+
+    def summary(self):
+        """Returns the request count, error count, throughput and latency
+        percentiles in milliseconds."""
+        def _ms(value):
+            if value is None:
+                return None
+            return value * 1000.0
+        return {
+            'requests': len(self.latencies) + len(self.errors),
+            'errors': len(self.errors),
+            'throughput': len(self.latencies) / max(self.seconds, 1e-6),
+            'p50': _ms(percentile(self.latencies, 50)),
+            'p90': _ms(percentile(self.latencies, 90)),
+            'p99': _ms(percentile(self.latencies, 99)),
+            'max': _ms(self.latencies[-1] if self.latencies else None)
+        }
+
+
+def run(fn, rate, duration, concurrency=8):
+    """Calls a function at a target rate.
+
+    fn - the function performing one operation.
+    rate - the number of operations to start per second.
+    duration - the number of seconds to start operations for.
+    concurrency - the maximum number of operations in progress.
+
+    Returns a Report once every operation has finished.
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def _call(scheduled):
+        try:
+            fn()
+        except Exception, e:
+            with lock:
+                errors.append(str(e))
+            return
+        latency = time.time() - scheduled
+        with lock:
+            latencies.append(latency)
+
+    pool = ThreadPool(concurrency)
+    start = time.time()
+    try:
+        for i in xrange(int(rate * duration)):
+            scheduled = start + i / float(rate)
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            pool.apply_async(_call, (scheduled,))
+    finally:
+        pool.close()
+        pool.join()
+    return Report(latencies, errors, time.time() - start)
+
+
+def setup(operation, url, items):
+    """Prepares an operation against a mock service.
+
+    operation - one of OPERATIONS.
+    url - the mock service URL.
+    items - an unsigned asset and listing to use.
+
+    Returns a function that performs one operation.
+    """
+    # sign with a throwaway key published to the service so load tests
+    # never touch a real authority
+    key_pair = RSA.generate(2048)
+    private_key_pem = key_pair.exportKey()
+    key_id = url + 'keys/loadtest'
+    util.upload(key_id, {
+        '@context': constants.CONTEXT_URL,
+        'id': key_id,
+        'type': 'CryptographicKey',
+        'publicKeyPem': key_pair.publickey().exportKey()
+    }, 'PUT')
+
+    sections = config.storage_config({}, url)
+    sections.set("application", "public-key-id", key_id)
+    sections.set("application", "private-key", private_key_pem)
+    asset, listing = items[0], items[1]
+
+    if operation == 'verify':
+        signed = signature.sign(asset, key_id, private_key_pem)
+        def _run():
+            # verify for real rather than hit the verification cache
+            signature.clear_verified()
+            signature.verify(signed)
+        return _run
+    if operation == 'register':
+        def _run():
+            signed_asset = storage.register_asset(sections, asset)
+            storage.register_listing(sections, signed_asset, listing)
+        return _run
+
+    signed_asset = storage.register_asset(sections, asset)
+    storage.register_listing(sections, signed_asset, listing)
+    if operation == 'fetch':
+        def _run():
+            storage.fetch(sections, listing)
+        return _run
+
+    contracts_url = discovery.get_endpoint(
+        url + 'client-config', 'contracts-url')
+    def _run():
+        published = storage.fetch(sections, listing)
+        purchase.purchase(contracts_url, published, url + 'accounts/loadtest',
+            key_id, private_key_pem)
+    return _run
+
+
+class LoadTest(util.Plugin):
+    """Plugin to load test the client library against a mock service."""
+
+    def get_name(self):
+        return "LoadTest"
+
+    def before_args_parsed(self, parser, subparsers):
+        subparser = subparsers.add_parser('loadtest',
+                help='Load test an operation against a mock service.')
+        subparser.add_argument('operation', choices=OPERATIONS,
+                help='The operation to run.')
+        subparser.add_argument('file', nargs='?',
+                default='listings/test.jsonld',
+                help='A JSON-LD file with an asset and a listing. '
+                '(default: %(default)s)')
+        subparser.add_argument('--url',
+                help='The URL of a running mock service (see the mock '
+                'command). An in-process mock service is used if not given.')
+        subparser.add_argument('-r', '--rate', type=float, default=50,
+                help='Operations started per second. (default: %(default)s)')
+        subparser.add_argument('-d', '--duration', type=float, default=10,
+                help='Seconds to run for. (default: %(default)s)')
+        subparser.add_argument('-c', '--concurrency', type=int, default=8,
+                help='Maximum operations in progress. (default: %(default)s)')
+        subparser.add_argument('--host-rate', type=float,
+                help='Requests per second the client sends to the service '
+                'host, see payswarm.scheduler. (default: no limit)')
+        mock.add_injection_arguments(subparser)
+        subparser.set_defaults(func=self.run)
+
+    def after_args_parsed(self, args):
+        pass
+
+    def run(self, args):
+        service = None
+        url = args.url
+        if url is None:
+            service = mock.MockService().start()
+            url = service.url
+        if args.host_rate is not None:
+            scheduler.configure(urlparse.urlsplit(url).netloc,
+                rate=args.host_rate)
+        try:
+            fn = setup(args.operation, url, storage.load_items(args.file))
+            # inject latency and errors only once setup is done
+            if service is not None:
+                service.latency = args.latency / 1000.0
+                service.jitter = args.jitter / 1000.0
+                service.error_rate = args.error_rate
+            report = run(fn, args.rate, args.duration, args.concurrency)
+        finally:
+            if service is not None:
+                service.stop()
+
+        summary = report.summary()
+        print "%d requests, %d errors, %.1f ops/s" % (
+            summary['requests'], summary['errors'], summary['throughput'])
+        if report.latencies:
+            print "latency ms: p50 %(p50).1f  p90 %(p90).1f  " \
+                "p99 %(p99).1f  max %(max).1f" % summary
+        for error in sorted(set(report.errors)):
+            print "ERROR (%d): %s" % (report.errors.count(error), error)
+        for host, host_stats in sorted(scheduler.stats().items()):
+            print "%s: %d sent, max queue %d, waited %.1fs, %d pauses" % (
+                host, host_stats['sent'], host_stats['max_queued'],
+                host_stats['waited'], host_stats['paused'])
@@ -0,0 +1,282 @@
+"""The mock module provides a local stand-in for PaySwarm web services.
+
+The mock service stores JSON documents by URL path. Public keys are served
+from "keys/{NAME}", a client config listing the service endpoints is
+served from "client-config" and anything POSTed or PUT to another path
+(such as assets and listings uploaded by payswarm.storage) can be fetched
+back with GET. Purchase requests POSTed to "contracts" are checked against
+the stored listing and answered with a receipt. GET responses carry an
+ETag and honor If-None-Match, and gzip request and response bodies are
+supported.
+
+Latency and errors can be injected to see how clients behave under load:
+every request is delayed by "latency" seconds plus up to "jitter" seconds
+and a fraction "error_rate" of requests fail with 503 Service Unavailable,
+carrying a Retry-After header if "retry_after" is set.
+"""
+import BaseHTTPServer
+import hashlib
+import json
+import random
+import SocketServer
+import sys
+import threading
+import time
+import zlib
+
+import constants
+import discovery
+import util
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handles a request to the mock service."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, document=None, etag=None, headers=None):
+        body = ''
+        if document is not None:
+            body = json.dumps(document)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/ld+json')
+        if body and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = util.gzip(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _path(self):
+        return self.path.split('?', 1)[0].lstrip('/')
+
+    def _inject(self):
+        """Applies injected latency and errors, returning True if the
+        request failed."""
+        delay, fail = self.server._injection()
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            headers = None
+            if self.server.retry_after is not None:
+                headers = {'Retry-After': str(self.server.retry_after)}
+            self._send(503, {'error': 'Injected error.'}, headers=headers)
+        return fail
+
+    def do_GET(self):
+        if self._inject():
+            return
+        document = self.server.get_document(self._path())
+        if document is None:
+            self._send(404)
+            return
+        etag = '"%s"' % hashlib.sha1(
+            json.dumps(document, sort_keys=True)).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self._send(304, etag=etag)
+        else:
+            self._send(200, document, etag)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        self.server.bytes_received += length
+        if self._inject():
+            return
+        try:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = util.gunzip(body)
+            document = json.loads(body)
+        except (ValueError, zlib.error):
+            self._send(400)
+            return
+        if self._path() == 'contracts' and self.command == 'POST':
+            status, document = self.server.purchase(document)
+            self._send(status, document)
+            return
+        self.server.add_document(self._path(), document)
+        self._send(200, document)
+
+    do_PUT = do_POST
+
+    def do_DELETE(self):
+        if self._inject():
+            return
+        if self.server.remove_document(self._path()):
+            self._send(204)
+        else:
+            self._send(404)
+
+
+class MockService(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A local HTTP server standing in for a PaySwarm Authority and listing
+    service."""
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, jitter=0,
+            error_rate=0, seed=None):
+        """Creates a new mock service.
+
+        host - the host to listen on.
+        port - the port to listen on, 0 to pick a free port.
+        latency - the number of seconds every request is delayed.
+        jitter - the maximum number of random seconds added to latency.
+        error_rate - the fraction of requests that fail with a 503.
+        seed - the seed for injected jitter and errors (optional).
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), _Handler)
+        self.url = 'http://%s:%d/' % self.server_address
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        # seconds sent in the Retry-After header of injected errors
+        self.retry_after = None
+        self._random = random.Random(seed)
+        self._documents = {}
+        # request body bytes received, as sent on the wire
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._contracts = 0
+        self.add_document('client-config', {
+            discovery.PSW_KEYS: self.url + 'keys',
+            discovery.PSW_LISTINGS: self.url,
+            discovery.PSW_CONTRACTS: self.url + 'contracts',
+            discovery.PSW_LICENSES: self.url + 'licenses'
+        })
+
+    def _injection(self):
+        """Returns the delay and whether to fail for a request."""
+        with self._lock:
+            delay = self.latency
+            if self.jitter:
+                delay += self._random.uniform(0, self.jitter)
+            fail = self.error_rate > 0 and \
+                self._random.random() < self.error_rate
+        return delay, fail
+
+    def get_document(self, path):
+        """Returns the document stored at a path or None."""
+        with self._lock:
+            return self._documents.get(path)
+
+    def add_document(self, path, document):
+        """Stores a document at a path."""
+        with self._lock:
+            self._documents[path] = document
+
+    def remove_document(self, path):
+        """Removes a document, returning whether it existed."""
+        with self._lock:
+            return self._documents.pop(path, None) is not None
+
+    def add_key(self, name, public_key_pem):
+        """Publishes a public key.
+
+        name - the key name.
+        public_key_pem - the public key in PEM-encoded format.
+
+        Returns the public key id.
+        """
+        key_id = self.url + 'keys/' + name
+        self.add_document('keys/' + name, {
+            '@context': constants.CONTEXT_URL,
+            'id': key_id,
+            'type': 'CryptographicKey',
+            'publicKeyPem': public_key_pem
+        })
+        return key_id
+
+    def purchase(self, request):
+        """Handles a purchase request for a stored listing.
+
+        request - the signed PurchaseRequest.
+
+        Returns the HTTP status and the Receipt or an error document.
+        """
+        if request.get('type') != 'PurchaseRequest':
+            return 400, {'error': 'Not a PurchaseRequest.'}
+        listing_id = request.get('listing', '')
+        listing = None
+        if listing_id.startswith(self.url):
+            listing = self.get_document(listing_id[len(self.url):])
+        if listing is None:
+            return 404, {'error': 'Listing not found.'}
+        if request.get('listingHash') != util.hash(listing):
+            return 409, {'error': 'The listing hash does not match.'}
+        with self._lock:
+            self._contracts += 1
+            path = 'contracts/%d' % self._contracts
+        contract = {
+            '@context': constants.CONTEXT_URL,
+            'id': self.url + path,
+            'type': 'Contract',
+            'listing': listing_id,
+            'listingHash': request['listingHash'],
+            'asset': listing.get('asset')
+        }
+        self.add_document(path, contract)
+        return 200, {
+            '@context': constants.CONTEXT_URL,
+            'type': 'Receipt',
+            'contract': contract
+        }
+
+    def start(self):
+        """Starts serving requests in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving requests."""
+        self.shutdown()
+        self.server_close()
+
+
+class Mock(util.Plugin):
+    """Plugin to run the mock PaySwarm service."""
+
+    def get_name(self):
+        return "Mock"
+
+    def before_args_parsed(self, parser, subparsers):
+        subparser = subparsers.add_parser('mock',
+                help='Run a local mock PaySwarm authority and listing '
+                'service.')
+        subparser.add_argument('-p', '--port', type=int, default=8000,
+                help='The port to listen on. (default: %(default)s)')
+        add_injection_arguments(subparser)
+        subparser.set_defaults(func=self.run)
+
+    def after_args_parsed(self, args):
+        pass
+
+    def run(self, args):
+        service = MockService(port=args.port, latency=args.latency / 1000.0,
+            jitter=args.jitter / 1000.0, error_rate=args.error_rate)
+        sys.stderr.write('Mock PaySwarm service at %s\n' % service.url)
+        try:
+            service.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        service.server_close()
+
+
+def add_injection_arguments(parser):
+    """Adds the latency and error injection options to a parser."""
+    parser.add_argument('--latency', type=float, default=0,
+            help='Milliseconds to delay every request. (default: %(default)s)')
+    parser.add_argument('--jitter', type=float, default=0,
+            help='Maximum random milliseconds added to the latency. '
+            '(default: %(default)s)')
+    parser.add_argument('--error-rate', type=float, default=0,
+            help='Fraction of requests that fail with a 503. '
+            '(default: %(default)s)')
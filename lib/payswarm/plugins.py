@@ -0,0 +1,132 @@
+"""The plugins module caches which subcommands each CLI plugin provides.
+
+The plugin manifest lets the payswarm CLI decide which plugins it needs for
+a command line without importing every configured plugin or running every
+plugin's before_args_parsed. It is stored as JSON:
+
+    {
+        "{PLUGIN_NAME}": {
+            "module": "{MODULE_NAME}",
+            "file": "{MODULE_SOURCE_PATH}",
+            "mtime": {MODULE_SOURCE_MTIME},
+            "commands": ["{SUBCOMMAND}", ...],
+            "options": {ADDS_GLOBAL_OPTIONS}
+        },
+        ...
+    }
+
+An entry is rediscovered whenever its module source file changes.
+"""
+from __future__ import with_statement
+
+from argparse import ArgumentParser
+import json
+import os
+import sys
+
+
+def _source(module_name):
+    """Returns the source path of an imported module or None."""
+    path = getattr(sys.modules.get(module_name), '__file__', None)
+    if path is None:
+        return None
+    if path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+    return os.path.abspath(path)
+
+
+def _mtime(path):
+    """Returns the modification time of a file or None."""
+    try:
+        return os.path.getmtime(path)
+    except (OSError, TypeError):
+        return None
+
+
+def describe(plugin):
+    """Describes what a plugin adds to the argument parser.
+
+    plugin - the plugin to describe.
+
+    Returns a tuple of the sorted subcommand names the plugin adds and
+    whether it adds global options.
+    """
+    parser = ArgumentParser(add_help=False)
+    subparsers = parser.add_subparsers()
+    plugin.before_args_parsed(parser, subparsers)
+    # the only action that is not a global option is the subparsers action
+    return sorted(subparsers.choices.keys()), len(parser._actions) > 1
+
+
+class PluginManifest(object):
+    """A cached map of plugin name to module and subcommands."""
+
+    def __init__(self, path):
+        """Creates a manifest, loading any cached copy.
+
+        path - the manifest file path.
+        """
+        self.path = path
+        self.plugins = {}
+        self._dirty = False
+        try:
+            with open(path) as f:
+                self.plugins = json.load(f)
+        except (IOError, ValueError):
+            self._dirty = True
+
+    def is_fresh(self, name):
+        """Returns whether the entry for a plugin name is up to date."""
+        entry = self.plugins.get(name)
+        return entry is not None and entry['file'] is not None and \
+            _mtime(entry['file']) == entry['mtime']
+
+    def names(self, module_name):
+        """Returns the cached plugin names provided by a module, or None if
+        the module must be imported to discover them."""
+        names = [name for name, entry in self.plugins.items()
+            if entry['module'] == module_name]
+        if not names or not all(self.is_fresh(name) for name in names):
+            return None
+        return names
+
+    def add(self, plugin):
+        """Records the module, subcommands and options of a loaded plugin."""
+        module_name = plugin.__class__.__module__
+        path = _source(module_name)
+        commands, options = describe(plugin)
+        self.plugins[plugin.get_name()] = {
+            'module': module_name,
+            'file': path,
+            'mtime': _mtime(path),
+            'commands': commands,
+            'options': options
+        }
+        self._dirty = True
+
+    def prune(self, module_names):
+        """Drops entries for plugins whose module is no longer used."""
+        for name, entry in self.plugins.items():
+            if entry['module'] not in module_names:
+                del self.plugins[name]
+                self._dirty = True
+
+    def commands(self):
+        """Returns a map of subcommand name to plugin name."""
+        rval = {}
+        for name, entry in self.plugins.items():
+            for command in entry['commands']:
+                rval[command] = name
+        return rval
+
+    def save(self):
+        """Writes the manifest if it changed. Write failures are ignored so
+        a read-only config directory only costs rediscovery."""
+        if not self._dirty:
+            return
+        try:
+            with open(self.path, 'w') as f:
+                json.dump(self.plugins, f, sort_keys=True, indent=2)
+            self._dirty = False
+        except IOError:
+            pass
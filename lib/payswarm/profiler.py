@@ -0,0 +1,233 @@
+"""The profiler plugin runs PaySwarm operations under a profiler."""
+from __future__ import with_statement
+
+import cProfile
+import gc
+import os
+import pstats
+import resource
+import signal
+import sys
+import time
+
+from Crypto.PublicKey import RSA
+
+import config
+import keys
+import mock
+import signature
+import storage
+import util
+
+# operations that can be profiled
+OPERATIONS = ['sign', 'verify', 'hash', 'register']
+
+
+class StackSampler(object):
+    """Samples the main thread's call stack on a CPU timer.
+
+    The samples can be written in the collapsed-stack format read by
+    flamegraph tools: one "frame;frame;frame count" line per stack.
+    """
+
+    def __init__(self, interval=0.001):
+        """Creates a new sampler.
+
+        interval - the CPU time in seconds between samples.
+        """
+        self.interval = interval
+        self.stacks = {}
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s:%s:%d' % (os.path.basename(code.co_filename),
+                code.co_name, code.co_firstlineno))
+            frame = frame.f_back
+        stack = ';'.join(reversed(stack))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def start(self):
+        """Starts sampling."""
+        signal.signal(signal.SIGPROF, self._sample)
+        # restart system calls interrupted by a sample
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        """Stops sampling."""
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def write(self, out):
+        """Writes the samples in collapsed-stack format."""
+        for stack, count in sorted(self.stacks.items()):
+            out.write('%s %d\n' % (stack, count))
+
+
+def _count_objects():
+    """Returns the number of live objects tracked by the GC, by type name."""
+    counts = {}
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def _max_rss():
+    """Returns the peak resident set size (KiB on Linux, bytes on OS X)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def profile(fn, iterations, out=sys.stdout, limit=25, sort='cumulative',
+        collapsed=None):
+    """Calls a function repeatedly under a profiler and reports the results.
+
+    fn - the function to call with no arguments.
+    iterations - the number of times to call fn.
+    out - the stream to write the report to.
+    limit - the number of functions to include in the report.
+    sort - the pstats sort key for the report.
+    collapsed - the filename to write collapsed stacks to, sampled in a
+        second run of the iterations (optional).
+    """
+    gc.collect()
+    objects_before = _count_objects()
+    rss_before = _max_rss()
+
+    profiler = cProfile.Profile()
+    start = time.time()
+    profiler.enable()
+    for i in range(iterations):
+        fn()
+    profiler.disable()
+    elapsed = time.time() - start
+
+    gc.collect()
+    objects_after = _count_objects()
+
+    out.write('%d iterations in %.3fs (%.3f ms/iteration)\n' %
+        (iterations, elapsed, elapsed * 1000.0 / max(iterations, 1)))
+    out.write('\nHot functions:\n')
+    stats = pstats.Stats(profiler, stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+
+    out.write('Allocations:\n')
+    out.write('   peak RSS: %d (+%d)\n' % (_max_rss(), _max_rss() - rss_before))
+    growth = []
+    for name, count in objects_after.items():
+        delta = count - objects_before.get(name, 0)
+        if delta:
+            growth.append((delta, name))
+    growth.sort(reverse=True)
+    out.write('   objects retained by type:\n')
+    for delta, name in growth[:10]:
+        out.write('      %+8d %s\n' % (delta, name))
+
+    if collapsed:
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            for i in range(iterations):
+                fn()
+        finally:
+            sampler.stop()
+        with open(collapsed, 'w') as f:
+            sampler.write(f)
+        out.write('\nWrote %d sampled stacks to %s\n' %
+            (sum(sampler.stacks.values()), collapsed))
+
+
+class Profiler(util.Plugin):
+    """Plugin to profile PaySwarm operations."""
+
+    def __init__(self, config_plugin=None):
+        """Creates the plugin.
+
+        config_plugin - the plugin holding the session config used for
+            register operations (optional).
+        """
+        self.config_plugin = config_plugin
+
+    def get_name(self):
+        return "Profiler"
+
+    def before_args_parsed(self, parser, subparsers):
+        subparser = subparsers.add_parser('profile',
+                help='Run an operation under a profiler.')
+        subparser.add_argument('operation', choices=OPERATIONS,
+                help='The operation to profile.')
+        subparser.add_argument('file', nargs='?',
+                default=os.path.join('listings', 'test.jsonld'),
+                help='The JSON-LD file with the items to use. '
+                '(default: %(default)s)')
+        subparser.add_argument('-n', '--iterations', type=int, default=100,
+                help='The number of iterations. (default: %(default)s)')
+        subparser.add_argument('--limit', type=int, default=25,
+                help='The number of hot functions to report. '
+                '(default: %(default)s)')
+        subparser.add_argument('--sort', default='cumulative',
+                choices=['cumulative', 'time', 'calls'],
+                help='The hot function sort order. (default: %(default)s)')
+        subparser.add_argument('--collapsed',
+                help='Write sampled stacks in collapsed-stack format to a '
+                'file for flamegraph tools.')
+        subparser.add_argument('--cold', action='store_true',
+                help='Clear key caches before every iteration.')
+        subparser.set_defaults(func=self.run)
+
+    def after_args_parsed(self, args):
+        pass
+
+    def _setup(self, args, service):
+        """Returns a function that performs one iteration of the operation."""
+        items = storage.load_items(args.file)
+
+        # sign with a throwaway key published by the mock service so
+        # profiling never touches a real authority
+        key_pair = RSA.generate(2048)
+        private_key_pem = key_pair.exportKey()
+        key_id = service.add_key('profile', key_pair.publickey().exportKey())
+
+        def _reset():
+            signature.clear_verified()
+            if args.cold:
+                keys.clear()
+
+        if args.operation == 'hash':
+            def _run():
+                for item in items:
+                    util.hash(item)
+        elif args.operation == 'sign':
+            def _run():
+                _reset()
+                for item in items:
+                    signature.sign(item, key_id, private_key_pem)
+        elif args.operation == 'verify':
+            signed = [signature.sign(item, key_id, private_key_pem)
+                for item in items]
+            def _run():
+                _reset()
+                for item in signed:
+                    signature.verify(item)
+        else:
+            session = {}
+            if self.config_plugin is not None:
+                session = self.config_plugin.config
+            sections = config.storage_config(session, service.url)
+            sections.set("application", "public-key-id", key_id)
+            sections.set("application", "private-key", private_key_pem)
+            def _run():
+                _reset()
+                signed_asset = storage.register_asset(sections, items[0])
+                storage.register_listing(sections, signed_asset, items[1])
+        return _run
+
+    def run(self, args):
+        service = mock.MockService().start()
+        try:
+            profile(self._setup(args, service), args.iterations,
+                limit=args.limit, sort=args.sort, collapsed=args.collapsed)
+        finally:
+            service.stop()
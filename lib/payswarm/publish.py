@@ -0,0 +1,416 @@
+"""The publish plugin signs and uploads a catalog from several nodes at once.
+
+The catalog is split into shards by a stable hash of each asset id; a
+listing goes to the shard of the asset it sells, so an asset is always
+signed before its listings by the node publishing its shard. Nodes share
+a work ledger, a SQLite file on storage they can all reach:
+
+    ./payswarm publish catalog.psc --ledger /shared/ledger.db --shards 64
+
+Each node claims a shard at a time with a lease, publishes it with the
+storage.populate_items and sign_items pipeline, and checkpoints its
+progress every CHECKPOINT_INTERVAL items, renewing its lease. A shard
+whose node fails or whose lease runs out is claimed again by another
+node and resumes from its last checkpoint. Every node must read the same
+catalog with the same shard count.
+
+A run whose shards are all published publishes nothing when started again;
+to publish it again, start one node with --reset before the others.
+"""
+from __future__ import with_statement
+
+import hashlib
+import os
+import socket
+import sqlite3
+import sys
+import time
+
+import codec
+import config
+import constants
+import scheduler
+import storage
+import util
+
+# number of items published between checkpoints
+CHECKPOINT_INTERVAL = 50
+
+# number of seconds a claimed shard stays with its node without a checkpoint
+LEASE = 300
+
+# default number of shards
+SHARDS = 16
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    run TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    node TEXT,
+    lease_expires REAL,
+    position INTEGER NOT NULL DEFAULT 0,
+    state TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (run, shard)
+)
+"""
+
+
+def _types(item):
+    types = item.get('type', [])
+    if not isinstance(types, list):
+        types = [types]
+    return types
+
+
+def shard_of(item, shards):
+    """Returns the shard of an unsigned asset or listing.
+
+    item - the asset or listing.
+    shards - the number of shards.
+    """
+    key = item['id']
+    if 'Listing' in _types(item) and item.get('asset'):
+        key = item['asset']
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return int(hashlib.sha256(key).hexdigest()[:16], 16) % shards
+
+
+def partition(items, shards):
+    """Splits items into shards, assets before listings in each.
+
+    items - the unsigned assets and listings of the catalog.
+    shards - the number of shards.
+
+    Returns a list of the items of each shard, indexed by shard number.
+    """
+    assets = [[] for shard in range(shards)]
+    listings = [[] for shard in range(shards)]
+    for item in items:
+        if 'Asset' in _types(item):
+            assets[shard_of(item, shards)].append(item)
+        else:
+            listings[shard_of(item, shards)].append(item)
+    return [assets[shard] + listings[shard] for shard in range(shards)]
+
+
+def shard_items(items, shard, shards):
+    """Returns the items of a shard, assets before listings.
+
+    items - the unsigned assets and listings of the catalog.
+    shard - the shard number.
+    shards - the number of shards.
+    """
+    return partition(items, shards)[shard]
+
+
+def default_node():
+    """Returns a node name unique to this process, HOSTNAME:PID."""
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+class Ledger(object):
+    """The shared record of which node is publishing which shard."""
+
+    def __init__(self, path):
+        """Opens a ledger, creating it if needed.
+
+        path - the SQLite file shared by the nodes.
+        """
+        self.path = path
+        # autocommit; transactions are started explicitly
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.execute(_SCHEMA)
+
+    def close(self):
+        """Closes the ledger."""
+        self._db.close()
+
+    def _transaction(self):
+        # take the write lock up front so two nodes never claim one shard
+        self._db.execute('BEGIN IMMEDIATE')
+        return self._db
+
+    def create(self, run, shards):
+        """Adds the shards of a run unless they already exist.
+
+        run - the name of the publishing run.
+        shards - the number of shards.
+        """
+        db = self._transaction()
+        try:
+            db.executemany(
+                'INSERT OR IGNORE INTO shards (run, shard) VALUES (?, ?)',
+                [(run, shard) for shard in range(shards)])
+            db.execute('COMMIT')
+        except:
+            db.execute('ROLLBACK')
+            raise
+
+    def reset(self, run):
+        """Marks the published shards of a run as pending so they are
+        published again.
+
+        run - the name of the publishing run.
+
+        Returns the number of shards reset.
+        """
+        cursor = self._db.execute(
+            "UPDATE shards SET status = 'pending', node = NULL, "
+            "lease_expires = NULL, position = 0, state = NULL, "
+            "attempts = 0, error = NULL WHERE run = ? AND status = 'done'",
+            (run,))
+        return cursor.rowcount
+
+    def claim(self, run, node, lease=LEASE):
+        """Claims a pending shard or one whose lease has run out.
+
+        run - the name of the publishing run.
+        node - the name of the claiming node.
+        lease - the number of seconds until the claim runs out.
+
+        Returns the shard number, checkpointed position and checkpointed
+        state, or None if no shard is left to claim.
+        """
+        now = time.time()
+        db = self._transaction()
+        try:
+            row = db.execute(
+                "SELECT shard, position, state FROM shards WHERE run = ? AND "
+                "(status = 'pending' OR (status = 'claimed' AND "
+                "lease_expires < ?)) ORDER BY attempts, shard LIMIT 1",
+                (run, now)).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE shards SET status = 'claimed', node = ?, "
+                    "lease_expires = ?, attempts = attempts + 1 "
+                    "WHERE run = ? AND shard = ?",
+                    (node, now + lease, run, row[0]))
+            db.execute('COMMIT')
+        except:
+            db.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        state = {}
+        if row[2]:
+            state = codec.loads(row[2])
+        return row[0], row[1], state
+
+    def checkpoint(self, run, shard, node, position, state, lease=LEASE):
+        """Records a node's progress on a shard and renews its lease.
+
+        run - the name of the publishing run.
+        shard - the shard number.
+        node - the node that claimed the shard.
+        position - the number of the shard's items published.
+        state - a JSON object needed to resume from position.
+        lease - the number of seconds until the renewed claim runs out.
+
+        Raises an exception if the node no longer holds the shard.
+        """
+        self._update(run, shard, node,
+            "position = ?, state = ?, lease_expires = ?",
+            (position, codec.dumps(state), time.time() + lease))
+
+    def complete(self, run, shard, node):
+        """Marks a shard as published."""
+        self._update(run, shard, node,
+            "status = 'done', lease_expires = NULL, error = NULL", ())
+
+    def release(self, run, shard, node, error=None):
+        """Gives up a shard so another node can claim it.
+
+        error - the error message to record, None to keep the last one.
+        """
+        self._update(run, shard, node,
+            "status = 'pending', node = NULL, lease_expires = NULL, "
+            "error = COALESCE(?, error)", (error,))
+
+    def _update(self, run, shard, node, assignments, values):
+        cursor = self._db.execute(
+            "UPDATE shards SET " + assignments + " WHERE run = ? AND "
+            "shard = ? AND node = ? AND status = 'claimed'",
+            tuple(values) + (run, shard, node))
+        if cursor.rowcount != 1:
+            raise Exception('Shard %d of "%s" is no longer claimed by "%s".' %
+                (shard, run, node))
+
+    def status(self, run):
+        """Returns the shards of a run as dicts with shard, status, node,
+        position, attempts and error."""
+        rows = self._db.execute(
+            "SELECT shard, status, node, position, attempts, error "
+            "FROM shards WHERE run = ? ORDER BY shard", (run,))
+        return [dict(zip(['shard', 'status', 'node', 'position', 'attempts',
+            'error'], row)) for row in rows]
+
+
+def publish_shard(sections, items, ledger, run, shard, node,
+        position=0, state=None, lease=LEASE):
+    """Signs and uploads the items of a claimed shard.
+
+    sections - the storage configuration (see config.storage_config).
+    items - the shard's unsigned items, see partition.
+    ledger - the Ledger the shard was claimed from.
+    run - the name of the publishing run.
+    shard - the shard number.
+    node - the node that claimed the shard.
+    position - the number of items already published, from the claim.
+    state - the checkpointed state, from the claim.
+    lease - the number of seconds each checkpoint renews the claim for.
+
+    Returns the number of items published.
+    """
+    listings_url = sections.get('general', 'listings-url')
+    # hashes of the shard's signed assets, keyed by asset id
+    asset_hashes = dict((state or {}).get('assetHashes', {}))
+    remaining = items[position:]
+    # listings of assets that are not in the shard sell the published asset
+    asset_ids = set(item['id'] for item in remaining
+        if 'Asset' in _types(item))
+    for item in remaining:
+        asset_id = item.get('asset')
+        if 'Listing' in _types(item) and asset_id and \
+                asset_id not in asset_ids and \
+                listings_url + asset_id not in asset_hashes:
+            asset_hashes[listings_url + asset_id] = util.hash(
+                storage.fetch(sections, {'id': asset_id}))
+
+    published = 0
+    signed_items = storage.sign_items(sections,
+        storage.populate_items(sections, remaining, asset_hashes),
+        asset_hashes)
+    for signed in signed_items:
+        util.upload(signed['id'], signed, priority=scheduler.PUBLISH)
+        published += 1
+        if published % CHECKPOINT_INTERVAL == 0:
+            ledger.checkpoint(run, shard, node, position + published,
+                {'assetHashes': asset_hashes}, lease)
+    return published
+
+
+def run_node(sections, source, ledger, run, shards=SHARDS, node=None,
+        lease=LEASE):
+    """Claims and publishes shards until none are left.
+
+    sections - the storage configuration (see config.storage_config).
+    source - the catalog archive or JSON-LD file, see storage.iter_items.
+    ledger - the shared Ledger.
+    run - the name of the publishing run.
+    shards - the number of shards, the same on every node.
+    node - the name of this node (default: default_node()).
+    lease - the number of seconds a claim lasts between checkpoints.
+
+    Returns {'shards', 'items', 'failed'} counts for this node. A shard
+    that fails is released with its error for any node to claim again.
+    """
+    node = node or default_node()
+    ledger.create(run, shards)
+    stats = {'shards': 0, 'items': 0, 'failed': 0}
+    failed = set()
+    # the catalog's items by shard, read once when the first shard is claimed
+    parts = None
+    while True:
+        claim = ledger.claim(run, node, lease)
+        if claim is None:
+            break
+        shard, position, state = claim
+        if shard in failed:
+            # leave shards this node could not publish to other nodes
+            ledger.release(run, shard, node)
+            break
+        if parts is None:
+            parts = partition(storage.iter_items(source), shards)
+        try:
+            stats['items'] += publish_shard(sections, parts[shard], ledger,
+                run, shard, node, position, state, lease)
+            ledger.complete(run, shard, node)
+            stats['shards'] += 1
+        except Exception, e:
+            failed.add(shard)
+            stats['failed'] += 1
+            try:
+                ledger.release(run, shard, node, str(e))
+            except Exception:
+                # the lease ran out and another node claimed the shard
+                pass
+    return stats
+
+
+class Publish(util.Plugin):
+    """Plugin to publish a catalog from several nodes sharing a ledger."""
+
+    def __init__(self, config_plugin):
+        """Creates the plugin.
+
+        config_plugin - the plugin holding the session config.
+        """
+        self.config_plugin = config_plugin
+
+    def get_name(self):
+        return "Publish"
+
+    def before_args_parsed(self, parser, subparsers):
+        subparser = subparsers.add_parser('publish',
+                help='Publish catalog shards claimed from a shared ledger.')
+        subparser.add_argument('source',
+                help='The catalog archive or JSON-LD file of unsigned '
+                'assets and listings.')
+        subparser.add_argument('--ledger', required=True,
+                help='The SQLite work ledger shared by all nodes.')
+        subparser.add_argument('--run',
+                help='The name of the publishing run. (default: the '
+                'source file name)')
+        subparser.add_argument('--shards', type=int, default=SHARDS,
+                help='The number of shards, the same on every node. '
+                '(default: %(default)s)')
+        subparser.add_argument('--node',
+                help='The name of this node. (default: HOSTNAME:PID)')
+        subparser.add_argument('--lease', type=float, default=LEASE,
+                help='Seconds a claimed shard is held between checkpoints. '
+                '(default: %(default)s)')
+        subparser.add_argument('--listings-url',
+                default=constants.DEFAULT_LISTINGS_URL,
+                help='URL for the Web Service that stores assets and '
+                'listings. (default: %(default)s)')
+        subparser.add_argument('--status', action='store_true',
+                help='Show the state of each shard instead of publishing.')
+        subparser.add_argument('--reset', action='store_true',
+                help='Publish the published shards of the run again. Pass '
+                'it to one node only, before starting the others.')
+        subparser.set_defaults(func=self.run)
+
+    def after_args_parsed(self, args):
+        pass
+
+    def run(self, args):
+        run = args.run or os.path.basename(args.source)
+        ledger = Ledger(args.ledger)
+        try:
+            if args.status:
+                for shard in ledger.status(run):
+                    print "%(shard)4d %(status)-8s %(position)6d items " \
+                        "%(attempts)d attempts %(node)s" % shard
+                    if shard['error']:
+                        print "     ERROR: %s" % shard['error']
+                return
+            if args.reset:
+                print "Reset %d published shards" % ledger.reset(run)
+            sections = config.storage_config(
+                self.config_plugin.config, args.listings_url)
+            stats = run_node(sections, args.source, ledger, run,
+                args.shards, args.node, args.lease)
+            done = [shard['status'] == 'done' for shard in ledger.status(run)]
+        finally:
+            ledger.close()
+        print "Published %(items)d items in %(shards)d shards, " \
+            "%(failed)d failed" % stats
+        if not stats['shards'] and not stats['failed'] and all(done):
+            print 'All shards of "%s" were already published; use --reset ' \
+                'to publish them again.' % run
+        if stats['failed']:
+            sys.exit(1)
@@ -0,0 +1,45 @@
+"""The purchase module requests purchases of PaySwarm listings."""
+import codec
+import constants
+import scheduler
+import signature
+import util
+
+
+def create_request(listing, source, listing_hash=None):
+    """Creates an unsigned purchase request for a listing.
+
+    listing - the listing to purchase.
+    source - the financial account to pay from.
+    listing_hash - the hash of the listing the buyer agreed to, defaults to
+        util.hash() of the listing given.
+
+    Returns the PurchaseRequest.
+    """
+    return {
+        '@context': constants.CONTEXT_URL,
+        'type': 'PurchaseRequest',
+        'listing': listing['id'],
+        'listingHash': listing_hash or util.hash(listing),
+        'source': source
+    }
+
+
+def purchase(contracts_url, listing, source, public_key_id, private_key_pem,
+        listing_hash=None):
+    """Purchases a listing.
+
+    contracts_url - the PaySwarm Authority contracts service URL (see
+        discovery.get_endpoint(config_url, 'contracts-url')).
+    listing - the listing to purchase.
+    source - the financial account to pay from.
+    public_key_id - the public key id to sign the request with.
+    private_key_pem - the private key in PEM-encoded format.
+    listing_hash - see create_request.
+
+    Returns the Receipt.
+    """
+    request = signature.sign(create_request(listing, source, listing_hash),
+        public_key_id, private_key_pem)
+    res = util.upload(contracts_url, request, priority=scheduler.PURCHASE)
+    return codec.loads(res.data)
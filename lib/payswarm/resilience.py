@@ -0,0 +1,199 @@
+"""The resilience module keeps slow or failing hosts from stalling clients.
+
+Each host has a circuit breaker. After FAILURE_THRESHOLD consecutive
+failures (errors, timeouts or 5xx responses) its circuit opens and requests
+to it fail at once instead of waiting on the network. After RESET_TIMEOUT
+seconds one trial request is let through; its success closes the circuit
+and its failure opens it again.
+
+The breaker also keeps recent response times for each host, which are used
+to hedge GET requests: when a request has taken longer than the host's
+HEDGE_PERCENTILE latency a second, identical request is sent and whichever
+answers first is used. Hedging is off unless HEDGE is set or util.get is
+called with hedge=True.
+"""
+from __future__ import with_statement
+
+import collections
+import math
+import Queue
+import sys
+import threading
+import time
+import urlparse
+
+# consecutive failures that open a host's circuit
+FAILURE_THRESHOLD = 5
+
+# seconds an open circuit fails fast before a trial request is allowed
+RESET_TIMEOUT = 30
+
+# whether util.get hedges requests by default
+HEDGE = False
+
+# percentile of recent response times after which a request is hedged
+HEDGE_PERCENTILE = 95
+
+# response times needed for a host before its requests are hedged
+HEDGE_MIN_SAMPLES = 20
+
+# response times kept for each host
+LATENCY_SAMPLES = 200
+
+
+class _Host(object):
+    """The circuit state and response times of one host."""
+
+    def __init__(self):
+        self.failures = 0
+        # when the circuit opened, None while closed
+        self.opened = None
+        self.trial = False
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.opens = 0
+        self.rejected = 0
+
+
+class Breaker(object):
+    """Tracks the health of hosts and fails requests to unhealthy ones."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+        # requests hedged and hedge requests that answered first
+        self.hedge_stats = {'hedged': 0, 'won': 0}
+
+    def _host(self, url):
+        host = urlparse.urlsplit(url).netloc
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _Host()
+        return state
+
+    def before(self, url):
+        """Checks that a request to a URL may be sent.
+
+        url - the URL to be requested.
+
+        Raises an exception if the host's circuit is open.
+        """
+        with self._lock:
+            state = self._host(url)
+            if state.opened is None:
+                return
+            if not state.trial and \
+                    time.time() - state.opened >= RESET_TIMEOUT:
+                state.trial = True
+                return
+            state.rejected += 1
+        raise Exception('Circuit open for "%s", not sending request.' %
+            urlparse.urlsplit(url).netloc)
+
+    def success(self, url, seconds):
+        """Records a successful request.
+
+        url - the requested URL.
+        seconds - the time the request took.
+        """
+        with self._lock:
+            state = self._host(url)
+            state.failures = 0
+            state.opened = None
+            state.trial = False
+            state.latencies.append(seconds)
+
+    def failure(self, url):
+        """Records a failed request.
+
+        url - the requested URL.
+        """
+        with self._lock:
+            state = self._host(url)
+            state.failures += 1
+            if state.trial or (state.opened is None and
+                    state.failures >= FAILURE_THRESHOLD):
+                state.opened = time.time()
+                state.opens += 1
+            state.trial = False
+
+    def hedge_delay(self, url):
+        """Returns the seconds after which a request to a URL is hedged, or
+        None if too few response times are known."""
+        with self._lock:
+            latencies = sorted(self._host(url).latencies)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        rank = int(math.ceil(HEDGE_PERCENTILE / 100.0 * len(latencies))) - 1
+        return latencies[min(max(rank, 0), len(latencies) - 1)]
+
+    def hedge(self, fn, delay):
+        """Calls fn, calling it a second time if it takes longer than delay.
+
+        fn - the idempotent function to call.
+        delay - the seconds to wait before the second call.
+
+        Returns the first successful result. The exception of the last call to
+        fail is raised if both fail.
+        """
+        results = Queue.Queue()
+
+        def _call(n):
+            try:
+                results.put((n, fn(), None))
+            except Exception:
+                results.put((n, None, sys.exc_info()))
+
+        def _start(n):
+            thread = threading.Thread(target=_call, args=(n,))
+            thread.daemon = True
+            thread.start()
+
+        _start(0)
+        calls = 1
+        try:
+            n, result, error = results.get(timeout=delay)
+        except Queue.Empty:
+            with self._lock:
+                self.hedge_stats['hedged'] += 1
+            _start(1)
+            calls = 2
+            n, result, error = results.get()
+        if error is not None and calls == 2:
+            n, result, error = results.get()
+        if error is not None:
+            raise error[0], error[1], error[2]
+        if n == 1:
+            with self._lock:
+                self.hedge_stats['won'] += 1
+        return result
+
+    def stats(self):
+        """Returns the circuit state, consecutive failures, times opened and
+        rejected requests of each host."""
+        with self._lock:
+            return dict((host, {
+                'open': state.opened is not None,
+                'failures': state.failures,
+                'opens': state.opens,
+                'rejected': state.rejected
+            }) for host, state in self._hosts.items())
+
+    def clear(self):
+        """Closes every circuit and forgets all response times."""
+        with self._lock:
+            self._hosts.clear()
+            self.hedge_stats = {'hedged': 0, 'won': 0}
+
+
+# the breaker used by payswarm.util
+breaker = Breaker()
+
+
+def stats():
+    """Returns the shared breaker's host metrics, see Breaker.stats."""
+    return breaker.stats()
+
+
+def clear():
+    """Resets the shared breaker, see Breaker.clear."""
+    breaker.clear()
@@ -0,0 +1,395 @@
+"""The revocation module keeps a local index of PaySwarm key status.
+
+The index is synced in bulk from key status documents published by trusted
+authorities, so signatures can be checked against revoked keys without
+fetching each key document, and verified offline between syncs:
+
+    {
+      "authority": "https://authority.example.com/",
+      "revoked": ["https://authority.example.com/i/bob/keys/1", ...],
+      "keys": [{"id": "...", "owner": "...", "publicKeyPem": "..."}, ...]
+    }
+
+"authority" is the base URL of the keys the authority is trusted for. It
+must be on the host the document is fetched from, and "revoked" and "keys"
+entries outside it are ignored. "keys" is optional. The index is stored at PAYSWARM_CONFIG_DIR/keystatus
+in a compact binary format:
+
+    header:  magic (8 bytes), sync time (double), Bloom filter bits
+             (uint32), Bloom filter hashes (uint32), revoked count (uint32),
+             trusted count (uint32), keys length (uint32)
+    bloom:   the Bloom filter bits
+    revoked: SHA-256 of each revoked key id (32 bytes), sorted
+    trusted: authority URL length (uint16), authority URL (UTF-8) ...
+    keys:    public key documents (compact JSON, UTF-8)
+
+All integers are big-endian. Lookups hash the key id once; the Bloom filter
+answers most lookups of keys that are not revoked without touching the
+revoked set.
+"""
+from __future__ import with_statement
+
+import hashlib
+import json
+import logging
+import math
+import os
+import struct
+import sys
+import time
+import urlparse
+
+import scheduler
+import util
+
+MAGIC = 'PSKSv1\n\0'
+
+_HEADER = struct.Struct('>8sdIIIII')
+_AUTHORITY = struct.Struct('>H')
+_HASHES = struct.Struct('>QQ')
+
+# target false positive rate of the Bloom filter
+BLOOM_ERROR_RATE = 0.01
+
+# number of seconds after a sync before the index should be synced again
+SYNC_INTERVAL = 60 * 60
+
+# number of seconds between checks for an index updated by another process
+RELOAD_INTERVAL = 10
+
+# (index, path, mtime, next check) for the default index
+_loaded = [None, None, None, 0]
+
+
+def default_path():
+    """Returns the default key status index path.
+
+    PAYSWARM_CONFIG_DIR/keystatus
+    """
+    return os.path.join(util.config_dir(), 'keystatus')
+
+
+def _under(key_id, authority):
+    """Returns whether a key id is under an authority base URL."""
+    key = urlparse.urlsplit(key_id)
+    base = urlparse.urlsplit(authority)
+    # compare whole hosts and path segments so that https://a.example.com
+    # does not cover a.example.com.evil.com
+    path = base.path
+    if not path.endswith('/'):
+        path += '/'
+    return key.scheme.lower() == base.scheme.lower() and \
+        key.netloc.lower() == base.netloc.lower() and \
+        key.path.startswith(path)
+
+
+def _digest(key_id):
+    if isinstance(key_id, unicode):
+        key_id = key_id.encode('utf-8')
+    return hashlib.sha256(key_id).digest()
+
+
+class BloomFilter(object):
+    """A Bloom filter over SHA-256 digests."""
+
+    def __init__(self, bits, hashes, data=None):
+        """Creates a new Bloom filter.
+
+        bits - the number of bits in the filter.
+        hashes - the number of bit positions set per digest.
+        data - the filter bits, empty if not given (optional).
+        """
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data or (bits + 7) // 8)
+
+    @classmethod
+    def sized(cls, count, error_rate=BLOOM_ERROR_RATE):
+        """Creates an empty filter sized for count digests."""
+        count = max(count, 1)
+        bits = int(-count * math.log(error_rate) / (math.log(2) ** 2))
+        bits = max(64, (bits + 7) // 8 * 8)
+        hashes = max(1, int(round(bits / float(count) * math.log(2))))
+        return cls(bits, hashes)
+
+    def _positions(self, digest):
+        h1, h2 = _HASHES.unpack_from(digest)
+        for i in xrange(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, digest):
+        """Adds a SHA-256 digest to the filter."""
+        for bit in self._positions(digest):
+            self.data[bit >> 3] |= 1 << (bit & 7)
+
+    def __contains__(self, digest):
+        for bit in self._positions(digest):
+            if not self.data[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+
+class KeyStatusIndex(object):
+    """Revoked key ids, trusted authorities and known public keys."""
+
+    def __init__(self, revoked=(), trusted=(), keys=(), synced=0):
+        """Creates a new index.
+
+        revoked - the revoked key ids.
+        trusted - the base URLs of trusted authorities.
+        keys - public key documents usable without fetching them.
+        synced - the time the index was synced.
+        """
+        self.revoked = frozenset(_digest(key_id) for key_id in revoked)
+        self.trusted = sorted(set(trusted))
+        self.keys = dict((key['id'], key) for key in keys
+            if _digest(key['id']) not in self.revoked)
+        self.synced = synced
+        self.bloom = BloomFilter.sized(len(self.revoked))
+        for digest in self.revoked:
+            self.bloom.add(digest)
+
+    def is_revoked(self, key_id):
+        """Returns whether a key id is in the revoked set."""
+        digest = _digest(key_id)
+        return digest in self.bloom and digest in self.revoked
+
+    def is_trusted(self, key_id):
+        """Returns whether a key id belongs to a trusted authority.
+
+        Every key is trusted if the index lists no authorities.
+        """
+        if not self.trusted:
+            return True
+        for authority in self.trusted:
+            if _under(key_id, authority):
+                return True
+        return False
+
+    def get_key(self, key_id):
+        """Returns a synced public key document or None."""
+        return self.keys.get(key_id)
+
+    def is_stale(self):
+        """Returns whether SYNC_INTERVAL has passed since the last sync."""
+        return time.time() - self.synced > SYNC_INTERVAL
+
+    def save(self, path=None):
+        """Writes the index to disk atomically.
+
+        path - the file to write (default: default_path()).
+        """
+        path = path or default_path()
+        keys = json.dumps(
+            [self.keys[key_id] for key_id in sorted(self.keys)],
+            sort_keys=True, separators=(',', ':'))
+        if isinstance(keys, unicode):
+            keys = keys.encode('utf-8')
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        tmp = path + '.%d.tmp' % os.getpid()
+        with open(tmp, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, self.synced, self.bloom.bits,
+                self.bloom.hashes, len(self.revoked), len(self.trusted),
+                len(keys)))
+            f.write(str(self.bloom.data))
+            f.write(''.join(sorted(self.revoked)))
+            for authority in self.trusted:
+                authority = authority.encode('utf-8')
+                f.write(_AUTHORITY.pack(len(authority)))
+                f.write(authority)
+            f.write(keys)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path=None):
+        """Reads an index from disk.
+
+        path - the file to read (default: default_path()).
+        """
+        path = path or default_path()
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < _HEADER.size:
+            raise Exception('Key status index is truncated: %s' % path)
+        magic, synced, bits, hashes, revoked_count, trusted_count, \
+            keys_length = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise Exception('Not a key status index: %s' % path)
+
+        offset = _HEADER.size
+        bloom = data[offset:offset + (bits + 7) // 8]
+        offset += len(bloom)
+        revoked = [data[offset + i * 32:offset + (i + 1) * 32]
+            for i in xrange(revoked_count)]
+        offset += revoked_count * 32
+        trusted = []
+        for i in xrange(trusted_count):
+            length, = _AUTHORITY.unpack_from(data, offset)
+            offset += _AUTHORITY.size
+            trusted.append(data[offset:offset + length].decode('utf-8'))
+            offset += length
+        keys = data[offset:offset + keys_length]
+        if offset + keys_length != len(data):
+            raise Exception('Key status index is truncated: %s' % path)
+
+        # reuse the stored filter rather than rebuilding it
+        index = cls.__new__(cls)
+        index.revoked = frozenset(revoked)
+        index.trusted = trusted
+        index.keys = dict((key['id'], key) for key in json.loads(keys))
+        index.synced = synced
+        index.bloom = BloomFilter(bits, hashes, bloom)
+        return index
+
+
+def fetch(urls):
+    """Builds an index from authority key status documents.
+
+    urls - the URLs of the key status documents to sync from. Every
+        authority named in them is trusted.
+
+    Returns the new index. Nothing is returned if any document cannot be
+    fetched or names an authority on another host, so a failed sync never
+    replaces a good index. Revoked key ids and keys outside the authority
+    of the document listing them are ignored, so one authority cannot
+    publish or revoke keys of another.
+    """
+    revoked = []
+    trusted = []
+    keys = []
+    for url in urls:
+        status = util.get(url, priority=scheduler.KEY)
+        if 'authority' not in status:
+            raise Exception('Key status document has no authority: %s' % url)
+        authority = status['authority']
+        base = urlparse.urlsplit(authority)
+        source = urlparse.urlsplit(url)
+        if base.scheme.lower() != source.scheme.lower() or \
+                base.netloc.lower() != source.netloc.lower():
+            raise Exception('Key status document %s names authority %s on '
+                'another host.' % (url, authority))
+        trusted.append(authority)
+        for key_id in status.get('revoked', []):
+            if _under(key_id, authority):
+                revoked.append(key_id)
+            else:
+                logging.warning('Ignoring revoked key %s outside authority '
+                    '%s.', key_id, authority)
+        for key in status.get('keys', []):
+            if _under(key['id'], authority):
+                keys.append(key)
+            else:
+                logging.warning('Ignoring key %s outside authority %s.',
+                    key['id'], authority)
+    return KeyStatusIndex(revoked, trusted, keys, time.time())
+
+
+def sync(urls, path=None):
+    """Fetches key status documents and replaces the stored index.
+
+    urls - the URLs of the key status documents to sync from.
+    path - the index file (default: default_path()).
+
+    Returns the new index.
+    """
+    index = fetch(urls)
+    index.save(path)
+    _loaded[:] = [None, None, None, 0]
+    return index
+
+
+def get_index():
+    """Returns the default index, or None if it has never been synced.
+
+    The index is reloaded when another process syncs it. If it cannot be
+    read, the last index read is kept; an exception is raised if there is
+    none, since an empty index would revoke and distrust nothing.
+    """
+    now = time.time()
+    if now < _loaded[3]:
+        return _loaded[0]
+    path = default_path()
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+    if mtime is None:
+        _loaded[:] = [None, path, None, now + RELOAD_INTERVAL]
+    elif path != _loaded[1] or mtime != _loaded[2]:
+        try:
+            index = KeyStatusIndex.load(path)
+        except Exception, e:
+            # fail closed until the next sync replaces the file
+            if _loaded[0] is None or path != _loaded[1]:
+                raise Exception('The key status index %s cannot be read, '
+                    'sync it again: %s' % (path, e))
+            logging.warning('Keeping the last key status index, %s cannot '
+                'be read: %s', path, e)
+            index = _loaded[0]
+        _loaded[:] = [index, path, mtime, now + RELOAD_INTERVAL]
+    else:
+        _loaded[3] = now + RELOAD_INTERVAL
+    return _loaded[0]
+
+
+def clear():
+    """Forgets the loaded default index. The file is left in place."""
+    _loaded[:] = [None, None, None, 0]
+
+
+class Revocation(util.Plugin):
+    """Plugin to sync and query the local key status index."""
+
+    def get_name(self):
+        return "Revocation"
+
+    def before_args_parsed(self, parser, subparsers):
+        subparser = subparsers.add_parser('revocation',
+                help='Sync and query the local key status index.')
+        actions = subparser.add_subparsers(title='actions')
+
+        sync = actions.add_parser('sync',
+                help='Sync the index from authority key status documents.')
+        sync.add_argument('urls', nargs='+', metavar='URL',
+                help='A key status document URL.')
+        sync.set_defaults(func=self.sync)
+
+        check = actions.add_parser('check',
+                help='Show the status of a key.')
+        check.add_argument('key', help='The public key id.')
+        check.set_defaults(func=self.check)
+
+    def after_args_parsed(self, args):
+        pass
+
+    def sync(self, args):
+        index = sync(args.urls)
+        print "Synced %d revoked keys, %d trusted authorities, %d keys" % (
+            len(index.revoked), len(index.trusted), len(index.keys))
+
+    def check(self, args):
+        try:
+            index = get_index()
+        except Exception, e:
+            print "ERROR: %s" % e
+            sys.exit(1)
+        if index is None:
+            print "ERROR: The key status index has not been synced."
+            sys.exit(1)
+        if index.is_stale():
+            print "WARNING: The key status index is out of date."
+        if index.is_revoked(args.key):
+            print "%s: revoked" % args.key
+            sys.exit(1)
+        if not index.is_trusted(args.key):
+            print "%s: untrusted" % args.key
+            sys.exit(1)
+        if index.get_key(args.key) is not None:
+            print "%s: OK (synced)" % args.key
+        else:
+            print "%s: OK" % args.key
+
+    def run(self, args):
+        pass
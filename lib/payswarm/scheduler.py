@@ -0,0 +1,219 @@
+"""The scheduler module paces outbound requests to each host.
+
+Hosts are not rate limited unless a limit is configured, either for one
+host or as the default RATE for all hosts:
+
+    payswarm.scheduler.configure('authority.example.com', rate=5, burst=10)
+
+Every request made through payswarm.util to a limited host then waits for
+a token from the host's token bucket before it is sent. When several
+requests for a host are waiting, the one with the highest priority class
+goes first, so a bulk publish cannot hold up a purchase:
+
+    PURCHASE > KEY > DEFAULT > PUBLISH
+
+A 429 or 503 response with a Retry-After header pauses the whole host until
+the time given has passed, whether or not the host is limited.
+"""
+from __future__ import with_statement
+
+import email.utils
+import heapq
+import itertools
+import threading
+import time
+import urlparse
+
+# priority classes, lower values are sent first
+PURCHASE = 0
+KEY = 1
+DEFAULT = 2
+PUBLISH = 3
+
+# names of the priority classes, indexed by priority
+PRIORITY_NAMES = ['purchase', 'key', 'default', 'publish']
+
+# requests per second allowed to a host, None for no limit
+RATE = None
+
+# number of requests that may be sent at once to an idle host with a rate
+BURST = 50
+
+# longest pause in seconds honored from a Retry-After header
+MAX_RETRY_AFTER = 300
+
+# statuses whose Retry-After header pauses a host
+RETRY_AFTER_STATUSES = (429, 503)
+
+
+class _Host(object):
+    """The token bucket, wait queue and metrics for one host."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        # no requests are sent before this time (see Retry-After)
+        self.paused_until = 0
+        # waiting requests as (priority, sequence) pairs
+        self.queue = []
+        self.depth = [0] * len(PRIORITY_NAMES)
+        self.max_depth = 0
+        self.sent = 0
+        self.waited = 0.0
+        self.paused = 0
+
+    def delay(self, now):
+        """Returns the seconds until a request may be sent, refilling the
+        bucket as of now."""
+        if self.rate is None:
+            return max(self.paused_until - now, 0)
+        self.tokens = min(self.burst,
+            self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = 0
+        if self.tokens < 1:
+            wait = (1 - self.tokens) / self.rate
+        return max(self.paused_until - now, wait, 0)
+
+
+class Scheduler(object):
+    """Paces requests with per-host token buckets and priority queues."""
+
+    def __init__(self, rate=RATE, burst=BURST):
+        """Creates a new scheduler.
+
+        rate - the default requests per second for a host, None for no limit.
+        burst - the default bucket size for a host.
+        """
+        self.rate = rate
+        self.burst = burst
+        self._limits = {}
+        self._hosts = {}
+        self._cond = threading.Condition(threading.Lock())
+        self._sequence = itertools.count()
+
+    def configure(self, host, rate=None, burst=None):
+        """Sets the limits for a host.
+
+        host - the host name, with a port if not the default.
+        rate - the requests per second, None for no limit.
+        burst - the bucket size (default: rate or the default burst).
+        """
+        if burst is None:
+            burst = max(int(rate or 0), 1) if rate else self.burst
+        with self._cond:
+            self._limits[host] = (rate, burst)
+            self._hosts.pop(host, None)
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            rate, burst = self._limits.get(host, (self.rate, self.burst))
+            state = self._hosts[host] = _Host(rate, burst)
+        return state
+
+    def acquire(self, url, priority=DEFAULT):
+        """Waits until a request to a URL may be sent.
+
+        url - the URL to be requested.
+        priority - the priority class of the request.
+        """
+        host = urlparse.urlsplit(url).netloc
+        start = time.time()
+        with self._cond:
+            state = self._host(host)
+            entry = (priority, next(self._sequence))
+            heapq.heappush(state.queue, entry)
+            state.depth[priority] += 1
+            state.max_depth = max(state.max_depth, len(state.queue))
+            while True:
+                timeout = None
+                if state.queue[0] == entry:
+                    timeout = state.delay(time.time())
+                    if timeout <= 0:
+                        break
+                self._cond.wait(timeout)
+            heapq.heappop(state.queue)
+            state.depth[priority] -= 1
+            if state.rate is not None:
+                state.tokens -= 1
+            state.sent += 1
+            state.waited += time.time() - start
+            # the next request in line may be able to go now
+            self._cond.notify_all()
+
+    def release(self, url, status, headers):
+        """Records the response to a request.
+
+        url - the requested URL.
+        status - the response status code.
+        headers - the response headers with lowercased names.
+        """
+        if status not in RETRY_AFTER_STATUSES:
+            return
+        delay = parse_retry_after(headers.get('retry-after'))
+        if delay is None:
+            return
+        host = urlparse.urlsplit(url).netloc
+        with self._cond:
+            state = self._host(host)
+            until = time.time() + min(delay, MAX_RETRY_AFTER)
+            if until > state.paused_until:
+                state.paused_until = until
+                state.paused += 1
+            self._cond.notify_all()
+
+    def stats(self):
+        """Returns metrics for each host.
+
+        For each host: the number of queued requests by priority class name,
+        the deepest the queue has been, the number of requests sent, the
+        total seconds they waited and the number of Retry-After pauses.
+        """
+        with self._cond:
+            return dict((host, {
+                'queued': dict(zip(PRIORITY_NAMES, state.depth)),
+                'max_queued': state.max_depth,
+                'sent': state.sent,
+                'waited': state.waited,
+                'paused': state.paused
+            }) for host, state in self._hosts.items())
+
+    def clear(self):
+        """Forgets the state of every host, keeping configured limits."""
+        with self._cond:
+            self._hosts = dict(
+                (host, state) for host, state in self._hosts.items()
+                if state.queue)
+
+
+def parse_retry_after(value):
+    """Returns the seconds to wait given by a Retry-After header or None.
+
+    value - the header value, either a number of seconds or an HTTP date.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(email.utils.mktime_tz(parsed) - time.time(), 0)
+
+
+# the scheduler used by payswarm.util
+scheduler = Scheduler()
+
+
+def configure(host, rate=None, burst=None):
+    """Sets the limits for a host, see Scheduler.configure."""
+    scheduler.configure(host, rate, burst)
+
+
+def stats():
+    """Returns the shared scheduler's metrics, see Scheduler.stats."""
+    return scheduler.stats()
@@ -0,0 +1,383 @@
+"""The search module queries signed listings in a local SQLite index.
+
+Listings are indexed from catalog archives or JSON-LD files of signed
+assets and listings, so questions about a published catalog are answered
+without fetching it from the listings service again:
+
+    ./payswarm search index catalog.psc
+    ./payswarm search query --vendor https://example.com/i/bob \\
+        --currency USD --max-rate 0.10 --rule-type Percentage
+
+Listings are indexed by vendor, asset, license and validity dates, each
+payee by destination, currency, rate and rate type and each payee rule by
+rate type. The title and comment of a listing, its payees and the asset it
+sells are in a full-text index. Rate types are compared without their
+"com:" prefix.
+
+Filters on payees match listings with at least one payee that satisfies
+all of them.
+"""
+from __future__ import with_statement
+
+import os
+import sqlite3
+import sys
+import time
+
+import codec
+import storage
+import util
+
+# number of listings returned by the search command by default
+LIMIT = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    id TEXT PRIMARY KEY,
+    title TEXT
+);
+CREATE TABLE IF NOT EXISTS listings (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    vendor TEXT,
+    asset TEXT,
+    license TEXT,
+    valid_from TEXT,
+    valid_until TEXT,
+    title TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS listings_vendor ON listings (vendor);
+CREATE INDEX IF NOT EXISTS listings_asset ON listings (asset);
+CREATE INDEX IF NOT EXISTS listings_license ON listings (license);
+CREATE INDEX IF NOT EXISTS listings_valid_from ON listings (valid_from);
+CREATE INDEX IF NOT EXISTS listings_valid_until ON listings (valid_until);
+CREATE TABLE IF NOT EXISTS payees (
+    listing INTEGER NOT NULL,
+    destination TEXT,
+    currency TEXT,
+    rate REAL,
+    rate_type TEXT
+);
+CREATE INDEX IF NOT EXISTS payees_listing ON payees (listing);
+CREATE INDEX IF NOT EXISTS payees_destination
+    ON payees (destination, currency, rate);
+CREATE INDEX IF NOT EXISTS payees_currency ON payees (currency, rate);
+CREATE TABLE IF NOT EXISTS rules (
+    listing INTEGER NOT NULL,
+    rate_type TEXT
+);
+CREATE INDEX IF NOT EXISTS rules_listing ON rules (listing);
+CREATE INDEX IF NOT EXISTS rules_rate_type ON rules (rate_type, listing);
+CREATE VIRTUAL TABLE IF NOT EXISTS listing_text USING fts4 (title, comment);
+"""
+
+
+def _get(obj, *names):
+    """Returns the first value of obj found under one of names."""
+    for name in names:
+        for key in (name, 'com:' + name):
+            if key in obj:
+                return obj[key]
+    return None
+
+
+def _list(value):
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        return [value]
+    return value
+
+
+def _id(value):
+    """Returns the id of a value that is a node or a reference."""
+    if isinstance(value, dict):
+        return value.get('id')
+    return value
+
+
+def _term(value):
+    """Returns a vocabulary term without its "com:" prefix."""
+    if isinstance(value, basestring) and value.startswith('com:'):
+        return value[4:]
+    return value
+
+
+def _rate(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _text(*values):
+    return ' '.join(v for v in values if isinstance(v, basestring))
+
+
+def default_index_path():
+    """Returns the default index path, PAYSWARM_CONFIG_DIR/search.db."""
+    return os.path.join(util.config_dir(), 'search.db')
+
+
+class Index(object):
+    """A searchable SQLite index of signed assets and listings."""
+
+    def __init__(self, path=None):
+        """Opens an index, creating it if needed.
+
+        path - the SQLite file (default: default_index_path()).
+        """
+        self.path = path or default_index_path()
+        self._db = sqlite3.connect(self.path)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        """Closes the index."""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def add_items(self, items):
+        """Adds or replaces signed assets and listings.
+
+        items - the assets and listings, in any order.
+
+        Returns the number of items indexed. Items that are neither assets
+        nor listings are skipped.
+        """
+        count = 0
+        try:
+            for item in items:
+                types = storage._types(item)
+                if 'Asset' in types:
+                    self._add_asset(item)
+                elif 'Listing' in types:
+                    self._add_listing(item)
+                else:
+                    continue
+                count += 1
+        except:
+            self._db.rollback()
+            raise
+        self._db.commit()
+        # let the query planner choose between the indexes
+        self._db.execute('ANALYZE')
+        return count
+
+    def _add_asset(self, asset):
+        title = _text(asset.get('title'))
+        self._db.execute('INSERT OR REPLACE INTO assets (id, title) '
+            'VALUES (?, ?)', (asset['id'], title))
+        # listings indexed before their asset take the asset's title now
+        rows = self._db.execute('SELECT rowid, title FROM listings '
+            'WHERE asset = ?', (asset['id'],)).fetchall()
+        for rowid, own_title in rows:
+            self._db.execute('UPDATE listing_text SET title = ? '
+                'WHERE docid = ?', (_text(own_title, title), rowid))
+
+    def _add_listing(self, listing):
+        db = self._db
+        row = db.execute('SELECT rowid FROM listings WHERE id = ?',
+            (listing['id'],)).fetchone()
+        if row is not None:
+            for table, column in [('payees', 'listing'), ('rules', 'listing'),
+                    ('listing_text', 'docid'), ('listings', 'rowid')]:
+                db.execute('DELETE FROM %s WHERE %s = ?' % (table, column),
+                    (row[0],))
+
+        asset_id = _id(listing.get('asset'))
+        title = _text(listing.get('title'))
+        rowid = db.execute(
+            'INSERT INTO listings (id, vendor, asset, license, valid_from, '
+            'valid_until, title, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (listing['id'], _id(_get(listing, 'vendor')), asset_id,
+            _id(listing.get('license')), listing.get('validFrom'),
+            listing.get('validUntil'), title,
+            codec.dumps(listing))).lastrowid
+
+        comments = [listing.get('comment')]
+        payees = []
+        for payee in _list(_get(listing, 'payee')):
+            comments.append(payee.get('comment'))
+            payees.append((rowid, _id(_get(payee, 'destination')),
+                _get(payee, 'currency'),
+                _rate(_get(payee, 'payeeRate', 'rate')),
+                _term(_get(payee, 'payeeRateType', 'rateType'))))
+        db.executemany('INSERT INTO payees (listing, destination, currency, '
+            'rate, rate_type) VALUES (?, ?, ?, ?, ?)', payees)
+        db.executemany('INSERT INTO rules (listing, rate_type) VALUES (?, ?)',
+            [(rowid, _term(_get(rule, 'payeeRateType', 'rateType')))
+            for rule in _list(_get(listing, 'payeeRule'))])
+
+        asset = db.execute('SELECT title FROM assets WHERE id = ?',
+            (asset_id,)).fetchone()
+        db.execute('INSERT INTO listing_text (docid, title, comment) '
+            'VALUES (?, ?, ?)', (rowid, _text(title, asset and asset[0]),
+            _text(*comments)))
+
+    def search(self, vendor=None, asset=None, license=None,
+            destination=None, currency=None, min_rate=None, max_rate=None,
+            rate_type=None, rule_type=None, valid_at=None, text=None,
+            limit=None):
+        """Returns the indexed listings that match every given filter.
+
+        vendor - the vendor id.
+        asset - the id of the asset sold.
+        license - the license id.
+        destination - the account id of a payee.
+        currency - the currency of a payee.
+        min_rate - the lowest payee rate, inclusive.
+        max_rate - the highest payee rate, exclusive.
+        rate_type - the rate type of a payee, such as 'FlatAmount'.
+        rule_type - the rate type of a payee rule, such as 'Percentage'.
+        valid_at - a time in seconds since the epoch the listing must be
+            valid at.
+        text - a full-text query on title and comment, in SQLite FTS syntax.
+        limit - the most listings to return (default: all).
+
+        Returns a list of listings in the order they were last indexed.
+        """
+        # joins rather than subqueries, so the query planner can start from
+        # whichever index is most selective
+        joins = []
+        where = []
+        values = []
+        for column, value in [('vendor', vendor), ('asset', asset),
+                ('license', license)]:
+            if value is not None:
+                where.append('l.%s = ?' % column)
+                values.append(value)
+        if valid_at is not None:
+            now = time.strftime(storage.W3C_DATE_FORMAT,
+                time.gmtime(valid_at))
+            where.append('l.valid_from <= ? AND l.valid_until >= ?')
+            values.extend([now, now])
+        payee_where = []
+        for clause, value in [('p.destination = ?', destination),
+                ('p.currency = ?', currency), ('p.rate >= ?', min_rate),
+                ('p.rate < ?', max_rate),
+                ('p.rate_type = ?', _term(rate_type))]:
+            if value is not None:
+                payee_where.append(clause)
+                values.append(value)
+        if payee_where:
+            joins.append('JOIN payees p ON p.listing = l.rowid')
+            where.extend(payee_where)
+        if rule_type is not None:
+            joins.append('JOIN rules r ON r.listing = l.rowid')
+            where.append('r.rate_type = ?')
+            values.append(_term(rule_type))
+        if text is not None:
+            joins.append('JOIN listing_text t ON t.docid = l.rowid')
+            where.append('t.listing_text MATCH ?')
+            values.append(text)
+
+        sql = 'SELECT l.data FROM listings l'
+        if joins:
+            sql += ' ' + ' '.join(joins)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        if payee_where or rule_type is not None:
+            # a listing with several matching payees or rules is returned once
+            sql += ' GROUP BY l.rowid'
+        # rowid order lets a limited query stop at its first matches
+        sql += ' ORDER BY l.rowid'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            values.append(limit)
+        return [codec.loads(row[0]) for row in self._db.execute(sql, values)]
+
+    def count(self):
+        """Returns the number of indexed assets and listings."""
+        return (self._db.execute('SELECT COUNT(*) FROM assets').fetchone()[0],
+            self._db.execute('SELECT COUNT(*) FROM listings').fetchone()[0])
+
+
+class Search(util.Plugin):
+    """Plugin to index and query signed listings locally."""
+
+    def get_name(self):
+        return "Search"
+
+    def before_args_parsed(self, parser, subparsers):
+        subparser = subparsers.add_parser('search',
+                help='Index and query signed listings locally.')
+        subparser.add_argument('--index',
+                help='The SQLite index file. (default: %s)' %
+                default_index_path())
+        actions = subparser.add_subparsers(title='actions')
+
+        index = actions.add_parser('index',
+                help='Add signed assets and listings to the index.')
+        index.add_argument('source', nargs='+',
+                help='A catalog archive or JSON-LD file of signed items.')
+        index.set_defaults(func=self.index)
+
+        query = actions.add_parser('query',
+                help='Find listings matching every given filter.')
+        query.add_argument('--vendor', help='The vendor id.')
+        query.add_argument('--asset', help='The id of the asset sold.')
+        query.add_argument('--license', help='The license id.')
+        query.add_argument('--destination',
+                help='The account id of a payee.')
+        query.add_argument('--currency', help='The currency of a payee.')
+        query.add_argument('--min-rate', type=float,
+                help='The lowest payee rate, inclusive.')
+        query.add_argument('--max-rate', type=float,
+                help='The highest payee rate, exclusive.')
+        query.add_argument('--rate-type',
+                help='The rate type of a payee, such as FlatAmount.')
+        query.add_argument('--rule-type',
+                help='The rate type of a payee rule, such as Percentage.')
+        query.add_argument('--valid', action='store_true',
+                help='Only listings that are valid now.')
+        query.add_argument('--text',
+                help='A full-text query on titles and comments.')
+        query.add_argument('--limit', type=int, default=LIMIT,
+                help='The most listings to show. (default: %(default)s)')
+        query.add_argument('--full', action='store_true',
+                help='Show each listing instead of its id.')
+        query.set_defaults(func=self.query)
+
+    def after_args_parsed(self, args):
+        pass
+
+    def index(self, args):
+        start = time.time()
+        count = 0
+        with Index(args.index) as index:
+            for source in args.source:
+                count += index.add_items(storage.iter_items(source))
+            assets, listings = index.count()
+        print "Indexed %d items in %.2fs (%d assets and %d listings in " \
+            "the index)" % (count, time.time() - start, assets, listings)
+
+    def query(self, args):
+        valid_at = None
+        if args.valid:
+            valid_at = time.time()
+        start = time.time()
+        with Index(args.index) as index:
+            listings = index.search(vendor=args.vendor, asset=args.asset,
+                license=args.license, destination=args.destination,
+                currency=args.currency, min_rate=args.min_rate,
+                max_rate=args.max_rate, rate_type=args.rate_type,
+                rule_type=args.rule_type, valid_at=valid_at, text=args.text,
+                limit=args.limit)
+        for listing in listings:
+            if args.full:
+                print codec.dumps(listing, sort_keys=True, indent=2)
+            else:
+                print listing['id']
+        sys.stderr.write("%d listings in %.1fms\n" % (
+            len(listings), (time.time() - start) * 1000))
+
+    def run(self, args):
+        pass
@@ -1,4 +1,8 @@
-"""The signature module is used to perform PaySwarm signatures on data."""
+"""The signature module is used to perform PaySwarm signatures on data.
+
+sign, verify and the verification cache are safe to use from several
+threads at once.
+"""
 
 # Copyright (c) 2011-2013, Digital Bazaar, Inc.
 # All rights reserved.
@@ -29,17 +33,34 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+from __future__ import with_statement
+
 from Crypto.Hash import SHA256
-from Crypto.PublicKey import RSA
 from Crypto.Signature import PKCS1_v1_5
 import copy
 import datetime
+import hashlib
+import threading
+# strptime imports this lazily, which fails when first done in two threads
+import _strptime
 
 import payswarm
 
 # W3C date format
 W3C_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 
+# maximum difference between a signature's creation time and now
+TIMESTAMP_WINDOW = datetime.timedelta(minutes=15)
+
+# maximum number of cached positive verification results
+VERIFIED_CACHE_SIZE = 10000
+
+# (expires, creator) keyed by the digest of a verified document
+_verified = {}
+
+# guards _verified
+_verified_lock = threading.Lock()
+
 def sign(jsonld, public_key_id, private_key_pem, nonce=None, created=None):
     """Adds a digital signature to an object.
 
@@ -59,22 +80,20 @@ def sign(jsonld, public_key_id, private_key_pem, nonce=None, created=None):
         created = created.strftime(W3C_DATE_FORMAT)
 
     # normalize the data to be signed
-    normalized = payswarm.jsonld.normalize(jsonld, {
-        'format': 'application/nquads'
-    })
+    normalized = payswarm.util.normalize(jsonld)
 
     if len(normalized) == 0:
         raise Exception('Attempt to sign empty normalized data.')
 
     # load the key
-    private_key = RSA.importKey(private_key_pem)
+    private_key = payswarm.keys.import_key(private_key_pem)
 
     # build the hash
     h = SHA256.new()
     if nonce:
         h.update(nonce)
     h.update(created)
-    h.update(normalized)
+    payswarm.util.update_digest(h, normalized)
 
     # create the signature
     signer = PKCS1_v1_5.new(private_key)
@@ -89,7 +108,7 @@ def sign(jsonld, public_key_id, private_key_pem, nonce=None, created=None):
         'signatureValue': signature.encode('base64'),
     }
     if nonce:
-        obj['signature'] = nonce
+        jsonld['signature']['nonce'] = nonce
 
     return jsonld
 
@@ -98,21 +117,58 @@ def verify(jsonld):
     """Verifies a digital signature in an object.
 
     jsonld - the JSON-LD to verify
+
+    A successful verification is remembered until the signature timestamp
+    leaves TIMESTAMP_WINDOW, so verifying an identical document again only
+    costs a digest and a lookup.
+
+    Verification runs in two CPU-bound stages around the public key fetch,
+    see prepare_verify and complete_verify; payswarm.executor runs the
+    stages and the fetch in separate thread pools.
+    """
+    state = prepare_verify(jsonld)
+    if state is None:
+        return True
+    return complete_verify(state, payswarm.keys.get_public_key(state.creator))
+
+
+class VerifyState(object):
+    """A signed document that has passed the checks made before its public
+    key is fetched."""
+
+    def __init__(self, digest, framed, signature, created):
+        self.digest = digest
+        self.framed = framed
+        self.signature = signature
+        self.created = created
+        self.creator = signature['creator']
+
+
+def prepare_verify(jsonld):
+    """Checks a signed document before its public key is fetched.
+
+    jsonld - the JSON-LD to verify.
+
+    Returns None if the document has already been verified, otherwise a
+    VerifyState for complete_verify.
     """
 
+    # check for a previous verification of the same signed document
+    digest = _digest(jsonld)
+    with _verified_lock:
+        entry = _verified.get(digest)
+    if entry is not None:
+        expires, creator = entry
+        if datetime.datetime.utcnow() < expires and \
+            not payswarm.keys.is_revoked(creator):
+            # the key status index may have changed since it was verified
+            _check_key_status(creator)
+            return None
+        with _verified_lock:
+            _verified.pop(digest, None)
+
     # frame data and retrieve signature
-    frame = {
-        '@context': payswarm.constants.CONTEXT_URL,
-        'signature': {
-            'type': {},
-            'created': {},
-            'creator': {},
-            'signatureValue': {},
-            # FIXME: improve handling signatures w/o nonces
-            #'nonce': {'@omitDefault': True}
-        }
-    }
-    framed = payswarm.jsonld.frame(jsonld, frame)
+    framed = payswarm.frames.frame(jsonld, 'Signature')
     graphs = framed['@graph']
     if len(graphs) == 0:
         raise Exception('No signed data found.')
@@ -135,48 +191,113 @@ def verify(jsonld):
     # check date
     # enxure signature created within a valid range (+/- M minutes)
     now = datetime.datetime.utcnow()
-    # FIXME: 15 minute default range, make this configurable
-    delta = datetime.timedelta(minutes=15)
+    delta = TIMESTAMP_WINDOW
     # FIXME PyLD should do this automatically
     created = datetime.datetime.strptime(signature['created'], W3C_DATE_FORMAT)
     if created < (now - delta) or created > (now + delta):
         raise Exception(
             'The message digital signature timestamp is out of range.')
 
-    # get public key
-    creator_public_key = payswarm.util.get(signature['creator'])
-    # FIXME frame key
+    # check the synced key status index before fetching anything
+    _check_key_status(signature['creator'])
+
+    return VerifyState(digest, framed, signature, created)
 
-    # verify publick key owner
-    # FIXME
-    #if not paysarm.hooks.is_trusted_authority(key.owner)
-    #    raise Exception('The message is not signed by a trusted public key.')
+
+def _check_key_status(creator):
+    """Checks a signature's creator against the synced key status index.
+
+    creator - the public key id.
+    """
+    index = payswarm.revocation.get_index()
+    if index is not None:
+        if index.is_revoked(creator):
+            forget_creator(creator)
+            raise Exception('The public key has been revoked.')
+        if not index.is_trusted(creator):
+            raise Exception(
+                'The message is not signed by a trusted public key.')
+
+
+def complete_verify(state, creator_public_key):
+    """Checks a signature against its creator's public key.
+
+    state - the VerifyState returned by prepare_verify.
+    creator_public_key - the public key document of state.creator.
+
+    Returns True.
+    """
+    signature = state.signature
+    # FIXME frame key
 
     # ensure key has not been revoked
     if 'revoked' in creator_public_key:
+        forget_creator(signature['creator'])
         raise Exception('The public key has been revoked.')
 
     # normalize the data to be signed
     # remove signature property from object
+    framed = state.framed
     del framed['@graph'][0]['signature']
     # normalize
-    normalized = payswarm.jsonld.normalize(framed, {
-        'format': 'application/nquads'
-    })
+    normalized = payswarm.util.normalize(framed)
 
     # load the key
-    public_key = RSA.importKey(creator_public_key['publicKeyPem'])
+    public_key = payswarm.keys.import_key(creator_public_key['publicKeyPem'])
 
     # build the hash
     h = SHA256.new()
     if 'nonce' in signature:
         h.update(signature['nonce'])
     h.update(signature['created'])
-    h.update(normalized)
+    payswarm.util.update_digest(h, normalized)
 
     # verify signature
     signer = PKCS1_v1_5.new(public_key)
     if not signer.verify(h, signature['signatureValue'].decode('base64')):
         raise Exception('The digital signature on the message is invalid.')
 
+    # remember the result until the timestamp is no longer acceptable
+    with _verified_lock:
+        if len(_verified) >= VERIFIED_CACHE_SIZE:
+            _prune_verified()
+        _verified[state.digest] = \
+            (state.created + TIMESTAMP_WINDOW, signature['creator'])
+
     return True
+
+
+def forget_creator(creator):
+    """Drops all cached verification results for documents signed by a key.
+
+    creator - the public key id.
+    """
+    with _verified_lock:
+        for digest, entry in _verified.items():
+            if entry[1] == creator:
+                del _verified[digest]
+
+
+def clear_verified():
+    """Drops all cached verification results."""
+    with _verified_lock:
+        _verified.clear()
+
+
+def _prune_verified():
+    """Drops expired verification results, or all of them if none expired.
+
+    The caller must hold _verified_lock.
+    """
+    now = datetime.datetime.utcnow()
+    for digest, entry in _verified.items():
+        if entry[0] <= now:
+            _verified.pop(digest, None)
+    if len(_verified) >= VERIFIED_CACHE_SIZE:
+        _verified.clear()
+
+
+def _digest(jsonld):
+    """Returns a digest of a signed document, including its signatureValue."""
+    data = payswarm.codec.canonical_dumps(jsonld)
+    return hashlib.sha256(data).hexdigest()
@@ -1,17 +1,34 @@
 """The storage plugin is used to remotely store assets and listings."""
+from __future__ import with_statement
+
 import copy
 import hashlib
 import json
 import os
+import sys
+import threading
 import time
-import urllib2
 
 import pyld.jsonld as jsonld
 
+import catalog
+import codec
 import constants
+import content
+import scheduler
 import signature
 import util
 
+# format of listing validFrom and validUntil dates
+W3C_DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# number of seconds a listing is valid for
+LISTING_VALIDITY = 60*60*24
+
+# number of seconds a signed asset is reused for by a SignedStore; kept
+# below signature.TIMESTAMP_WINDOW so reused signatures still verify
+SIGNED_TTL = 10*60
+
 
 def populate_asset(config, asset):
     """Populates an asset with the provider, authority and content URLs.
@@ -35,12 +52,32 @@ def populate_asset(config, asset):
 
     return rval
 
-def register_asset(config, asset):
+def sign(config, item):
+    """Digitally signs an item with the configured application key.
+
+    config - the configuration to read the [application] 'public-key-id'
+        and 'private-key' from.
+    item - the JSON-LD object to sign.
+
+    Returns the signed item.
+    """
+    return signature.sign(item,
+        config.get("application", "public-key-id"),
+        config.get("application", "private-key"))
+
+def register_asset(config, asset, content_file=None, content_mode='sha256',
+    store=None):
     """Digitally signs the given asset and stores it on the listings service.
 
     config - the configuration to read the private key used for digital 
         signatures from as well as the listings service URL.
     asset - the asset to register in JSON format.
+    content_file - a local copy of the asset content. Its digest is
+        recorded on the asset before it is signed (optional).
+    content_mode - the content hash mode, see payswarm.content.hash_file.
+    store - a SignedStore of assets already signed and uploaded. If it holds
+        the populated asset, that signed asset is returned without signing
+        or uploading it again (optional).
 
     Returns the digitally signed asset.
     Throws an exception if something nasty happens.
@@ -53,14 +90,26 @@ def register_asset(config, asset):
     # include the default context if necessary
     populated_asset.setdefault("@context", constants.CONTEXT)
 
+    # record the content digest so that it is covered by the signature
+    if content_file is not None:
+        content.record_digest(populated_asset, content_file, content_mode)
+
+    # reuse an identical asset that was already signed and uploaded
+    if store is not None:
+        public_key_id = config.get("application", "public-key-id")
+        asset_hash = util.hash(populated_asset)
+        sa = store.get(asset_hash, public_key_id)
+        if sa is not None:
+            return sa
+
     # digitally sign the asset
-    sa = signature.sign(config, populated_asset)
+    sa = sign(config, populated_asset)
 
     # upload the asset
-    req = urllib2.Request(storage_url,
-        headers = { "Content-Type": "application/ld+json" },
-        data = json.dumps(sa, sort_keys=True, indent=3))
-    urllib2.urlopen(req)
+    util.upload(storage_url, sa, priority=scheduler.PUBLISH)
+
+    if store is not None:
+        store.put(asset_hash, public_key_id, sa)
     
     return sa
 
@@ -76,7 +125,7 @@ def fetch(config, item):
     storage_url = config.get("general", "listings-url") + item["id"]
 
     # retrieve the listing
-    rval = json.loads(urllib2.urlopen(storage_url).read())
+    rval = util.get(storage_url)
 
     return rval
 
@@ -108,10 +157,10 @@ def populate_listing(config, asset, listing):
     rval["licenseHash"] = \
         config.get("application", "default-license-hash")
     rval["validFrom"] = \
-        time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        time.strftime(W3C_DATE_FORMAT, time.gmtime())
     rval["validUntil"] = \
-        time.strftime("%Y-%m-%dT%H:%M:%SZ", 
-            time.gmtime(time.time() + 60*60*24))
+        time.strftime(W3C_DATE_FORMAT,
+            time.gmtime(time.time() + LISTING_VALIDITY))
 
     return rval
 
@@ -137,17 +186,290 @@ def register_listing(config, signed_asset, listing):
     populated_listing.setdefault("@context", constants.CONTEXT)
 
     # Digitally sign the listing
-    sl = signature.sign(config, populated_listing)
+    sl = sign(config, populated_listing)
 
     # Upload the listing
-    req = urllib2.Request(storage_url,
-        headers = { "Content-Type": "application/ld+json" },
-        data = json.dumps(sl, sort_keys=True, indent=2))
-    urllib2.urlopen(req)
+    util.upload(storage_url, sl, priority=scheduler.PUBLISH)
 
     return sl
 
 
+def _types(item):
+    types = item.get("type", [])
+    if not isinstance(types, list):
+        types = [types]
+    return types
+
+class Populator(object):
+    """Populates assets and listings with configuration values read once.
+
+    Produces the same documents as populate_asset and populate_listing, but
+    every listing gets the same validity window and output documents are
+    shallow copies: top-level values that are not populated are shared with
+    the input, so the input must not be modified while the output is in use.
+    """
+
+    def __init__(self, config, now=None):
+        """Creates a new populator.
+
+        config - the configuration to read the asset and listing data from.
+        now - the start of the validity window in seconds since the epoch
+            (default: the current time).
+        """
+        if now is None:
+            now = time.time()
+        self.listings_url = config.get("general", "listings-url")
+        # FIXME: see populate_asset
+        self.asset_provider = config.get("application",
+            "preferences-url").replace("/preferences", "")
+        self.authority = config.get("general", "config-url")
+        self.financial_account = \
+            config.get("application", "financial-account")
+        self.license = config.get("application", "default-license")
+        self.license_hash = \
+            config.get("application", "default-license-hash")
+        self.valid_from = time.strftime(W3C_DATE_FORMAT, time.gmtime(now))
+        self.valid_until = time.strftime(W3C_DATE_FORMAT,
+            time.gmtime(now + LISTING_VALIDITY))
+
+    def asset(self, asset):
+        """Returns a populated copy of an asset, see populate_asset."""
+        rval = dict(asset)
+        storage_url = self.listings_url + asset["id"]
+        rval["id"] = storage_url
+        rval["assetProvider"] = self.asset_provider
+        rval["authority"] = self.authority
+        rval["contentUrl"] = storage_url
+        rval.setdefault("@context", constants.CONTEXT)
+        return rval
+
+    def listing(self, listing, asset_id, asset_hash):
+        """Returns a populated copy of a listing, see populate_listing.
+
+        listing - the listing to populate.
+        asset_id - the id of the signed asset the listing sells.
+        asset_hash - the util.hash() of the signed asset.
+        """
+        rval = dict(listing)
+        rval["id"] = self.listings_url + listing["id"]
+        if "com:payee" in rval:
+            p = rval["com:payee"] = dict(rval["com:payee"])
+            p["id"] = self.listings_url + p["id"]
+            if "AUTOFILL" in p["com:destination"]:
+                p["com:destination"] = self.financial_account
+        rval["asset"] = asset_id
+        rval["assetHash"] = asset_hash
+        rval["license"] = self.license
+        rval["licenseHash"] = self.license_hash
+        rval["validFrom"] = self.valid_from
+        rval["validUntil"] = self.valid_until
+        rval.setdefault("@context", constants.CONTEXT)
+        return rval
+
+def populate_items(config, items, asset_hashes=None, now=None):
+    """Populates a batch of assets and listings.
+
+    config - the configuration to read the asset and listing data from.
+    items - the unsigned assets and listings, each asset before the
+        listings that sell it.
+    asset_hashes - the hashes of signed assets keyed by populated asset id,
+        which listings take their assetHash from. sign_items adds each asset
+        it signs, so listings of assets signed earlier in the same pipeline
+        are found.
+    now - the start of the shared validity window (default: now).
+
+    Yields each populated item in order. A listing's "asset" is relative
+    to the listings-url unless it is already a key of asset_hashes.
+    """
+    if asset_hashes is None:
+        asset_hashes = {}
+    populator = Populator(config, now)
+    for item in items:
+        types = _types(item)
+        if "Asset" in types:
+            yield populator.asset(item)
+        elif "Listing" in types:
+            asset_id = item.get("asset", "")
+            if asset_id not in asset_hashes:
+                asset_id = populator.listings_url + asset_id
+            asset_hash = asset_hashes.get(asset_id)
+            if asset_hash is None:
+                raise Exception('No signed asset "%s" for listing "%s".' %
+                    (asset_id, item["id"]))
+            yield populator.listing(item, asset_id, asset_hash)
+        else:
+            raise Exception('"%s" is not an asset or listing.' % item["id"])
+
+def sign_items(config, items, asset_hashes=None):
+    """Signs a batch of populated items.
+
+    config - the configuration to read the signing key from.
+    items - the populated items, such as the output of populate_items.
+    asset_hashes - a map to add the hash of each signed asset to, keyed by
+        asset id (optional).
+
+    Yields each signed item in order.
+    """
+    public_key_id = config.get("application", "public-key-id")
+    private_key_pem = config.get("application", "private-key")
+    for item in items:
+        signed = signature.sign(item, public_key_id, private_key_pem)
+        if asset_hashes is not None and "Asset" in _types(item):
+            asset_hashes[signed["id"]] = util.hash(signed)
+        yield signed
+
+
+def default_signed_store_path():
+    """Returns the default SignedStore path, PAYSWARM_CONFIG_DIR/signed."""
+    return os.path.join(util.config_dir(), 'signed')
+
+class SignedStore(object):
+    """Remembers signed and uploaded assets by the hash of their content.
+
+    Entries are kept in memory and appended to a JSON Lines file so later
+    processes reuse them too. An entry is only returned for the key it was
+    signed with and for SIGNED_TTL seconds after it was signed.
+    """
+
+    def __init__(self, path=None, ttl=SIGNED_TTL):
+        """Loads a store.
+
+        path - the file to persist entries to, None to keep them in memory.
+        ttl - the number of seconds an entry is reused for.
+        """
+        self.path = path
+        self.ttl = ttl
+        # {'publicKeyId', 'stored', 'signed'} keyed by asset hash
+        self.entries = {}
+        # signing and uploading skipped, and entries stored
+        self.stats = {'reused': 0, 'stored': 0}
+        self._lock = threading.Lock()
+        self._file = None
+        if path is None:
+            return
+        lines = 0
+        try:
+            with open(path) as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = codec.loads(line)
+                    except ValueError:
+                        # a line cut short by an interruption
+                        break
+                    self.entries[entry['hash']] = entry
+        except IOError:
+            pass
+        self._prune()
+        if lines > len(self.entries):
+            self._compact()
+
+    def _prune(self):
+        expires = time.time() - self.ttl
+        for asset_hash, entry in self.entries.items():
+            if entry['stored'] <= expires:
+                del self.entries[asset_hash]
+
+    def _compact(self):
+        """Rewrites the file with only the live entries."""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        tmp = self.path + '.%d.tmp' % os.getpid()
+        with open(tmp, 'w') as f:
+            for entry in self.entries.values():
+                f.write(codec.dumps(entry) + '\n')
+        os.rename(tmp, self.path)
+
+    def get(self, asset_hash, public_key_id):
+        """Returns the signed asset stored for a hash and key, or None.
+
+        asset_hash - the util.hash() of the populated, unsigned asset.
+        public_key_id - the key the asset must have been signed with.
+        """
+        with self._lock:
+            entry = self.entries.get(asset_hash)
+            if entry is None or entry['publicKeyId'] != public_key_id or \
+                    entry['stored'] <= time.time() - self.ttl:
+                return None
+            self.stats['reused'] += 1
+            return entry['signed']
+
+    def put(self, asset_hash, public_key_id, signed):
+        """Stores a signed and uploaded asset.
+
+        asset_hash - the util.hash() of the populated, unsigned asset.
+        public_key_id - the key the asset was signed with.
+        signed - the signed asset.
+        """
+        entry = {'hash': asset_hash, 'publicKeyId': public_key_id,
+            'stored': time.time(), 'signed': signed}
+        with self._lock:
+            self.entries[asset_hash] = entry
+            self.stats['stored'] += 1
+            if self.path is None:
+                return
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory, 0700)
+                self._file = open(self.path, 'a')
+            self._file.write(codec.dumps(entry) + '\n')
+            self._file.flush()
+
+    def close(self):
+        """Closes the store's file."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def load_items(path):
+    """Loads the assets and listings stored in a JSON-LD file.
+
+    path - the filename of a JSON-LD document containing a "@graph", a
+        single item or a list of items.
+
+    Returns a list of JSON-LD objects.
+    """
+    with open(path) as f:
+        data = codec.load(f)
+    if isinstance(data, list):
+        return data
+    if "@graph" not in data:
+        return [data]
+
+    # items split out of a graph keep the document's context
+    items = []
+    for item in data["@graph"]:
+        if "@context" in data and "@context" not in item:
+            item = dict(item)
+            item["@context"] = data["@context"]
+        items.append(item)
+    return items
+
+
+def iter_items(path):
+    """Iterates over the assets and listings in a catalog archive or a
+    JSON-LD file.
+
+    path - the filename of a catalog archive or a JSON-LD document accepted
+        by load_items.
+
+    Catalog archives are streamed one record at a time.
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(len(catalog.MAGIC))
+    if magic != catalog.MAGIC:
+        for item in load_items(path):
+            yield item
+        return
+    with catalog.CatalogReader(path) as reader:
+        for item in reader:
+            yield item
+
+
 class Storage(util.Plugin):
     """Plugin to publish PaySwarm assets and listings."""
 
@@ -158,11 +480,85 @@ class Storage(util.Plugin):
         return "Storage"
 
     def before_args_parsed(self, parser, subparsers):
-        pass
+        subparser = subparsers.add_parser('catalog',
+                help='Pack, check and query signed catalog archives.')
+        actions = subparser.add_subparsers(title='actions')
+
+        pack = actions.add_parser('pack',
+                help='Write signed items from a JSON-LD file to an archive.')
+        pack.add_argument('source', help='The JSON-LD file to read.')
+        pack.add_argument('archive', help='The archive file to write.')
+        pack.set_defaults(func=self.pack)
+
+        check = actions.add_parser('check',
+                help='Check the integrity of an archive.')
+        check.add_argument('archive', help='The archive file to check.')
+        check.set_defaults(func=self.check)
+
+        get = actions.add_parser('get',
+                help='Look up items by id or assetHash.')
+        get.add_argument('archive', help='The archive file to read.')
+        get.add_argument('key', help='The item id or assetHash.')
+        get.set_defaults(func=self.get)
+
+        audit = actions.add_parser('audit',
+                help='Check that listings match the assets they sell.')
+        audit.add_argument('source',
+                help='The catalog archive or JSON-LD file to audit.')
+        audit.add_argument('-j', '--jobs', type=int, default=1,
+                help='The number of processes hashing assets. '
+                '(default: %(default)s)')
+        audit.add_argument('--cache',
+                help='A file of asset hashes to reuse and update.')
+        audit.set_defaults(func=self.audit)
 
     def after_args_parsed(self, args):
         pass
 
+    def pack(self, args):
+        count = catalog.write(args.archive, load_items(args.source))
+        print "Wrote %d items to %s" % (count, args.archive)
+
+    def check(self, args):
+        with catalog.CatalogReader(args.archive) as reader:
+            problems = reader.check()
+        for problem in problems:
+            print "ERROR: %s" % problem
+        if problems:
+            sys.exit(1)
+        print "%s: OK" % args.archive
+
+    def get(self, args):
+        with catalog.CatalogReader(args.archive) as reader:
+            for item in reader.find(args.key):
+                print json.dumps(item, sort_keys=True, indent=2)
+
+    def audit(self, args):
+        # imported when used so importing storage does not load
+        # multiprocessing
+        import audit
+        cache = {}
+        if args.cache:
+            cache = audit.load_cache(args.cache)
+        report = audit.audit(iter_items(args.source), args.jobs, cache)
+        if args.cache:
+            audit.save_cache(args.cache, cache)
+        for listing, asset, expected, actual in report.mismatches:
+            print "MISMATCH: %s assetHash %s, %s hashes to %s" % (
+                listing, expected, asset, actual)
+        for listing, asset in report.missing:
+            print "MISSING: %s asset %s" % (listing, asset)
+        for listing, valid_until in report.expired:
+            print "EXPIRED: %s validUntil %s" % (listing, valid_until)
+        for item, message in report.errors:
+            print "ERROR: %s: %s" % (item, message)
+        print "Audited %d assets and %d listings in %.2fs " \
+            "(%.1f items/s, %d hashed, %d cached)" % (
+            report.assets, report.listings, report.seconds,
+            report.throughput(), report.hashed, report.cached)
+        if not report.ok:
+            sys.exit(1)
+
     def run(self, args):
         pass
 
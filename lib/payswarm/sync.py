@@ -0,0 +1,274 @@
+"""The sync plugin publishes only the assets and listings that changed.
+
+A local manifest records util.hash() of the unsigned content of every item
+uploaded from a catalog file to a listing service. A sync compares the
+catalog with the manifest, registers new and changed items, re-registers
+listings whose asset was re-registered or that are about to expire and can
+delete items that are no longer in the catalog. Each completed upload or
+delete is appended to a journal next to the manifest, so an interrupted
+sync resumes without re-uploading what it already did.
+"""
+from __future__ import with_statement
+
+import calendar
+import hashlib
+import json
+import os
+import time
+
+import config
+import constants
+import scheduler
+import storage
+import util
+
+# number of seconds before a published listing's validUntil at which a sync
+# republishes it even if it has not changed
+RENEW_BEFORE = 60*60
+
+
+def _types(item):
+    types = item.get('type', [])
+    if not isinstance(types, list):
+        types = [types]
+    return types
+
+
+def default_manifest_path(source, listings_url):
+    """Returns the default manifest path for a catalog file and service.
+
+    PAYSWARM_CONFIG_DIR/sync/{SHA-1 of the service URL and catalog path}
+    """
+    key = '%s\n%s' % (listings_url, os.path.abspath(source))
+    return os.path.join(util.config_dir(), 'sync',
+        hashlib.sha1(key).hexdigest() + '.json')
+
+
+def digest(item, listings_url):
+    """Returns the digest of an unsigned item as it would be published.
+
+    item - the unsigned asset or listing.
+    listings_url - the listing service URL its id is relative to.
+    """
+    return util.hash(dict(item, id=listings_url + item['id']))
+
+
+class Manifest(object):
+    """The digests of the items published from a catalog file."""
+
+    def __init__(self, path):
+        """Loads a manifest and replays its journal, if any.
+
+        path - the manifest file.
+        """
+        self.path = path
+        self.journal_path = path + '.journal'
+        # {'digest', 'assetHash'} keyed by item id, with 'validUntil' for
+        # listings
+        self.items = {}
+        self._journal = None
+        try:
+            with open(path) as f:
+                self.items = json.load(f)['items']
+        except IOError:
+            pass
+        try:
+            with open(self.journal_path) as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        # a line cut short by an interruption
+                        break
+        except IOError:
+            pass
+
+    def _apply(self, entry):
+        if entry.get('deleted'):
+            self.items.pop(entry['id'], None)
+        else:
+            self.items[entry['id']] = dict(
+                (k, v) for k, v in entry.iteritems() if k != 'id')
+
+    def record(self, entry):
+        """Records a completed upload or delete in the journal.
+
+        entry - {'id', 'digest', 'assetHash'} for an upload, also with
+            'validUntil' for a listing, or {'id', 'deleted': True} for a
+            delete.
+        """
+        self._apply(entry)
+        if self._journal is None:
+            directory = os.path.dirname(self.journal_path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, 0700)
+            self._journal = open(self.journal_path, 'a')
+        self._journal.write(json.dumps(entry) + '\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def save(self):
+        """Writes the manifest and removes the journal."""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        tmp = self.path + '.%d.tmp' % os.getpid()
+        with open(tmp, 'w') as f:
+            json.dump({'items': self.items}, f, sort_keys=True)
+        os.rename(tmp, self.path)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self.journal_path):
+            os.unlink(self.journal_path)
+
+
+def _exists(url):
+    """Returns whether the listing service has a document at a URL."""
+    res = util.request_raw('GET', url, priority=scheduler.PUBLISH)
+    if res.status == 404:
+        return False
+    if res.status < 200 or res.status >= 300:
+        raise Exception('Bad status code %d requesting "%s"' %
+            (res.status, url))
+    return True
+
+
+def _expiring(entry, now):
+    """Returns whether a published listing expires within RENEW_BEFORE."""
+    valid_until = entry.get('validUntil')
+    if valid_until is None:
+        # published before validity was recorded
+        return True
+    try:
+        expires = calendar.timegm(
+            time.strptime(valid_until, storage.W3C_DATE_FORMAT))
+    except ValueError:
+        return True
+    return expires - now <= RENEW_BEFORE
+
+
+def sync(sections, items, manifest, delete=False, check_remote=False,
+        now=None):
+    """Publishes the new and changed items of a catalog.
+
+    sections - the storage configuration (see config.storage_config).
+    items - the unsigned assets and listings of the catalog.
+    manifest - the Manifest of the catalog.
+    delete - whether to delete published items no longer in the catalog.
+    check_remote - whether to re-register unchanged items that are missing
+        from the listing service.
+    now - the time listings are checked for expiry at (default: now).
+
+    Returns {'uploaded', 'unchanged', 'deleted'} counts. The manifest is
+    saved once the sync completes.
+    """
+    listings_url = sections.get("general", "listings-url")
+    if now is None:
+        now = time.time()
+    assets = [item for item in items if 'Asset' in _types(item)]
+    listings = [item for item in items if 'Listing' in _types(item)]
+    stats = {'uploaded': 0, 'unchanged': 0, 'deleted': 0}
+    # signed assets keyed by relative id, for listings of changed assets
+    signed = {}
+
+    def _changed(item, d):
+        entry = manifest.items.get(item['id'])
+        if entry is None or entry['digest'] != d:
+            return True
+        return check_remote and not _exists(listings_url + item['id'])
+
+    for asset in assets:
+        d = digest(asset, listings_url)
+        if _changed(asset, d):
+            signed[asset['id']] = storage.register_asset(sections, asset)
+            manifest.record({'id': asset['id'], 'digest': d,
+                'assetHash': util.hash(signed[asset['id']])})
+            stats['uploaded'] += 1
+        else:
+            stats['unchanged'] += 1
+
+    for listing in listings:
+        d = digest(listing, listings_url)
+        asset_id = listing.get('asset', '')
+        if asset_id.startswith(listings_url):
+            asset_id = asset_id[len(listings_url):]
+        # a listing is stale once its asset has been signed again or its
+        # validity window is about to end
+        asset_entry = manifest.items.get(asset_id)
+        entry = manifest.items.get(listing['id'], {})
+        if _changed(listing, d) or _expiring(entry, now) or \
+                (asset_entry is not None and
+                entry.get('assetHash') != asset_entry.get('assetHash')):
+            signed_asset = signed.get(asset_id)
+            if signed_asset is None:
+                signed_asset = signed[asset_id] = \
+                    storage.fetch(sections, {'id': asset_id})
+            sl = storage.register_listing(sections, signed_asset, listing)
+            manifest.record({'id': listing['id'], 'digest': d,
+                'assetHash': sl['assetHash'],
+                'validUntil': sl['validUntil']})
+            stats['uploaded'] += 1
+        else:
+            stats['unchanged'] += 1
+
+    if delete:
+        current = set(item['id'] for item in assets + listings)
+        for item_id in sorted(set(manifest.items) - current):
+            res = util.request_raw('DELETE', listings_url + item_id,
+                priority=scheduler.PUBLISH)
+            if res.status != 404 and (res.status < 200 or res.status >= 300):
+                raise Exception('Bad status code %d deleting "%s"' %
+                    (res.status, listings_url + item_id))
+            manifest.record({'id': item_id, 'deleted': True})
+            stats['deleted'] += 1
+
+    manifest.save()
+    return stats
+
+
+class Sync(util.Plugin):
+    """Plugin to publish only the changed items of a catalog file."""
+
+    def __init__(self, config_plugin):
+        """Creates the plugin.
+
+        config_plugin - the plugin holding the session config.
+        """
+        self.config_plugin = config_plugin
+
+    def get_name(self):
+        return "Sync"
+
+    def before_args_parsed(self, parser, subparsers):
+        subparser = subparsers.add_parser('sync',
+                help='Publish new and changed assets and listings.')
+        subparser.add_argument('source',
+                help='The JSON-LD file of unsigned assets and listings.')
+        subparser.add_argument('--listings-url',
+                default=constants.DEFAULT_LISTINGS_URL,
+                help='URL for the Web Service that stores assets and '
+                'listings. (default: %(default)s)')
+        subparser.add_argument('--manifest',
+                help='The sync manifest file. (default: one per source '
+                'file and listings URL in the config directory)')
+        subparser.add_argument('--delete', action='store_true',
+                help='Delete published items that are no longer in the '
+                'source file.')
+        subparser.add_argument('--check-remote', action='store_true',
+                help='Re-publish unchanged items missing from the listing '
+                'service.')
+        subparser.set_defaults(func=self.run)
+
+    def after_args_parsed(self, args):
+        pass
+
+    def run(self, args):
+        sections = config.storage_config(
+            self.config_plugin.config, args.listings_url)
+        manifest = Manifest(args.manifest or
+            default_manifest_path(args.source, args.listings_url))
+        stats = sync(sections, storage.load_items(args.source), manifest,
+            args.delete, args.check_remote)
+        print "Uploaded %(uploaded)d, unchanged %(unchanged)d, " \
+            "deleted %(deleted)d" % stats
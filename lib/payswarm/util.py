@@ -30,7 +30,11 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import hashlib
-import json
+import os
+import sys
+import threading
+import time
+import zlib
 
 have_urllib3 = False
 try:
@@ -48,6 +52,40 @@ except ImportError:
     import urllib2
 
 import payswarm
+import codec
+import resilience
+import scheduler
+
+# remote JSON-LD documents (contexts) keyed by URL
+_documents = {}
+
+# serializes calls into PyLD, whose context cache is not thread-safe; remote
+# contexts are loaded before it is taken (see preload_contexts)
+jsonld_lock = threading.Lock()
+
+# seconds to wait for a response before a request fails
+REQUEST_TIMEOUT = 30
+
+# number of characters encoded and hashed at a time by update_digest
+DIGEST_CHUNK_SIZE = 64 * 1024
+
+# transport options for uploaded documents
+TRANSPORT = {
+    # serialize without insignificant whitespace
+    'compact': True,
+    # gzip request bodies (the server must accept Content-Encoding: gzip)
+    'gzip': False
+}
+
+def config_dir():
+    """
+    Returns the PaySwarm config directory.
+
+    PAYSWARM_CONFIG_DIR else ~/.config/payswarm1
+    """
+    return os.environ.get('PAYSWARM_CONFIG_DIR',
+        os.path.join(os.path.expanduser('~'), '.config', 'payswarm1'))
+
 
 def hash(obj):
     """
@@ -56,14 +94,120 @@ def hash(obj):
     @param obj the JSON-LD object to hash.
     @param callback(err, hash) called once the operation completes.
     """
-    normalized = payswarm.jsonld.normalize(obj, {
-        'format': 'application/nquads'
-    })
+    normalized = normalize(obj)
 
     if len(normalized) == 0:
         raise Exception('Attempt to hash empty normalized data.')
 
-    return 'urn:sha256:' + hashlib.sha256(normalized).hexdigest()
+    h = update_digest(hashlib.sha256(), normalized)
+    return 'urn:sha256:' + h.hexdigest()
+
+
+def update_digest(h, data):
+    """
+    Feeds text to a hash object as UTF-8 without encoding it all at once.
+
+    Unicode text is encoded and hashed DIGEST_CHUNK_SIZE characters at a
+    time, so only one chunk of the encoded text exists at any moment.
+
+    @param h the hash object, such as a hashlib or Crypto.Hash object.
+    @param data the unicode or UTF-8 encoded text to hash.
+
+    @return the hash object.
+    """
+    if isinstance(data, unicode):
+        for i in xrange(0, len(data), DIGEST_CHUNK_SIZE):
+            h.update(data[i:i + DIGEST_CHUNK_SIZE].encode('utf-8'))
+    else:
+        h.update(data)
+    return h
+
+
+def normalize(obj):
+    """
+    Normalizes JSON-LD data to N-Quads using the caching document loader.
+
+    @param obj the JSON-LD object to normalize.
+    """
+    preload_contexts(obj)
+    with jsonld_lock:
+        return payswarm.jsonld.normalize(obj, {
+            'format': 'application/nquads',
+            'documentLoader': load_document
+        })
+
+
+def load_document(url):
+    """
+    Loads a remote JSON-LD document for the JSON-LD processor.
+
+    Known PaySwarm contexts are served from payswarm.constants without any
+    network access. Other documents are fetched once and kept for the life
+    of the process.
+
+    @param url the URL of the document to load.
+    """
+    if url in payswarm.constants.CONTEXTS:
+        document = {'@context': payswarm.constants.CONTEXTS[url]}
+    else:
+        document = _documents.get(url)
+        if document is None:
+            document = document_fetches.do(url, _fetch_document, (url,))
+    return {
+        'contextUrl': None,
+        'documentUrl': url,
+        'document': document
+    }
+
+
+def _fetch_document(url):
+    document = _documents[url] = get(url)
+    return document
+
+
+def _context_urls(obj, urls):
+    """Collects the remote context URLs used anywhere in a document."""
+    if isinstance(obj, list):
+        for value in obj:
+            _context_urls(value, urls)
+    elif isinstance(obj, dict):
+        for name, value in obj.items():
+            if name == '@context':
+                for ctx in (value if isinstance(value, list) else [value]):
+                    if isinstance(ctx, basestring):
+                        if ctx not in payswarm.constants.CONTEXTS:
+                            urls.add(ctx)
+                    else:
+                        _context_urls(ctx, urls)
+            else:
+                _context_urls(value, urls)
+
+
+def preload_contexts(obj):
+    """
+    Loads the remote contexts of a JSON-LD document into the document cache.
+
+    Call it before taking jsonld_lock, so that the JSON-LD processor only
+    reads cached contexts while it holds the lock and threads waiting on
+    remote fetches do not hold up each other. Contexts that cannot be loaded
+    are left for the processor to report.
+
+    @param obj the JSON-LD document or frame.
+    """
+    pending = set()
+    _context_urls(obj, pending)
+    seen = set()
+    while pending:
+        url = pending.pop()
+        seen.add(url)
+        try:
+            document = load_document(url)['document']
+        except Exception:
+            continue
+        # contexts may import other remote contexts
+        found = set()
+        _context_urls(document, found)
+        pending.update(found - seen)
 
 
 def inline_context(jsonld):
@@ -75,46 +219,270 @@ def inline_context(jsonld):
             return payswarm.constants.CONTEXTS[ctx]
         return ctx
     if '@context' in jsonld:
-        if isinstance(jsonld['@context'], str):
+        if isinstance(jsonld['@context'], basestring):
             jsonld['@context'] = _inline(jsonld['@context'])
         elif isinstance(jsonld['@context'], list):
             jsonld['@context'] = [_inline(el) for el in jsonld['@context']]
 
 
+class HTTPError(Exception):
+    """
+    A request that received a response with an unexpected status code.
+    """
+
+    def __init__(self, message, status):
+        Exception.__init__(self, message)
+        # the status code
+        self.status = status
+
+
+class Response(object):
+    """
+    A raw HTTP response.
+    """
+
+    def __init__(self, status, headers, data):
+        # the status code
+        self.status = status
+        # the headers with lowercased names
+        self.headers = dict((k.lower(), v) for k, v in headers.items())
+        # the response body
+        self.data = data
+
+
+def request_raw(method, url, body=None, headers=None,
+        priority=scheduler.DEFAULT, timeout=None):
+    """
+    Perform a HTTP or HTTPS web request without interpreting the response.
+    Uses urllib3 if available. Without urllib3 a secure request to a SNI server
+    may fail.
+
+    The request fails at once if the host's circuit is open (see
+    payswarm.resilience) and otherwise waits its turn with payswarm.scheduler
+    before it is sent.
+
+    @param method the HTTP method.
+    @param url the URL to request.
+    @param body the request body (optional).
+    @param headers a dict of request headers (optional).
+    @param priority the scheduler priority class of the request.
+    @param timeout the seconds to wait for a response (default:
+        REQUEST_TIMEOUT).
+
+    @return the Response, whatever its status code. Compressed response
+        bodies are decompressed.
+    """
+    resilience.breaker.before(url)
+    scheduler.scheduler.acquire(url, priority)
+    start = time.time()
+    try:
+        res = _send(method, url, body, headers, timeout or REQUEST_TIMEOUT)
+    except Exception:
+        resilience.breaker.failure(url)
+        raise
+    if res.status >= 500:
+        resilience.breaker.failure(url)
+    else:
+        resilience.breaker.success(url, time.time() - start)
+    scheduler.scheduler.release(url, res.status, res.headers)
+    return res
+
+
+def _send(method, url, body, headers, timeout):
+    headers = dict(headers or {})
+    headers.setdefault('Accept-Encoding', 'gzip')
+    if have_urllib3:
+        # urllib3 decodes compressed content itself
+        res = urllib3pool.urlopen(method, url, body=body, headers=headers,
+            timeout=timeout)
+        return Response(res.status, res.headers, res.data)
+
+    req = urllib2.Request(url, data=body, headers=headers)
+    req.get_method = lambda: method
+    try:
+        res = urllib2.urlopen(req, timeout=timeout)
+    except urllib2.HTTPError, e:
+        # non-2xx responses are still responses
+        res = e
+    data = res.read()
+    if res.info().get('Content-Encoding') == 'gzip':
+        data = gunzip(data)
+    return Response(res.getcode(), res.info(), data)
+
+
 def request(method, url, **kwargs):
     """
     Perform a HTTP or HTTPS web request for JSON-LD data.
     Uses urllib3 if available. Without urllib3 a secure request to a SNI server
     may fail.
     """
-    if have_urllib3:
-        res = urllib3pool.request(method, url, **kwargs)
-        if res.status < 200 or res.status >= 300:
-            raise Exception('Bad status code %d getting public key "%s"' %
-                    ( res.status, url))
-        data = res.data
-    else:
-        res = urllib2.urlopen(signature['creator'], **kwargs)
-        data = res.read()
+    res = request_raw(method, url, kwargs.get('data'), kwargs.get('headers'),
+        kwargs.get('priority', scheduler.DEFAULT), kwargs.get('timeout'))
+    if res.status < 200 or res.status >= 300:
+        raise HTTPError('Bad status code %d requesting "%s"' %
+                (res.status, url), res.status)
 
     # FIXME: check data type
     # FIXME: handle RDFa
 
-    return json.loads(data)
+    return codec.loads(res.data)
+
+
+def serialize(obj):
+    """
+    Serialize a JSON-LD document for upload according to TRANSPORT.
+
+    @param obj the JSON-LD object to serialize.
+    """
+    if TRANSPORT['compact']:
+        return codec.dumps(obj, sort_keys=True, separators=(',', ':'))
+    return codec.dumps(obj, sort_keys=True, indent=2)
 
 
-def get(url):
+def gzip(data):
+    """
+    Compress data in gzip format.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def gunzip(data):
+    """
+    Decompress gzip formatted data.
+    """
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+def upload(url, obj, method='POST', priority=scheduler.DEFAULT):
+    """
+    Upload a JSON-LD document, serialized and compressed according to
+    TRANSPORT.
+
+    @param url the URL to upload to.
+    @param obj the JSON-LD object to upload.
+    @param method the HTTP method to use.
+    @param priority the scheduler priority class of the upload.
+
+    @return the Response.
+    """
+    body = serialize(obj)
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+    headers = {'Content-Type': 'application/ld+json'}
+    if TRANSPORT['gzip']:
+        body = gzip(body)
+        headers['Content-Encoding'] = 'gzip'
+    res = request_raw(method, url, body, headers, priority)
+    if res.status < 200 or res.status >= 300:
+        raise HTTPError('Bad status code %d uploading to "%s"' %
+                (res.status, url), res.status)
+    return res
+
+
+def get(url, priority=scheduler.DEFAULT, hedge=None):
     """
     Get a JSON-LD resource.
+
+    @param url the URL of the resource.
+    @param priority the scheduler priority class of the request.
+    @param hedge True to send a second request if the first is slower than
+        the host's recent HEDGE_PERCENTILE response time (default:
+        payswarm.resilience.HEDGE).
     """
-    return request('GET', url)
+    if hedge is None:
+        hedge = resilience.HEDGE
+    delay = None
+    if hedge:
+        delay = resilience.breaker.hedge_delay(url)
+    if delay is None:
+        return request('GET', url, priority=priority)
+    return resilience.breaker.hedge(
+        lambda: request('GET', url, priority=priority), delay)
 
 
-def post(url, data):
+def post(url, data, priority=scheduler.DEFAULT):
     """
     Post a JSON-LD resource.
     """
-    return request('POST', url, data=data)
+    return request('POST', url, data=data, priority=priority)
+
+
+class _Call(object):
+    """An in-flight SingleFlight call."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls that share a key into a single call.
+
+    The first caller for a key runs the function. Callers that arrive while
+    that call is in flight wait for it and share its result or exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        # calls made, calls that joined an in-flight call, failed calls and
+        # waiters that timed out
+        self.stats = {'calls': 0, 'coalesced': 0, 'errors': 0, 'timeouts': 0}
+
+    def do(self, key, fn, args=(), timeout=None):
+        """
+        Calls fn(*args) unless a call for key is already in flight.
+
+        @param key the key identifying the call.
+        @param fn the function to call.
+        @param args the arguments to pass to fn.
+        @param timeout the maximum number of seconds to wait for a call made
+            by another thread, None to wait forever.
+
+        @return the result of the call.
+        """
+        with self._lock:
+            self.stats['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.stats['coalesced'] += 1
+
+        if leader:
+            try:
+                try:
+                    call.result = fn(*args)
+                except Exception:
+                    call.error = sys.exc_info()
+                except:
+                    # interrupted (KeyboardInterrupt, SystemExit); waiting
+                    # callers fail instead of returning a missing result
+                    call.error = (Exception, Exception(
+                        'Call for "%s" was interrupted.' % (key,)), None)
+                    raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                    if call.error is not None:
+                        self.stats['errors'] += 1
+                call.event.set()
+        elif not call.event.wait(timeout):
+            with self._lock:
+                self.stats['timeouts'] += 1
+            raise Exception('Timed out waiting for "%s".' % (key,))
+
+        if call.error is not None:
+            raise call.error[0], call.error[1], call.error[2]
+        return call.result
+
+
+# coalesces concurrent fetches of the same remote JSON-LD document
+document_fetches = SingleFlight()
 
 
 class Plugin(object):
@@ -0,0 +1,226 @@
+"""The warmup module preloads caches before a verifier takes traffic.
+
+A fresh process fetches every creator's public key and every remote
+JSON-LD context on first use and validates each frame the first time it
+frames a document. Warming up does that work ahead of time, concurrently,
+from any of:
+
+    a catalog archive or JSON-LD file of signed assets and listings
+    a file of public key URLs, one per line ("#" starts a comment)
+    a traffic log of JSON Lines, each a JSON-LD document or a daemon or
+        batch request carrying documents in its params
+
+Run it on its own to see what a cold start costs, or pass the same options
+to the daemon command to warm up before it starts listening:
+
+    ./payswarm warmup --catalog catalog.psc --traffic requests.jsonl
+    ./payswarm daemon --catalog catalog.psc --keys creators.txt
+"""
+from __future__ import with_statement
+
+from multiprocessing.pool import ThreadPool
+import json
+import sys
+import time
+
+import constants
+import frames
+import keys
+import storage
+import util
+
+# number of concurrent key and context fetches
+JOBS = 16
+
+
+class Report(object):
+    """The results of a warm-up."""
+
+    def __init__(self):
+        self.keys = 0
+        self.contexts = 0
+        self.frames = 0
+        # (entry, error message)
+        self.errors = []
+        self.seconds = 0
+
+    @property
+    def loaded(self):
+        """The number of entries loaded."""
+        return self.keys + self.contexts + self.frames
+
+
+def _scan(obj, key_ids, context_urls):
+    """Collects signature creators and remote context URLs in a document."""
+    if isinstance(obj, list):
+        for value in obj:
+            _scan(value, key_ids, context_urls)
+        return
+    if not isinstance(obj, dict):
+        return
+    ctx = obj.get('@context')
+    for value in (ctx if isinstance(ctx, list) else [ctx]):
+        if isinstance(value, basestring) and \
+                value not in constants.CONTEXTS:
+            context_urls.add(value)
+    sig = obj.get('signature')
+    if isinstance(sig, dict) and isinstance(sig.get('creator'), basestring):
+        key_ids.add(sig['creator'])
+    for name, value in obj.items():
+        if name != '@context':
+            _scan(value, key_ids, context_urls)
+
+
+def read_key_ids(path):
+    """Returns the public key URLs listed in a file, one per line."""
+    key_ids = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                key_ids.append(line)
+    return key_ids
+
+
+def read_traffic(path):
+    """Iterates over the documents in a JSON Lines traffic log.
+
+    Lines that are daemon or batch requests yield their params; other lines
+    are yielded as they are. Lines that are not JSON are skipped.
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                document = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(document, dict) and 'method' in document:
+                document = document.get('params', {})
+            yield document
+
+
+def warmup(documents=(), key_ids=(), jobs=JOBS):
+    """Preloads public keys, remote contexts and validated frames.
+
+    documents - JSON-LD documents whose signature creators and remote
+        contexts are loaded.
+    key_ids - more public key URLs to load. Keys known to be revoked are
+        skipped.
+    jobs - the number of concurrent fetches.
+
+    Returns a Report. Entries that fail to load are reported, not raised.
+    """
+    report = Report()
+    start = time.time()
+    key_ids = set(key_ids)
+    context_urls = set()
+    for document in documents:
+        _scan(document, key_ids, context_urls)
+
+    def _load(task):
+        kind, name = task
+        try:
+            if kind == 'key':
+                key = keys.get_public_key(name)
+                if 'publicKeyPem' in key:
+                    keys.import_key(key['publicKeyPem'])
+            elif kind == 'context':
+                util.load_document(name)
+            else:
+                frames.get_frame(name)
+        except Exception, e:
+            return task, str(e)
+        return task, None
+
+    # revoked keys are not fetched
+    tasks = [('key', key_id) for key_id in sorted(key_ids)
+        if not keys.is_revoked(key_id)]
+    tasks.extend(('context', url) for url in sorted(context_urls))
+    tasks.extend(('frame', name) for name in sorted(constants.FRAMES))
+    pool = ThreadPool(max(jobs, 1))
+    try:
+        for (kind, name), error in pool.imap_unordered(_load, tasks):
+            if error is not None:
+                report.errors.append((name, error))
+            elif kind == 'key':
+                report.keys += 1
+            elif kind == 'context':
+                report.contexts += 1
+            else:
+                report.frames += 1
+    finally:
+        pool.close()
+        pool.join()
+    report.seconds = time.time() - start
+    return report
+
+
+def add_source_arguments(parser):
+    """Adds the warm-up source options to a parser."""
+    parser.add_argument('--catalog', action='append', default=[],
+            help='A catalog archive or JSON-LD file of signed items. '
+            'May be repeated.')
+    parser.add_argument('--keys', action='append', default=[],
+            help='A file of public key URLs, one per line. May be repeated.')
+    parser.add_argument('--traffic', action='append', default=[],
+            help='A JSON Lines log of documents or daemon requests. '
+            'May be repeated.')
+    parser.add_argument('--warmup-jobs', type=int, default=JOBS,
+            help='Concurrent fetches while warming up. '
+            '(default: %(default)s)')
+
+
+def has_sources(args):
+    """Returns whether any warm-up sources were given."""
+    return bool(args.catalog or args.keys or args.traffic)
+
+
+def run_from_args(args):
+    """Warms up from the sources given by add_source_arguments options and
+    returns the Report."""
+    def _documents():
+        for path in args.catalog:
+            for item in storage.iter_items(path):
+                yield item
+        for path in args.traffic:
+            for document in read_traffic(path):
+                yield document
+    key_ids = []
+    for path in args.keys:
+        key_ids.extend(read_key_ids(path))
+    return warmup(_documents(), key_ids, args.warmup_jobs)
+
+
+def print_report(report, out=sys.stdout):
+    """Writes a warm-up report."""
+    for name, message in report.errors:
+        out.write("ERROR: %s: %s\n" % (name, message))
+    out.write("Warmed up %d keys, %d contexts and %d frames in %.2fs "
+        "(%d errors)\n" % (report.keys, report.contexts, report.frames,
+        report.seconds, len(report.errors)))
+
+
+class Warmup(util.Plugin):
+    """Plugin to measure warming up the caches of a verifier."""
+
+    def get_name(self):
+        return "Warmup"
+
+    def before_args_parsed(self, parser, subparsers):
+        subparser = subparsers.add_parser('warmup',
+                help='Preload keys, contexts and frames and report the '
+                'cost of a cold start.')
+        add_source_arguments(subparser)
+        subparser.set_defaults(func=self.run)
+
+    def after_args_parsed(self, args):
+        pass
+
+    def run(self, args):
+        report = run_from_args(args)
+        print_report(report)
+        if report.errors:
+            sys.exit(1)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import datetime
+import shutil
+import tempfile
+import unittest
+
+import payswarm
+import payswarm.audit
+
+class TestAudit(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.assets = [{
+            '@context': payswarm.constants.CONTEXT_URL,
+            'id': 'http://example.com/asset/%d' % i,
+            'type': 'Asset',
+            'title': 'Asset %d' % (i % 2)
+        } for i in range(4)]
+        self.listings = [{
+            '@context': payswarm.constants.CONTEXT_URL,
+            'id': 'http://example.com/listing/%d' % i,
+            'type': ['gr:Offering', 'Listing'],
+            'asset': asset['id'],
+            'assetHash': payswarm.util.hash(asset),
+            'validUntil': '2030-01-01T00:00:00Z'
+        } for i, asset in enumerate(self.assets)]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_consistent(self):
+        report = payswarm.audit.audit(self.assets + self.listings)
+        self.assertTrue(report.ok)
+        self.assertEqual(report.assets, 4)
+        self.assertEqual(report.listings, 4)
+        self.assertEqual(report.hashed, 4)
+
+    def test_problems(self):
+        self.listings[0]['assetHash'] = 'urn:sha256:0'
+        self.listings[1]['asset'] = 'http://example.com/asset/missing'
+        self.listings[2]['validUntil'] = '2000-01-01T00:00:00Z'
+        report = payswarm.audit.audit(self.listings + self.assets, jobs=2)
+        self.assertFalse(report.ok)
+        self.assertEqual([m[0] for m in report.mismatches],
+            [self.listings[0]['id']])
+        self.assertEqual(report.missing,
+            [(self.listings[1]['id'], 'http://example.com/asset/missing')])
+        self.assertEqual(report.expired,
+            [(self.listings[2]['id'], '2000-01-01T00:00:00Z')])
+
+    def test_many_batches(self):
+        assets = [dict(self.assets[0], id='http://example.com/asset/x%d' % i,
+            title='Asset x%d' % i) for i in range(80)]
+        listings = [dict(self.listings[0], id='http://example.com/l/x%d' % i,
+            asset=asset['id'], assetHash=payswarm.util.hash(asset))
+            for i, asset in enumerate(assets)]
+        report = payswarm.audit.audit(assets + listings, jobs=2)
+        self.assertTrue(report.ok)
+        self.assertEqual(report.assets, 80)
+        self.assertEqual(report.hashed, 80)
+
+    def test_cache(self):
+        cache = {}
+        payswarm.audit.audit(self.assets + self.listings, cache=cache)
+        self.assertEqual(len(cache), 4)
+        report = payswarm.audit.audit(self.assets + self.listings, cache=cache)
+        self.assertTrue(report.ok)
+        self.assertEqual(report.hashed, 0)
+        self.assertEqual(report.cached, 4)
+
+    def test_catalog_source(self):
+        path = os.path.join(self.dir, 'catalog.pscat')
+        payswarm.catalog.write(path, self.assets + self.listings)
+        items = payswarm.storage.iter_items(path)
+        report = payswarm.audit.audit(items,
+            now=datetime.datetime(2040, 1, 1))
+        self.assertEqual(len(report.expired), 4)
+
+if __name__ == '__main__':
+    unittest.main()
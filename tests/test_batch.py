@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import json
+import StringIO
+import unittest
+
+import payswarm
+import payswarm.batch
+import payswarm.mock
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.data = {
+            '@context': [
+                'https://w3id.org/payswarm/v1',
+                {
+                    'ex': 'http://example.com/',
+                    'id': 'http://example.com/id/',
+                },
+            ],
+            '@id': 'id:1',
+            'ex:foo': 'bar'
+        }
+        self.service = payswarm.mock.MockService().start()
+        self.runner = payswarm.batch.Runner({}, self.service.url)
+
+    def tearDown(self):
+        self.service.stop()
+
+    def _run(self, commands, jobs=1):
+        out = StringIO.StringIO()
+        lines = [json.dumps(command) + '\n' for command in commands]
+        errors = self.runner.run(lines, out, jobs)
+        return errors, [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_ordered_output(self):
+        commands = []
+        for i in range(20):
+            commands.append({'id': i, 'method': 'hash',
+                'params': {'jsonld': self.data}})
+        commands.append({'id': 20, 'method': 'unknown'})
+        for jobs in (1, 4):
+            errors, responses = self._run(commands, jobs)
+            self.assertEqual(errors, 1)
+            self.assertEqual([r['id'] for r in responses], range(21))
+            self.assertEqual(responses[0]['result'],
+                payswarm.util.hash(self.data))
+            self.assertTrue('error' in responses[20])
+
+    def test_fetch(self):
+        self.service.add_document('example/item', {'id': 'example/item'})
+        errors, responses = self._run([
+            {'id': 1, 'method': 'fetch', 'params': {'id': 'example/item'}},
+            {'id': 2, 'method': 'fetch', 'params': {'id': 'example/none'}}])
+        self.assertEqual(errors, 1)
+        self.assertEqual(responses[0]['result'], {'id': 'example/item'})
+
+if __name__ == '__main__':
+    unittest.main()
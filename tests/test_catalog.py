@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import shutil
+import tempfile
+import unittest
+
+import payswarm
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'catalog.pscat')
+        self.items = [{
+            'id': 'http://example.com/asset/%d' % i,
+            'type': 'Asset',
+            'title': u'Asset \u2116%d' % i
+        } for i in range(10)]
+        self.items += [{
+            'id': 'http://example.com/listing/%d' % i,
+            'type': 'Listing',
+            'asset': 'http://example.com/asset/%d' % (i % 2),
+            'assetHash': 'urn:sha256:%d' % (i % 2)
+        } for i in range(10)]
+        payswarm.catalog.write(self.path, self.items)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_lookup(self):
+        with payswarm.catalog.CatalogReader(self.path) as reader:
+            self.assertEqual(reader.record_count, 20)
+            for item in self.items:
+                self.assertEqual(reader.get(item['id']), item)
+            self.assertEqual(len(reader.find('urn:sha256:1')), 5)
+            self.assertEqual(reader.get('http://example.com/missing'), None)
+
+    def test_iterate(self):
+        with payswarm.catalog.CatalogReader(self.path) as reader:
+            self.assertEqual(list(reader), self.items)
+
+    def test_check(self):
+        with payswarm.catalog.CatalogReader(self.path) as reader:
+            self.assertEqual(reader.check(), [])
+
+        # corrupt a byte in the first record's data
+        with open(self.path, 'r+b') as f:
+            f.seek(60)
+            c = f.read(1)
+            f.seek(60)
+            f.write(chr(ord(c) ^ 1))
+        with payswarm.catalog.CatalogReader(self.path) as reader:
+            self.assertEqual(len(reader.check()), 1)
+            with self.assertRaises(Exception):
+                reader.read(24)
+
+    def test_failed_write(self):
+        def _items():
+            yield self.items[0]
+            raise ValueError('source failed')
+        self.assertRaises(ValueError, payswarm.catalog.write, self.path,
+            _items())
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_truncated(self):
+        for size in [0, 10]:
+            with open(self.path, 'wb') as f:
+                f.write('\0' * size)
+            with self.assertRaises(Exception) as context:
+                payswarm.catalog.CatalogReader(self.path)
+            self.assertTrue('truncated' in str(context.exception))
+
+if __name__ == '__main__':
+    unittest.main()
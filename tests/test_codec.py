@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import json
+import unittest
+
+import payswarm
+from payswarm import codec
+
+class TestCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = codec.backend
+        self.document = {
+            '@context': payswarm.constants.CONTEXT_URL,
+            'id': 'http://listings.example.com/listing/1',
+            'type': ['gr:Offering', 'Listing'],
+            'payeeRate': '0.05',
+            'rate': 0.1,
+            'count': 12345678901234,
+            'comment': u'Asset \u2116 1 "quoted" /path',
+            'flags': [True, False, None]
+        }
+
+    def tearDown(self):
+        codec.set_backend(self.backend)
+
+    def test_backends(self):
+        for name in codec.BACKENDS:
+            codec.set_backend(name)
+            data = codec.dumps(self.document, sort_keys=True,
+                separators=(',', ':'))
+            # serialized output never depends on the backend
+            self.assertEqual(data, json.dumps(self.document, sort_keys=True,
+                separators=(',', ':')))
+            self.assertEqual(codec.dumps(self.document, sort_keys=True,
+                indent=2), json.dumps(self.document, sort_keys=True, indent=2))
+            self.assertEqual(codec.loads(data), self.document)
+            self.assertNotEqual(codec.dumps_backend, 'ujson')
+
+    def test_string_types(self):
+        data = '{"@context": "%s", "title": "Asset"}' % \
+            payswarm.constants.CONTEXT_URL
+        for name in codec.BACKENDS:
+            codec.set_backend(name)
+            document = codec.loads(data)
+            self.assertTrue(isinstance(document['title'], basestring))
+            # parsed context URLs are inlined whatever their string type
+            payswarm.util.inline_context(document)
+            self.assertTrue(isinstance(document['@context'], dict))
+
+    def test_default_parse(self):
+        # the default backend parses every document as json does
+        self.assertNotEqual(codec.backend, 'ujson')
+        self.assertEqual(codec.loads('"\\ud800"'), u'\ud800')
+        self.assertEqual(codec.loads(str(2**64 + 1)), 2**64 + 1)
+
+    def test_ujson_fallback(self):
+        if 'ujson' not in codec.BACKENDS:
+            return
+        codec.set_backend('ujson')
+        self.assertEqual(codec.loads(str(2**64 + 1)), 2**64 + 1)
+        self.assertEqual(codec.loads('[1.5, "a"]'), [1.5, 'a'])
+
+    def test_canonical(self):
+        self.assertEqual(codec.canonical_dumps(self.document),
+            json.dumps(self.document, sort_keys=True, separators=(',', ':')))
+
+    def test_unknown_backend(self):
+        self.assertRaises(Exception, codec.set_backend, 'missing')
+        self.assertEqual(codec.backend, self.backend)
+
+if __name__ == '__main__':
+    unittest.main()
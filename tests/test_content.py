@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import hashlib
+import shutil
+import tempfile
+import unittest
+
+import payswarm
+
+class TestContent(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.chunk_size = payswarm.content.CHUNK_SIZE
+        self.save_interval = payswarm.content.SAVE_INTERVAL
+        payswarm.content.CHUNK_SIZE = 1024
+        self.data = ''.join(chr(i % 251) for i in range(5 * 1024 + 17))
+        self.path = os.path.join(self.dir, 'content.bin')
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        payswarm.content.CHUNK_SIZE = self.chunk_size
+        payswarm.content.SAVE_INTERVAL = self.save_interval
+        shutil.rmtree(self.dir)
+
+    def _tree(self):
+        size = payswarm.content.CHUNK_SIZE
+        nodes = [hashlib.sha256('\x00' + self.data[i:i + size]).digest()
+            for i in range(0, len(self.data), size)]
+        while len(nodes) > 1:
+            parents = [hashlib.sha256('\x01' + nodes[i] + nodes[i + 1])
+                .digest() for i in range(0, len(nodes) - 1, 2)]
+            if len(nodes) % 2:
+                parents.append(nodes[-1])
+            nodes = parents
+        return nodes[0].encode('hex')
+
+    def test_sha256(self):
+        self.assertEqual(payswarm.content.hash_file(self.path),
+            hashlib.sha256(self.data).hexdigest())
+
+    def test_tree(self):
+        self.assertEqual(
+            payswarm.content.hash_file(self.path, 'tree', jobs=3),
+            self._tree())
+
+    def test_empty(self):
+        path = os.path.join(self.dir, 'empty.bin')
+        open(path, 'wb').close()
+        self.assertEqual(payswarm.content.hash_file(path),
+            hashlib.sha256('').hexdigest())
+        self.assertEqual(payswarm.content.hash_file(path, 'tree'),
+            hashlib.sha256('\x00').hexdigest())
+
+    def test_resume(self):
+        state = self.path + '.hashstate'
+        st = os.stat(self.path)
+        # a saved state with a bogus leaf shows that saved leaves are reused
+        leaves = ['\xff' * 32, hashlib.sha256(
+            '\x00' + self.data[1024:2048]).digest()]
+        payswarm.content._save_state(state, self.path, st, leaves)
+        resumed = payswarm.content.hash_tree(self.path, state=state)
+        self.assertNotEqual(resumed, self._tree())
+        self.assertFalse(os.path.exists(state))
+        # a state for a different file is ignored
+        payswarm.content._save_state(state, state, st, leaves)
+        self.assertEqual(
+            payswarm.content.hash_tree(self.path, state=state), self._tree())
+
+    def test_record_digest(self):
+        asset = payswarm.content.record_digest({}, self.path, 'tree')
+        self.assertEqual(asset['digestAlgorithm'], 'sha256-tree')
+        self.assertEqual(asset['digestValue'], self._tree())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import shutil
+import tempfile
+import threading
+import unittest
+
+import payswarm
+import payswarm.daemon
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.data = {
+            '@context': [
+                'https://w3id.org/payswarm/v1',
+                {
+                    'ex': 'http://example.com/',
+                    'id': 'http://example.com/id/',
+                },
+            ],
+            '@id': 'id:1',
+            'ex:foo': 'bar'
+        }
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'daemon.sock')
+        self.server = payswarm.daemon.Server(self.path)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.client = payswarm.daemon.Client(self.path)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def test_hash(self):
+        self.assertEqual(
+                self.client.hash(self.data), payswarm.util.hash(self.data))
+
+    def test_pipeline(self):
+        results = self.client.pipeline([('hash', {'jsonld': self.data})] * 3)
+        self.assertEqual(results, [payswarm.util.hash(self.data)] * 3)
+
+    def test_errors(self):
+        with self.assertRaises(Exception):
+            self.client.call('unknown', {})
+        # connection is still usable after an error
+        self.assertEqual(
+                self.client.hash(self.data), payswarm.util.hash(self.data))
+
+    def test_socket_mode(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0777, 0600)
+
+    def test_dispatch_invalid(self):
+        response = payswarm.daemon.dispatch('not json')
+        self.assertTrue('error' in response)
+        for line in ['[]', '1', '"verify"', 'null']:
+            response = payswarm.daemon.dispatch(line)
+            self.assertEqual(response['id'], None)
+            self.assertTrue('error' in response)
+
+if __name__ == '__main__':
+    unittest.main()
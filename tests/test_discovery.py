@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import shutil
+import tempfile
+import unittest
+
+import payswarm
+import payswarm.mock
+
+class TestDiscovery(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config_dir = os.environ.get('PAYSWARM_CONFIG_DIR')
+        os.environ['PAYSWARM_CONFIG_DIR'] = self.dir
+        self.service = payswarm.mock.MockService().start()
+        self.service.add_document('client-config', {
+            payswarm.discovery.PSW_KEYS: self.service.url + 'keys'
+        })
+        self.url = self.service.url + 'client-config'
+        self.ttl = payswarm.discovery.DISCOVERY_TTL
+        payswarm.discovery.clear()
+
+    def tearDown(self):
+        payswarm.discovery.DISCOVERY_TTL = self.ttl
+        payswarm.discovery.clear()
+        self.service.stop()
+        if self.config_dir is None:
+            del os.environ['PAYSWARM_CONFIG_DIR']
+        else:
+            os.environ['PAYSWARM_CONFIG_DIR'] = self.config_dir
+        shutil.rmtree(self.dir)
+
+    def test_endpoint(self):
+        self.assertEqual(
+            payswarm.discovery.get_endpoint(self.url, 'keys-url'),
+            self.service.url + 'keys')
+
+    def test_disk_cache(self):
+        payswarm.discovery.get_config(self.url)
+        # served from disk once the authority is gone
+        self.service.remove_document('client-config')
+        payswarm.discovery.clear()
+        self.assertEqual(
+            payswarm.discovery.get_endpoint(self.url, 'keys-url'),
+            self.service.url + 'keys')
+
+    def test_revalidate(self):
+        payswarm.discovery.DISCOVERY_TTL = -1
+        config = payswarm.discovery.get_config(self.url)
+        etag = payswarm.discovery._configs[self.url]['etag']
+        self.assertTrue(etag)
+        # unchanged document is revalidated with the ETag
+        self.assertEqual(payswarm.discovery.get_config(self.url), config)
+        # changed document is fetched again
+        self.service.add_document('client-config', {'changed': True})
+        self.assertEqual(
+            payswarm.discovery.get_config(self.url), {'changed': True})
+
+if __name__ == '__main__':
+    unittest.main()
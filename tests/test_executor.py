@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import threading
+import unittest
+
+from Crypto.PublicKey import RSA
+
+import payswarm
+import payswarm.executor
+import payswarm.mock
+
+class TestExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.service = payswarm.mock.MockService(latency=0.02).start()
+        key = RSA.generate(1024)
+        self.pem = key.exportKey()
+        self.key_id = self.service.add_key('test', key.publickey().exportKey())
+        self.docs = [{
+            '@context': payswarm.constants.CONTEXT_URL,
+            'id': 'http://example.com/asset/%d' % i,
+            'type': 'Asset',
+            'title': 'Asset %d' % i
+        } for i in range(40)]
+        payswarm.keys.clear()
+        payswarm.signature.clear_verified()
+        self.executor = payswarm.executor.Executor(io_workers=8, cpu_workers=4)
+
+    def tearDown(self):
+        self.executor.close()
+        self.service.stop()
+        payswarm.keys.clear()
+        payswarm.signature.clear_verified()
+
+    def test_sign_verify_hash(self):
+        signed = [f.result(10) for f in
+            [self.executor.sign(doc, self.key_id, self.pem)
+                for doc in self.docs]]
+        verified = [self.executor.verify(doc) for doc in signed]
+        hashes = [self.executor.hash(doc) for doc in self.docs]
+        self.assertEqual([f.result(10) for f in verified],
+            [True] * len(signed))
+        self.assertEqual([f.result(10) for f in hashes],
+            [payswarm.util.hash(doc) for doc in self.docs])
+
+    def test_errors(self):
+        signed = payswarm.signature.sign(self.docs[0], self.key_id, self.pem)
+        signed['title'] = 'Tampered'
+        self.assertRaises(Exception, self.executor.verify(signed).result, 10)
+        missing = self.service.url + 'keys/missing'
+        self.assertRaises(Exception, self.executor.fetch_key(missing).result, 10)
+
+    def test_concurrent_stress(self):
+        # threads verify and clear the key and verification caches at once;
+        # every result must still be correct
+        signed = [payswarm.signature.sign(doc, self.key_id, self.pem)
+            for doc in self.docs]
+        errors = []
+
+        def _worker(n):
+            try:
+                for i in range(20):
+                    doc = signed[(n + i) % len(signed)]
+                    if i % 7 == 0:
+                        payswarm.keys.clear()
+                        payswarm.signature.clear_verified()
+                    if not payswarm.signature.verify(doc):
+                        errors.append('not verified')
+                    futures = [self.executor.verify(doc),
+                        self.executor.hash(self.docs[i])]
+                    for future in futures:
+                        future.result(10)
+            except Exception, e:
+                errors.append(str(e))
+
+        threads = [threading.Thread(target=_worker, args=(n,))
+            for n in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+if __name__ == '__main__':
+    unittest.main()
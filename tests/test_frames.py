@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import unittest
+
+from Crypto.PublicKey import RSA
+
+import payswarm
+import payswarm.mock
+
+class TestFrames(unittest.TestCase):
+
+    def setUp(self):
+        payswarm.frames.clear()
+
+    def test_named_frame_validated_once(self):
+        frame = payswarm.frames.get_frame('Listing')
+        self.assertEqual(frame, payswarm.constants.FRAMES['Listing'])
+        self.assertTrue(payswarm.frames.get_frame('Listing') is frame)
+
+    def test_custom_frame_cached_by_content(self):
+        frame = {'@context': payswarm.constants.CONTEXT_URL, 'type': 'Asset'}
+        first = payswarm.frames._get_custom(frame)
+        second = payswarm.frames._get_custom(dict(frame))
+        self.assertTrue(first is second)
+
+    def test_same_as_pyld(self):
+        asset = {
+            '@context': payswarm.constants.CONTEXT_URL,
+            'id': 'http://example.com/asset#1',
+            'type': 'Asset',
+            'title': 'Test Asset'
+        }
+        framed = payswarm.frames.frame(asset, 'Asset')
+        self.assertEqual(framed['@context'], payswarm.constants.CONTEXT_URL)
+        self.assertEqual(framed, payswarm.jsonld.frame(asset,
+            payswarm.constants.FRAMES['Asset'],
+            {'documentLoader': payswarm.util.load_document}))
+        # framing again with the cached frame gives the same output
+        self.assertEqual(payswarm.frames.frame(asset, 'Asset'), framed)
+
+    def test_sign_verify(self):
+        service = payswarm.mock.MockService().start()
+        try:
+            key = RSA.generate(1024)
+            key_id = service.add_key('test', key.publickey().exportKey())
+            asset = {
+                '@context': payswarm.constants.CONTEXT_URL,
+                'id': 'http://example.com/asset#1',
+                'type': 'Asset',
+                'title': 'Test Asset'
+            }
+            signed = payswarm.signature.sign(asset, key_id, key.exportKey())
+            # verify twice so the second call uses the cached frame
+            self.assertTrue(payswarm.signature.verify(signed))
+            payswarm.signature.clear_verified()
+            self.assertTrue(payswarm.signature.verify(signed))
+        finally:
+            payswarm.keys.clear()
+            payswarm.signature.clear_verified()
+            service.stop()
+
+    def test_invalid_frame(self):
+        self.assertRaises(Exception, payswarm.frames.compile_frame, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import unittest
+
+import payswarm
+import payswarm.loadtest
+import payswarm.mock
+
+class TestLoadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service = payswarm.mock.MockService(seed=1).start()
+        self.items = [{
+            '@context': payswarm.constants.CONTEXT_URL,
+            'id': 'example/asset',
+            'type': 'Asset',
+            'title': 'Test Asset'
+        }, {
+            '@context': payswarm.constants.CONTEXT_URL,
+            'id': 'example/listing',
+            'type': ['gr:Offering', 'Listing']
+        }]
+        payswarm.discovery.clear()
+
+    def tearDown(self):
+        self.service.stop()
+        payswarm.discovery.clear()
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(payswarm.loadtest.percentile(values, 50), 50)
+        self.assertEqual(payswarm.loadtest.percentile(values, 99), 99)
+        self.assertEqual(payswarm.loadtest.percentile([], 50), None)
+
+    def test_error_injection(self):
+        self.service.error_rate = 1
+        self.assertRaises(Exception, payswarm.util.get,
+            self.service.url + 'client-config')
+        self.service.error_rate = 0
+        self.assertTrue(payswarm.discovery.PSW_CONTRACTS in
+            payswarm.util.get(self.service.url + 'client-config'))
+
+    def test_purchase(self):
+        fn = payswarm.loadtest.setup(
+            'purchase', self.service.url, self.items)
+        fn()
+        contract = self.service.get_document('contracts/1')
+        self.assertEqual(contract['listing'],
+            self.service.url + 'example/listing')
+
+        # a purchase of a changed listing is refused
+        listing = dict(self.service.get_document('example/listing'))
+        listing['comment'] = 'Changed'
+        request = payswarm.purchase.create_request(listing, 'account')
+        self.assertEqual(self.service.purchase(request)[0], 409)
+
+    def test_run(self):
+        fn = payswarm.loadtest.setup('fetch', self.service.url, self.items)
+        self.service.latency = 0.01
+        self.service.error_rate = 0.5
+        report = payswarm.loadtest.run(fn, rate=100, duration=0.5)
+        summary = report.summary()
+        self.assertEqual(summary['requests'], 50)
+        self.assertTrue(0 < summary['errors'] < 50)
+        self.assertTrue(summary['p50'] >= 10)
+        self.assertTrue(summary['p50'] <= summary['p99'] <= summary['max'])
+
+if __name__ == '__main__':
+    unittest.main()
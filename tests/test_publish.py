@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+
+from Crypto.PublicKey import RSA
+
+import payswarm
+import payswarm.mock
+from payswarm import publish
+
+class TestPublish(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.ledger_path = os.path.join(self.dir, 'ledger.db')
+        self.source = os.path.join(self.dir, 'catalog.jsonld')
+        self.service = payswarm.mock.MockService().start()
+        key = RSA.generate(1024)
+        key_id = self.service.add_key('test', key.publickey().exportKey())
+        self.sections = payswarm.config.storage_config({
+            'authority': self.service.url,
+            'owner': self.service.url + 'i/test',
+            'publicKey': {'id': key_id, 'privateKeyPem': key.exportKey()}
+        }, self.service.url)
+        self.items = []
+        for i in range(8):
+            self.items.append({
+                '@context': payswarm.constants.CONTEXT_URL,
+                'id': 'asset/%d' % i,
+                'type': 'Asset',
+                'title': 'Asset %d' % i
+            })
+        for i in range(16):
+            self.items.append({
+                '@context': payswarm.constants.CONTEXT_URL,
+                'id': 'listing/%d' % i,
+                'type': ['gr:Offering', 'Listing'],
+                'asset': 'asset/%d' % (i % 8)
+            })
+        with open(self.source, 'w') as f:
+            json.dump(self.items, f)
+        self.interval = publish.CHECKPOINT_INTERVAL
+
+    def tearDown(self):
+        publish.CHECKPOINT_INTERVAL = self.interval
+        self.service.stop()
+        shutil.rmtree(self.dir)
+
+    def _check_published(self):
+        for item in self.items:
+            document = self.service.get_document(item['id'])
+            self.assertTrue('signature' in document)
+            if 'asset' in item:
+                asset = self.service.get_document(item['asset'])
+                self.assertEqual(document['assetHash'],
+                    payswarm.util.hash(asset))
+
+    def test_shards(self):
+        shards = [publish.shard_of(item, 4) for item in self.items]
+        self.assertEqual(shards, [publish.shard_of(item, 4)
+            for item in self.items])
+        # listings go to the shard of their asset
+        for listing, shard in zip(self.items[8:], shards[8:]):
+            self.assertEqual(shard, shards[int(listing['asset'][6:])])
+        total = sum(len(publish.shard_items(self.items, shard, 4))
+            for shard in range(4))
+        self.assertEqual(total, len(self.items))
+        parts = publish.partition(self.items, 4)
+        self.assertEqual(parts, [publish.shard_items(self.items, shard, 4)
+            for shard in range(4)])
+
+    def test_read_once(self):
+        reads = []
+        iter_items = publish.storage.iter_items
+
+        def _iter_items(source):
+            reads.append(source)
+            return iter_items(source)
+        publish.storage.iter_items = _iter_items
+        try:
+            ledger = publish.Ledger(self.ledger_path)
+            stats = publish.run_node(self.sections, self.source, ledger,
+                'catalog', shards=6, node='node-a')
+            ledger.close()
+        finally:
+            publish.storage.iter_items = iter_items
+        self.assertEqual(stats['shards'], 6)
+        self.assertEqual(reads, [self.source])
+
+    def test_reset(self):
+        ledger = publish.Ledger(self.ledger_path)
+        stats = publish.run_node(self.sections, self.source, ledger,
+            'catalog', shards=2, node='node-a')
+        self.assertEqual(stats['items'], len(self.items))
+        # a finished run publishes nothing until it is reset
+        stats = publish.run_node(self.sections, self.source, ledger,
+            'catalog', shards=2, node='node-a')
+        self.assertEqual(stats['items'], 0)
+        self.assertEqual(ledger.reset('catalog'), 2)
+        self.assertEqual(set(s['position'] for s in ledger.status('catalog')),
+            set([0]))
+        stats = publish.run_node(self.sections, self.source, ledger,
+            'catalog', shards=2, node='node-a')
+        self.assertEqual(stats['items'], len(self.items))
+        self.assertEqual(ledger.reset('other'), 0)
+        ledger.close()
+        self._check_published()
+
+    def test_nodes(self):
+        results = {}
+
+        def _node(name):
+            ledger = publish.Ledger(self.ledger_path)
+            try:
+                results[name] = publish.run_node(self.sections, self.source,
+                    ledger, 'catalog', shards=6, node=name)
+            finally:
+                ledger.close()
+
+        threads = [threading.Thread(target=_node, args=('node-%d' % i,))
+            for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(r['shards'] for r in results.values()), 6)
+        self.assertEqual(sum(r['items'] for r in results.values()),
+            len(self.items))
+        ledger = publish.Ledger(self.ledger_path)
+        self.assertEqual(set(s['status'] for s in ledger.status('catalog')),
+            set(['done']))
+        ledger.close()
+        self._check_published()
+
+    def test_reclaim(self):
+        publish.CHECKPOINT_INTERVAL = 2
+        ledger = publish.Ledger(self.ledger_path)
+        ledger.create('catalog', 1)
+        items = publish.shard_items(self.items, 0, 1)
+
+        # a node checkpoints twice, then its lease runs out
+        shard, position, state = ledger.claim('catalog', 'node-a', lease=-1)
+        published = publish.publish_shard(self.sections, items[:5], ledger,
+            'catalog', shard, 'node-a', position, state, lease=-1)
+        self.assertEqual(published, 5)
+        self.assertEqual(ledger.status('catalog')[0]['position'], 4)
+
+        # another node resumes from the checkpoint
+        shard, position, state = ledger.claim('catalog', 'node-b')
+        self.assertEqual(position, 4)
+        self.assertEqual(len(state['assetHashes']), 4)
+        self.assertRaises(Exception, ledger.checkpoint, 'catalog', 0,
+            'node-a', 5, {})
+        published = publish.publish_shard(self.sections, items, ledger,
+            'catalog', shard, 'node-b', position, state)
+        self.assertEqual(published, len(items) - 4)
+        ledger.complete('catalog', shard, 'node-b')
+        self.assertEqual(ledger.claim('catalog', 'node-c'), None)
+        ledger.close()
+        self._check_published()
+
+    def test_failed_shard(self):
+        self.items.append({'id': 'other', 'type': 'Person'})
+        with open(self.source, 'w') as f:
+            json.dump(self.items, f)
+        ledger = publish.Ledger(self.ledger_path)
+        stats = publish.run_node(self.sections, self.source, ledger,
+            'catalog', shards=1, node='node-a')
+        self.assertEqual(stats['failed'], 1)
+        status = ledger.status('catalog')[0]
+        self.assertEqual(status['status'], 'pending')
+        self.assertTrue('not an asset or listing' in status['error'])
+        ledger.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import time
+import unittest
+
+import payswarm
+import payswarm.mock
+from payswarm import resilience
+
+class TestResilience(unittest.TestCase):
+
+    def setUp(self):
+        self.service = payswarm.mock.MockService().start()
+        self.url = self.service.url + 'client-config'
+        self.reset_timeout = resilience.RESET_TIMEOUT
+        resilience.clear()
+        payswarm.keys.clear()
+
+    def tearDown(self):
+        resilience.RESET_TIMEOUT = self.reset_timeout
+        resilience.clear()
+        payswarm.keys.clear()
+        self.service.stop()
+
+    def _host_stats(self):
+        return resilience.stats()[self.url.split('/')[2]]
+
+    def test_timeout(self):
+        self.service.latency = 0.5
+        start = time.time()
+        self.assertRaises(Exception, payswarm.util.request_raw, 'GET',
+            self.url, timeout=0.1)
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertEqual(self._host_stats()['failures'], 1)
+
+    def test_circuit(self):
+        resilience.RESET_TIMEOUT = 0.2
+        self.service.error_rate = 1
+        for i in range(resilience.FAILURE_THRESHOLD):
+            self.assertEqual(
+                payswarm.util.request_raw('GET', self.url).status, 503)
+        self.assertTrue(self._host_stats()['open'])
+
+        # fails fast without reaching the service
+        self.service.error_rate = 0
+        self.service.latency = 0.5
+        start = time.time()
+        self.assertRaises(Exception, payswarm.util.get, self.url)
+        self.assertTrue(time.time() - start < 0.1)
+        self.assertEqual(self._host_stats()['rejected'], 1)
+
+        # a successful trial request closes the circuit
+        self.service.latency = 0
+        time.sleep(0.25)
+        payswarm.util.get(self.url)
+        self.assertFalse(self._host_stats()['open'])
+
+    def test_stale_key(self):
+        key_id = self.service.add_key('test', 'PEM')
+        self.assertEqual(
+            payswarm.keys.get_public_key(key_id)['publicKeyPem'], 'PEM')
+        # expire the cached key and take the service down
+        expires, key = payswarm.keys._public_keys[key_id]
+        payswarm.keys._public_keys[key_id] = (time.time() - 1, key)
+        self.service.error_rate = 1
+        served = payswarm.keys.stale_stats['served']
+        self.assertEqual(payswarm.keys.get_public_key(key_id), key)
+        self.assertEqual(payswarm.keys.stale_stats['served'], served + 1)
+
+        # too old to use
+        payswarm.keys._public_keys[key_id] = (
+            time.time() - payswarm.keys.STALE_KEY_TTL - 1, key)
+        self.assertRaises(Exception, payswarm.keys.get_public_key, key_id)
+
+    def test_deleted_key_not_stale(self):
+        key_id = self.service.add_key('test', 'PEM')
+        payswarm.keys.get_public_key(key_id)
+        expires, key = payswarm.keys._public_keys[key_id]
+        payswarm.keys._public_keys[key_id] = (time.time() - 1, key)
+        # the authority no longer has the key
+        self.service.remove_document(key_id[len(self.service.url):])
+        served = payswarm.keys.stale_stats['served']
+        try:
+            payswarm.keys.get_public_key(key_id)
+            self.fail('A deleted key was served from the cache.')
+        except payswarm.util.HTTPError, e:
+            self.assertEqual(e.status, 404)
+        self.assertEqual(payswarm.keys.stale_stats['served'], served)
+
+    def test_hedge(self):
+        calls = []
+        def _fn():
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return 'slow'
+            return 'fast'
+        breaker = resilience.Breaker()
+        start = time.time()
+        self.assertEqual(breaker.hedge(_fn, 0.05), 'fast')
+        self.assertTrue(time.time() - start < 0.3)
+        self.assertEqual(breaker.hedge_stats, {'hedged': 1, 'won': 1})
+
+        # a failed hedge request does not hide a later success
+        def _fail():
+            calls.append(1)
+            if len(calls) % 2:
+                time.sleep(0.1)
+                return 'ok'
+            raise Exception('failed')
+        del calls[:]
+        self.assertEqual(breaker.hedge(_fail, 0.01), 'ok')
+
+    def test_hedged_get(self):
+        for i in range(resilience.HEDGE_MIN_SAMPLES):
+            payswarm.util.get(self.url)
+        self.assertTrue(resilience.breaker.hedge_delay(self.url) is not None)
+        self.assertTrue(payswarm.discovery.PSW_CONTRACTS in
+            payswarm.util.get(self.url, hedge=True))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import shutil
+import tempfile
+import unittest
+
+import payswarm
+import payswarm.mock
+
+class TestRevocation(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config_dir = os.environ.get('PAYSWARM_CONFIG_DIR')
+        os.environ['PAYSWARM_CONFIG_DIR'] = self.dir
+        self.service = payswarm.mock.MockService().start()
+        self.authority = self.service.url + 'i/'
+        self.service.add_document('keystatus', {
+            'authority': self.authority,
+            'revoked': [self.authority + 'bob/keys/1'],
+            'keys': [{
+                'id': self.authority + 'alice/keys/1',
+                'owner': self.authority + 'alice',
+                'publicKeyPem': 'PEM'
+            }]
+        })
+        payswarm.revocation.clear()
+        payswarm.keys.clear()
+
+    def tearDown(self):
+        payswarm.revocation.clear()
+        payswarm.keys.clear()
+        self.service.stop()
+        if self.config_dir is None:
+            del os.environ['PAYSWARM_CONFIG_DIR']
+        else:
+            os.environ['PAYSWARM_CONFIG_DIR'] = self.config_dir
+        shutil.rmtree(self.dir)
+
+    def test_bloom_filter(self):
+        digests = [payswarm.revocation._digest('key-%d' % i)
+            for i in range(1000)]
+        bloom = payswarm.revocation.BloomFilter.sized(len(digests))
+        for digest in digests[:500]:
+            bloom.add(digest)
+        for digest in digests[:500]:
+            self.assertTrue(digest in bloom)
+        false_positives = len([d for d in digests[500:] if d in bloom])
+        self.assertTrue(false_positives < 25)
+
+    def test_save_and_load(self):
+        path = os.path.join(self.dir, 'index')
+        index = payswarm.revocation.KeyStatusIndex(
+            ['http://a.example.com/keys/1', u'http://a.example.com/keys/\xe9'],
+            ['http://a.example.com/'],
+            [{'id': 'http://a.example.com/keys/2', 'publicKeyPem': 'PEM'}],
+            1234.5)
+        index.save(path)
+        loaded = payswarm.revocation.KeyStatusIndex.load(path)
+        self.assertEqual(loaded.synced, 1234.5)
+        self.assertEqual(loaded.revoked, index.revoked)
+        self.assertTrue(loaded.is_revoked(u'http://a.example.com/keys/\xe9'))
+        self.assertFalse(loaded.is_revoked('http://a.example.com/keys/2'))
+        self.assertTrue(loaded.is_trusted('http://a.example.com/keys/2'))
+        self.assertFalse(loaded.is_trusted('http://b.example.com/keys/1'))
+        self.assertEqual(loaded.get_key('http://a.example.com/keys/2'),
+            index.get_key('http://a.example.com/keys/2'))
+
+    def test_trusted_authority_boundary(self):
+        index = payswarm.revocation.KeyStatusIndex(
+            trusted=['https://a.example.com', 'https://b.example.com/i/'])
+        self.assertTrue(index.is_trusted('https://a.example.com/keys/1'))
+        self.assertTrue(index.is_trusted('https://A.example.com/keys/1'))
+        self.assertFalse(
+            index.is_trusted('https://a.example.com.evil.com/keys/1'))
+        self.assertFalse(index.is_trusted('https://a.example.com:8443/k'))
+        self.assertFalse(index.is_trusted('http://a.example.com/keys/1'))
+        self.assertTrue(index.is_trusted('https://b.example.com/i/bob/k'))
+        self.assertFalse(index.is_trusted('https://b.example.com/other/k'))
+
+    def _corrupt_index(self):
+        path = payswarm.revocation.default_path()
+        with open(path, 'wb') as f:
+            f.write('corrupt')
+        # make the change visible without waiting for RELOAD_INTERVAL
+        os.utime(path, (0, 0))
+        payswarm.revocation._loaded[3] = 0
+
+    def test_corrupt_index_fails_closed(self):
+        self._corrupt_index()
+        self.assertRaises(Exception, payswarm.revocation.get_index)
+        self.assertRaises(Exception, payswarm.keys.is_revoked,
+            self.authority + 'bob/keys/1')
+        # a later sync replaces it
+        payswarm.revocation.sync([self.service.url + 'keystatus'])
+        self.assertTrue(payswarm.keys.is_revoked(self.authority + 'bob/keys/1'))
+
+    def test_corrupt_index_keeps_last(self):
+        payswarm.revocation.sync([self.service.url + 'keystatus'])
+        index = payswarm.revocation.get_index()
+        self._corrupt_index()
+        self.assertTrue(payswarm.revocation.get_index() is index)
+        self.assertTrue(payswarm.keys.is_revoked(self.authority + 'bob/keys/1'))
+
+    def test_foreign_entries_ignored(self):
+        other = 'https://other.example.com/i/'
+        self.service.add_document('keystatus', {
+            'authority': self.authority,
+            'revoked': [self.authority + 'bob/keys/1', other + 'carol/keys/1'],
+            'keys': [{
+                'id': self.authority + 'alice/keys/1',
+                'publicKeyPem': 'PEM'
+            }, {
+                'id': other + 'dave/keys/1',
+                'publicKeyPem': 'FORGED'
+            }, {
+                'id': self.service.url + 'admin/keys/1',
+                'publicKeyPem': 'FORGED'
+            }]
+        })
+        index = payswarm.revocation.fetch([self.service.url + 'keystatus'])
+        self.assertTrue(index.is_revoked(self.authority + 'bob/keys/1'))
+        self.assertFalse(index.is_revoked(other + 'carol/keys/1'))
+        self.assertEqual(index.keys.keys(), [self.authority + 'alice/keys/1'])
+
+    def test_authority_on_other_host(self):
+        self.service.add_document('keystatus', {
+            'authority': 'https://other.example.com/i/',
+            'keys': [{
+                'id': 'https://other.example.com/i/dave/keys/1',
+                'publicKeyPem': 'FORGED'
+            }]
+        })
+        self.assertRaises(Exception, payswarm.revocation.fetch,
+            [self.service.url + 'keystatus'])
+
+    def test_load_truncated(self):
+        path = os.path.join(self.dir, 'index')
+        payswarm.revocation.KeyStatusIndex(['k']).save(path)
+        data = open(path, 'rb').read()
+        open(path, 'wb').write(data[:-1])
+        self.assertRaises(
+            Exception, payswarm.revocation.KeyStatusIndex.load, path)
+
+    def test_sync(self):
+        self.assertEqual(payswarm.revocation.get_index(), None)
+        payswarm.revocation.sync([self.service.url + 'keystatus'])
+        self.assertTrue(payswarm.keys.is_revoked(self.authority + 'bob/keys/1'))
+        self.assertFalse(
+            payswarm.keys.is_revoked(self.authority + 'alice/keys/1'))
+
+        # synced keys are served without fetching them
+        self.service.stop()
+        key = payswarm.keys.get_public_key(self.authority + 'alice/keys/1')
+        self.assertEqual(key['publicKeyPem'], 'PEM')
+        self.service = payswarm.mock.MockService().start()
+
+    def test_failed_sync_keeps_index(self):
+        payswarm.revocation.sync([self.service.url + 'keystatus'])
+        self.assertRaises(Exception, payswarm.revocation.sync,
+            [self.service.url + 'keystatus', self.service.url + 'missing'])
+        index = payswarm.revocation.get_index()
+        self.assertTrue(index.is_revoked(self.authority + 'bob/keys/1'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import threading
+import time
+import unittest
+
+import payswarm
+import payswarm.mock
+from payswarm import scheduler
+
+class TestScheduler(unittest.TestCase):
+
+    def test_rate(self):
+        s = scheduler.Scheduler(rate=50, burst=5)
+        start = time.time()
+        for i in range(15):
+            s.acquire('http://example.com/item')
+        # 5 go at once, the other 10 at 50 per second
+        self.assertTrue(time.time() - start >= 0.18)
+        stats = s.stats()['example.com']
+        self.assertEqual(stats['sent'], 15)
+        self.assertEqual(stats['queued']['default'], 0)
+
+    def test_unlimited(self):
+        s = scheduler.Scheduler(rate=None)
+        start = time.time()
+        for i in range(1000):
+            s.acquire('http://example.com/item')
+        self.assertTrue(time.time() - start < 1)
+
+    def test_default_unlimited(self):
+        s = scheduler.Scheduler()
+        start = time.time()
+        for i in range(1000):
+            s.acquire('http://example.com/item')
+        self.assertTrue(time.time() - start < 1)
+        # a configured host is limited
+        s.configure('example.com', rate=50, burst=1)
+        start = time.time()
+        for i in range(6):
+            s.acquire('http://example.com/item')
+        self.assertTrue(time.time() - start >= 0.08)
+
+    def test_priority(self):
+        s = scheduler.Scheduler(rate=20, burst=1)
+        s.acquire('http://example.com/')
+        order = []
+
+        def _request(priority, name):
+            s.acquire('http://example.com/', priority)
+            order.append(name)
+
+        threads = [threading.Thread(target=_request, args=args) for args in [
+            (scheduler.PUBLISH, 'publish-1'), (scheduler.PUBLISH, 'publish-2'),
+            (scheduler.KEY, 'key'), (scheduler.PURCHASE, 'purchase')]]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.005)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ['purchase', 'key', 'publish-1', 'publish-2'])
+        self.assertEqual(s.stats()['example.com']['max_queued'], 4)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(scheduler.parse_retry_after('120'), 120)
+        self.assertEqual(scheduler.parse_retry_after(None), None)
+        self.assertEqual(scheduler.parse_retry_after('soon'), None)
+        self.assertEqual(scheduler.parse_retry_after(
+            'Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+
+    def test_retry_after(self):
+        service = payswarm.mock.MockService().start()
+        service.error_rate = 1
+        service.retry_after = 1
+        try:
+            url = service.url + 'client-config'
+            self.assertEqual(payswarm.util.request_raw('GET', url).status, 503)
+            service.error_rate = 0
+            start = time.time()
+            self.assertEqual(payswarm.util.request_raw('GET', url).status, 200)
+            self.assertTrue(time.time() - start >= 0.9)
+            host = url.split('/')[2]
+            self.assertEqual(scheduler.stats()[host]['paused'], 1)
+        finally:
+            service.stop()
+
+if __name__ == '__main__':
+    unittest.main()
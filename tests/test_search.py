@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import calendar
+import shutil
+import tempfile
+import time
+import unittest
+
+import payswarm
+import payswarm.search
+
+BASE = 'http://example.com/'
+
+def _date(seconds):
+    return time.strftime(payswarm.storage.W3C_DATE_FORMAT,
+        time.gmtime(seconds))
+
+class TestSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'search.db')
+        now = time.time()
+        self.items = [{
+            'id': BASE + 'asset/%d' % i,
+            'type': 'Asset',
+            'title': ['Sunset photo', 'Mountain song', 'Ocean film'][i]
+        } for i in range(3)]
+        for i in range(12):
+            self.items.append({
+                'id': BASE + 'listing/%d' % i,
+                'type': ['gr:Offering', 'Listing'],
+                'vendor': BASE + 'i/vendor-%d' % (i % 2),
+                'asset': BASE + 'asset/%d' % (i % 3),
+                'license': BASE + 'license/%d' % (i % 4),
+                'validFrom': _date(now - 60),
+                'validUntil': _date(now + (60 if i < 10 else -30)),
+                'payee': [{
+                    'id': BASE + 'listing/%d#payee' % i,
+                    'type': 'Payee',
+                    'destination': BASE + 'i/vendor-%d/accounts/main' % (i % 2),
+                    'currency': 'USD',
+                    'payeeRate': '0.%02d' % (i * 2),
+                    'payeeRateType': 'FlatAmount',
+                    'comment': 'Payment for listing %d' % i
+                }],
+                'payeeRule': [{
+                    'type': 'PayeeRule',
+                    'payeeRateType': 'Percentage' if i % 3 == 0
+                        else 'FlatAmount'
+                }]
+            })
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _ids(self, listings):
+        return sorted(int(l['id'].rsplit('/', 1)[1]) for l in listings)
+
+    def test_filters(self):
+        with payswarm.search.Index(self.path) as index:
+            self.assertEqual(index.add_items(self.items), 15)
+            self.assertEqual(index.count(), (3, 12))
+            search = index.search
+            self.assertEqual(len(search()), 12)
+            self.assertEqual(self._ids(search(vendor=BASE + 'i/vendor-1')),
+                [1, 3, 5, 7, 9, 11])
+            self.assertEqual(self._ids(search(asset=BASE + 'asset/2')),
+                [2, 5, 8, 11])
+            self.assertEqual(self._ids(search(license=BASE + 'license/0')),
+                [0, 4, 8])
+            self.assertEqual(self._ids(search(
+                destination=BASE + 'i/vendor-0/accounts/main',
+                max_rate=0.10)), [0, 2, 4])
+            self.assertEqual(self._ids(search(currency='USD',
+                min_rate=0.10, max_rate=0.14)), [5, 6])
+            self.assertEqual(len(search(currency='EUR')), 0)
+            self.assertEqual(self._ids(search(rule_type='com:Percentage')),
+                [0, 3, 6, 9])
+            self.assertEqual(len(search(rate_type='FlatAmount')), 12)
+            self.assertEqual(self._ids(search(valid_at=time.time())),
+                range(10))
+            # listings by vendor X under 0.10 with a Percentage payee rule
+            self.assertEqual(self._ids(search(vendor=BASE + 'i/vendor-0',
+                currency='USD', max_rate=0.10, rule_type='Percentage')), [0])
+            self.assertEqual(len(search(limit=5)), 5)
+
+    def test_text(self):
+        with payswarm.search.Index(self.path) as index:
+            # listings indexed before their assets take the asset title
+            index.add_items(self.items[3:])
+            index.add_items(self.items[:3])
+            self.assertEqual(self._ids(index.search(text='mountain')),
+                [1, 4, 7, 10])
+            self.assertEqual(self._ids(index.search(text='listing 7')), [7])
+            self.assertEqual(self._ids(index.search(text='photo',
+                vendor=BASE + 'i/vendor-1')), [3, 9])
+
+    def test_replace(self):
+        with payswarm.search.Index(self.path) as index:
+            index.add_items(self.items)
+        listing = dict(self.items[6])
+        listing['payee'] = []
+        listing['title'] = 'Replaced'
+        with payswarm.search.Index(self.path) as index:
+            index.add_items([listing])
+            self.assertEqual(index.count(), (3, 12))
+            self.assertEqual(index.search(text='replaced'), [listing])
+            self.assertEqual(self._ids(index.search(rule_type='Percentage',
+                currency='USD')), [0, 6, 9])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,9 +4,14 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
 
 import json
+import shutil
+import tempfile
 import unittest
 
+from Crypto.PublicKey import RSA
+
 import payswarm
+import payswarm.mock
 import pyld
 
 class TestSignVerify(unittest.TestCase):
@@ -55,5 +60,67 @@ class TestSignVerify(unittest.TestCase):
         # signature still present
         self.assertTrue('signature' in signed)
 
+class TestVerifyCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config_dir = os.environ.get('PAYSWARM_CONFIG_DIR')
+        os.environ['PAYSWARM_CONFIG_DIR'] = self.dir
+        payswarm.revocation.clear()
+        payswarm.keys.clear()
+        payswarm.signature.clear_verified()
+        self.service = payswarm.mock.MockService().start()
+        key = RSA.generate(1024)
+        self.key_id = self.service.add_key(
+            'test', key.publickey().exportKey())
+        self.signed = payswarm.signature.sign({
+            '@context': payswarm.constants.CONTEXT_URL,
+            'id': 'http://example.com/asset#1',
+            'type': 'Asset',
+            'title': 'Test Asset'
+        }, self.key_id, key.exportKey())
+
+        # first verification is remembered, second is served from the cache
+        self.assertTrue(payswarm.signature.verify(self.signed))
+        self.assertEqual(len(payswarm.signature._verified), 1)
+        self.assertTrue(payswarm.signature.verify(self.signed))
+
+    def tearDown(self):
+        payswarm.revocation.clear()
+        payswarm.keys.clear()
+        payswarm.signature.clear_verified()
+        self.service.stop()
+        if self.config_dir is None:
+            del os.environ['PAYSWARM_CONFIG_DIR']
+        else:
+            os.environ['PAYSWARM_CONFIG_DIR'] = self.config_dir
+        shutil.rmtree(self.dir)
+
+    def _sync(self, revoked=(), trusted=()):
+        payswarm.revocation.KeyStatusIndex(revoked, trusted).save()
+        payswarm.revocation.clear()
+
+    def test_revoked_key(self):
+        # a revoked creator key invalidates the cached result
+        key = dict(payswarm.keys.get_public_key(self.key_id))
+        key['revoked'] = '2013-01-01T00:00:00Z'
+        payswarm.keys._public_keys[self.key_id] = (0, key)
+        with self.assertRaises(Exception):
+            payswarm.signature.verify(self.signed)
+        self.assertEqual(len(payswarm.signature._verified), 0)
+
+    def test_revoked_in_index(self):
+        self._sync(revoked=[self.key_id])
+        with self.assertRaises(Exception):
+            payswarm.signature.verify(self.signed)
+        self.assertEqual(len(payswarm.signature._verified), 0)
+
+    def test_untrusted_authority(self):
+        self._sync(trusted=['http://authority.example.com/'])
+        with self.assertRaises(Exception):
+            payswarm.signature.verify(self.signed)
+        self._sync(trusted=[self.service.url])
+        self.assertTrue(payswarm.signature.verify(self.signed))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import copy
+import shutil
+import tempfile
+import unittest
+
+from Crypto.PublicKey import RSA
+
+import payswarm
+import payswarm.mock
+
+class TestPopulate(unittest.TestCase):
+
+    def setUp(self):
+        key = RSA.generate(1024)
+        self.config = payswarm.config.storage_config({
+            'authority': 'https://authority.example.com/',
+            'owner': 'https://authority.example.com/i/vendor',
+            'source': 'https://authority.example.com/i/vendor/accounts/main',
+            'publicKey': {
+                'id': 'https://authority.example.com/i/vendor/keys/1',
+                'privateKeyPem': key.exportKey()
+            }
+        }, 'http://listings.example.com/')
+        self.items = []
+        for i in range(3):
+            self.items.append({
+                'id': 'asset/%d' % i,
+                'type': 'Asset',
+                'title': 'Asset %d' % i,
+                'creator': {'fullName': 'Creator'}
+            })
+            self.items.append({
+                'id': 'listing/%d' % i,
+                'type': ['gr:Offering', 'Listing'],
+                'asset': 'asset/%d' % i,
+                'com:payee': {
+                    'id': 'listing/%d#payee' % i,
+                    'com:destination': 'AUTOFILL'
+                }
+            })
+
+    def test_matches_single_item_populate(self):
+        original = copy.deepcopy(self.items)
+        asset = payswarm.storage.populate_asset(self.config, self.items[0])
+        asset.setdefault('@context', payswarm.constants.CONTEXT)
+        hashes = {asset['id']: payswarm.util.hash(asset)}
+        listing = payswarm.storage.populate_listing(
+            self.config, asset, self.items[1])
+        listing.setdefault('@context', payswarm.constants.CONTEXT)
+
+        populated = list(payswarm.storage.populate_items(
+            self.config, self.items[:2], hashes))
+        self.assertEqual(populated[0], asset)
+        for name in ['validFrom', 'validUntil']:
+            del listing[name]
+            del populated[1][name]
+        self.assertEqual(populated[1], listing)
+        self.assertEqual(self.items, original)
+
+    def test_pipeline(self):
+        hashes = {}
+        populated = payswarm.storage.populate_items(
+            self.config, self.items, hashes, now=0)
+        signed = list(payswarm.storage.sign_items(
+            self.config, populated, hashes))
+        self.assertEqual(len(signed), 6)
+        for asset, listing in zip(signed[::2], signed[1::2]):
+            self.assertTrue('signature' in asset)
+            self.assertEqual(listing['asset'], asset['id'])
+            self.assertEqual(listing['assetHash'], payswarm.util.hash(asset))
+            self.assertEqual(listing['validFrom'], '1970-01-01T00:00:00Z')
+            self.assertEqual(listing['validUntil'], '1970-01-02T00:00:00Z')
+            self.assertEqual(listing['com:payee']['com:destination'],
+                'https://authority.example.com/i/vendor/accounts/main')
+
+    def test_missing_asset(self):
+        populated = payswarm.storage.populate_items(
+            self.config, self.items[1:2])
+        self.assertRaises(Exception, list, populated)
+
+class TestSignedStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'signed')
+        self.service = payswarm.mock.MockService().start()
+        key = RSA.generate(1024)
+        self.session = {
+            'authority': self.service.url,
+            'owner': self.service.url + 'i/vendor',
+            'source': self.service.url + 'i/vendor/accounts/main',
+            'publicKey': {
+                'id': self.service.add_key('vendor', 'PEM'),
+                'privateKeyPem': key.exportKey()
+            }
+        }
+        self.config = payswarm.config.storage_config(
+            self.session, self.service.url)
+        self.asset = {'id': 'asset/1', 'type': 'Asset', 'title': 'Asset'}
+
+    def tearDown(self):
+        self.service.stop()
+        shutil.rmtree(self.dir)
+
+    def test_reuse(self):
+        store = payswarm.storage.SignedStore(self.path)
+        signed = payswarm.storage.register_asset(
+            self.config, self.asset, store=store)
+        received = self.service.bytes_received
+        self.assertEqual(payswarm.storage.register_asset(
+            self.config, self.asset, store=store), signed)
+        self.assertEqual(self.service.bytes_received, received)
+        self.assertEqual(store.stats, {'reused': 1, 'stored': 1})
+
+        # changed content is signed and uploaded again
+        changed = dict(self.asset, title='Changed')
+        self.assertNotEqual(payswarm.storage.register_asset(
+            self.config, changed, store=store)['title'], signed['title'])
+        self.assertTrue(self.service.bytes_received > received)
+        store.close()
+
+        # entries persist, but only for the key that signed them
+        store = payswarm.storage.SignedStore(self.path)
+        self.assertEqual(len(store.entries), 2)
+        asset_hash = [h for h, e in store.entries.items()
+            if e['signed']['title'] == 'Asset'][0]
+        self.assertEqual(store.get(
+            asset_hash, self.session['publicKey']['id']), signed)
+        self.assertEqual(store.get(asset_hash, 'other-key'), None)
+
+    def test_expiry(self):
+        store = payswarm.storage.SignedStore(self.path, ttl=0)
+        store.put('urn:sha256:1', 'key', {'id': 'asset'})
+        self.assertEqual(store.get('urn:sha256:1', 'key'), None)
+        store.close()
+        # expired entries are dropped from the file when it is loaded
+        payswarm.storage.SignedStore(self.path, ttl=0)
+        with open(self.path) as f:
+            self.assertEqual(f.read(), '')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import shutil
+import tempfile
+import time
+import unittest
+
+from Crypto.PublicKey import RSA
+
+import payswarm
+import payswarm.mock
+import payswarm.sync
+
+class TestSync(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.service = payswarm.mock.MockService().start()
+        key = RSA.generate(1024)
+        key_id = self.service.add_key('test', key.publickey().exportKey())
+        self.sections = payswarm.config.storage_config({
+            'authority': self.service.url,
+            'owner': self.service.url + 'i/test',
+            'publicKey': {'id': key_id, 'privateKeyPem': key.exportKey()}
+        }, self.service.url)
+        self.items = [{
+            '@context': payswarm.constants.CONTEXT_URL,
+            'id': 'example/asset',
+            'type': 'Asset',
+            'title': 'Test Asset'
+        }, {
+            '@context': payswarm.constants.CONTEXT_URL,
+            'id': 'example/listing',
+            'type': ['gr:Offering', 'Listing'],
+            'asset': 'example/asset'
+        }]
+        self.path = os.path.join(self.dir, 'manifest.json')
+
+    def tearDown(self):
+        self.service.stop()
+        shutil.rmtree(self.dir)
+
+    def _sync(self, **kwargs):
+        return payswarm.sync.sync(self.sections, self.items,
+            payswarm.sync.Manifest(self.path), **kwargs)
+
+    def test_only_changed(self):
+        self.assertEqual(self._sync()['uploaded'], 2)
+        self.assertEqual(self._sync(),
+            {'uploaded': 0, 'unchanged': 2, 'deleted': 0})
+
+        # a changed asset also republishes its listing
+        self.items[0]['title'] = 'Changed Asset'
+        self.assertEqual(self._sync()['uploaded'], 2)
+
+        self.items[1]['comment'] = 'Changed Listing'
+        self.assertEqual(self._sync()['uploaded'], 1)
+
+    def test_renew_expiring(self):
+        self._sync()
+        self.assertEqual(self._sync()['uploaded'], 0)
+        # an unchanged listing is republished before it expires
+        later = time.time() + payswarm.storage.LISTING_VALIDITY - \
+            payswarm.sync.RENEW_BEFORE
+        stats = self._sync(now=later)
+        self.assertEqual((stats['uploaded'], stats['unchanged']), (1, 1))
+        listing = self.service.get_document('example/listing')
+        manifest = payswarm.sync.Manifest(self.path)
+        self.assertEqual(manifest.items['example/listing']['validUntil'],
+            listing['validUntil'])
+
+    def test_delete_and_check_remote(self):
+        self._sync()
+        self.service.remove_document('example/asset')
+        self.assertTrue(self._sync(check_remote=True)['uploaded'] >= 1)
+        self.assertNotEqual(self.service.get_document('example/asset'), None)
+
+        del self.items[1]
+        self.assertEqual(self._sync(delete=True)['deleted'], 1)
+        self.assertEqual(self.service.get_document('example/listing'), None)
+
+    def test_resume(self):
+        # an interrupted sync leaves a journal instead of a saved manifest
+        manifest = payswarm.sync.Manifest(self.path)
+        manifest.record({'id': 'example/asset',
+            'digest': payswarm.sync.digest(self.items[0], self.service.url),
+            'assetHash': None})
+        manifest.record({'id': 'example/listing',
+            'digest': payswarm.sync.digest(self.items[1], self.service.url),
+            'assetHash': None, 'validUntil': '2100-01-01T00:00:00Z'})
+        self.assertEqual(self._sync()['uploaded'], 0)
+        self.assertFalse(os.path.exists(self.path + '.journal'))
+
+if __name__ == '__main__':
+    unittest.main()
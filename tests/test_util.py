@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import hashlib
+import threading
+import time
+import unittest
+
+import payswarm
+import payswarm.mock
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.flight = payswarm.util.SingleFlight()
+        self.calls = []
+        self.release = threading.Event()
+
+    def _slow(self, value):
+        self.calls.append(value)
+        self.release.wait(5)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def _run(self, value, count, timeout=None):
+        results = []
+        def _call():
+            try:
+                results.append(
+                    self.flight.do('key', self._slow, (value,), timeout))
+            except Exception, e:
+                results.append(e)
+        threads = [threading.Thread(target=_call) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesce(self):
+        results = self._run('value', 10)
+        self.assertEqual(results, ['value'] * 10)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.flight.stats['coalesced'], 9)
+
+    def test_errors(self):
+        error = ValueError('failed')
+        results = self._run(error, 5)
+        self.assertEqual(results, [error] * 5)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.flight.stats['errors'], 1)
+
+    def test_timeout(self):
+        self.release.clear()
+        results = self._run('value', 3, timeout=0.01)
+        self.assertEqual(self.flight.stats['timeouts'], 2)
+        self.assertEqual(results.count('value'), 1)
+
+    def test_interrupted(self):
+        def _interrupt():
+            raise KeyboardInterrupt()
+        self.assertRaises(KeyboardInterrupt, self.flight.do, 'key', _interrupt)
+        # the key is no longer in flight
+        self.release.set()
+        self.assertEqual(self.flight.do('key', self._slow, ('a',), 1), 'a')
+
+    def test_sequential_calls(self):
+        self.release.set()
+        self.flight.do('key', self._slow, ('a',))
+        self.flight.do('key', self._slow, ('b',))
+        self.assertEqual(self.calls, ['a', 'b'])
+
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.service = payswarm.mock.MockService().start()
+        self.transport = dict(payswarm.util.TRANSPORT)
+        self.doc = {'id': 'http://example.com/1', 'title': u'caf\xe9'}
+
+    def tearDown(self):
+        payswarm.util.TRANSPORT.update(self.transport)
+        self.service.stop()
+
+    def test_compact(self):
+        self.assertEqual(payswarm.util.serialize({'b': 1, 'a': [1, 2]}),
+            '{"a":[1,2],"b":1}')
+
+    def test_gzip_upload(self):
+        for gzip in (False, True):
+            payswarm.util.TRANSPORT['gzip'] = gzip
+            payswarm.util.upload(self.service.url + 'doc', self.doc)
+            self.assertEqual(
+                payswarm.util.get(self.service.url + 'doc'), self.doc)
+
+class TestContexts(unittest.TestCase):
+
+    def setUp(self):
+        self.service = payswarm.mock.MockService(latency=0.3).start()
+        self.service.add_document('outer', {'@context': [
+            self.service.url + 'inner', {'b': 'http://example.com/b'}]})
+        self.service.add_document('inner',
+            {'@context': {'a': 'http://example.com/a'}})
+        self.service.add_document('other',
+            {'@context': {'c': 'http://example.com/c'}})
+
+    def tearDown(self):
+        self.service.stop()
+        for path in ('outer', 'inner', 'other'):
+            payswarm.util._documents.pop(self.service.url + path, None)
+
+    def test_preload_nested(self):
+        payswarm.util.preload_contexts({'@context': [
+            payswarm.constants.CONTEXT_URL, self.service.url + 'outer']})
+        for path in ('outer', 'inner'):
+            self.assertTrue(
+                self.service.url + path in payswarm.util._documents)
+
+    def test_fetches_overlap(self):
+        # remote contexts are fetched outside jsonld_lock, so two documents
+        # with slow contexts are normalized in about one fetch time
+        docs = [{'@context': self.service.url + 'inner', 'a': 'x'},
+            {'@context': self.service.url + 'other', 'c': 'y'}]
+        results = []
+        threads = [threading.Thread(target=lambda doc=doc:
+            results.append(payswarm.util.normalize(doc))) for doc in docs]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(time.time() - start < 0.55)
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all('http://example.com/' in r for r in results))
+
+class TestDigest(unittest.TestCase):
+
+    def setUp(self):
+        self.chunk_size = payswarm.util.DIGEST_CHUNK_SIZE
+        payswarm.util.DIGEST_CHUNK_SIZE = 7
+
+    def tearDown(self):
+        payswarm.util.DIGEST_CHUNK_SIZE = self.chunk_size
+
+    def test_chunked_utf8(self):
+        text = u'<a> <b> "caf\xe9 \u2116%d" .\n' * 10
+        for data in (text, text.encode('utf-8')):
+            h = payswarm.util.update_digest(hashlib.sha256(), data)
+            self.assertEqual(h.hexdigest(),
+                hashlib.sha256(text.encode('utf-8')).hexdigest())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import argparse
+import json
+import shutil
+import tempfile
+import unittest
+
+from Crypto.PublicKey import RSA
+
+import payswarm
+import payswarm.mock
+import payswarm.warmup
+
+class TestWarmup(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config_dir = os.environ.get('PAYSWARM_CONFIG_DIR')
+        os.environ['PAYSWARM_CONFIG_DIR'] = self.dir
+        payswarm.revocation.clear()
+        self.service = payswarm.mock.MockService().start()
+        self.key_ids = [self.service.add_key('key-%d' % i,
+            RSA.generate(1024).publickey().exportKey()) for i in range(3)]
+        self.context_url = self.service.url + 'contexts/test'
+        self.service.add_document('contexts/test',
+            {'@context': {'title': 'http://purl.org/dc/terms/title'}})
+        self.items = [{
+            '@context': [payswarm.constants.CONTEXT_URL, self.context_url],
+            'id': 'http://example.com/asset/%d' % i,
+            'type': 'Asset',
+            'signature': {
+                'type': 'GraphSignature2012',
+                'creator': self.key_ids[i % 2]
+            }
+        } for i in range(4)]
+        payswarm.keys.clear()
+        payswarm.frames.clear()
+
+    def tearDown(self):
+        self.service.stop()
+        if self.config_dir is None:
+            del os.environ['PAYSWARM_CONFIG_DIR']
+        else:
+            os.environ['PAYSWARM_CONFIG_DIR'] = self.config_dir
+        payswarm.revocation.clear()
+        shutil.rmtree(self.dir)
+        payswarm.keys.clear()
+        payswarm.frames.clear()
+        payswarm.util._documents.pop(self.context_url, None)
+
+    def _write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(data)
+        return path
+
+    def test_warmup(self):
+        report = payswarm.warmup.warmup(self.items, [self.key_ids[2]], jobs=4)
+        self.assertEqual(report.errors, [])
+        self.assertEqual(report.keys, 3)
+        self.assertEqual(report.contexts, 1)
+        self.assertEqual(report.frames, len(payswarm.constants.FRAMES))
+        self.assertEqual(report.loaded, 4 + len(payswarm.constants.FRAMES))
+        for key_id in self.key_ids:
+            self.assertTrue(key_id in payswarm.keys._public_keys)
+        self.assertTrue(self.context_url in payswarm.util._documents)
+        self.assertEqual(len(payswarm.frames._named),
+            len(payswarm.constants.FRAMES))
+
+    def test_revoked_keys_skipped(self):
+        payswarm.revocation.KeyStatusIndex([self.key_ids[0]]).save()
+        report = payswarm.warmup.warmup([], self.key_ids)
+        self.assertEqual(report.errors, [])
+        self.assertEqual(report.keys, 2)
+        self.assertFalse(self.key_ids[0] in payswarm.keys._public_keys)
+
+    def test_errors(self):
+        missing = self.service.url + 'keys/missing'
+        report = payswarm.warmup.warmup([], [missing])
+        self.assertEqual([e[0] for e in report.errors], [missing])
+
+    def test_sources(self):
+        catalog = self._write('items.jsonld', json.dumps(self.items[:1]))
+        keys = self._write('keys.txt',
+            '# creators\n%s\n\n%s  # second\n' % tuple(self.key_ids[1:]))
+        traffic = self._write('traffic.jsonl', '\n'.join([
+            json.dumps({'id': 1, 'method': 'verify',
+                'params': {'jsonld': self.items[1]}}),
+            'not json',
+            json.dumps(self.items[2])]))
+        self.assertEqual(payswarm.warmup.read_key_ids(keys), self.key_ids[1:])
+
+        parser = argparse.ArgumentParser()
+        payswarm.warmup.add_source_arguments(parser)
+        args = parser.parse_args(['--catalog', catalog, '--keys', keys,
+            '--traffic', traffic])
+        self.assertTrue(payswarm.warmup.has_sources(args))
+        report = payswarm.warmup.run_from_args(args)
+        self.assertEqual(report.errors, [])
+        self.assertEqual(report.keys, 3)
+        self.assertEqual(report.contexts, 1)
+
+if __name__ == '__main__':
+    unittest.main()